@@ -11,6 +11,8 @@ import glob
 import shutil
 import urllib.request
 import urllib.error
+import py_compile
+import importlib.util
 
 def OCLSP_FindClient():
     lsp_config = OCLSP_GetOriginLSPConfigJsonPath()
@@ -169,6 +171,17 @@ def OCLSP_GetOrignPythonPath():
     origin_python_path = os.path.join(origin_python_dll_path, "python.exe")
     return origin_python_path
 
+def OCLSP_CompileProxy(oclsp_py_path):
+    # Origin's Python would compile OCLSP.py at every start if it ran the script,
+    # so it is run with -OO -m OCLSP from the bytecode compiled here instead
+    cfile = importlib.util.cache_from_source(oclsp_py_path, optimization=2)
+    try:
+        py_compile.compile(oclsp_py_path, cfile=cfile, doraise=True, optimize=2)
+    except (py_compile.PyCompileError, OSError) as e:
+        OCLSP_Print("Failed to compile OCLSP.py:", e)
+        return False
+    return True
+
 def OCLSP_UpdateLSPWithCpptools(cpptools_path):
     uff = op.path()
     lsp_json_path = OCLSP_GetOriginLSPConfigJsonPath()
@@ -184,7 +197,8 @@ def OCLSP_UpdateLSPWithCpptools(cpptools_path):
         lsp_data = {}
     if "LSPList" not in lsp_data or not isinstance(lsp_data["LSPList"], list):
         lsp_data["LSPList"] = []
-    oclsp_py_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "OCLSP.py")
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    oclsp_py_path = os.path.join(app_dir, "OCLSP.py")
 
     # Look for an existing LSP entry with Lang = 1 (Origin C)
     existing_entry = None
@@ -194,6 +208,13 @@ def OCLSP_UpdateLSPWithCpptools(cpptools_path):
             break
     oclsp_py_path_quote = f'"{oclsp_py_path}"'
     cpptools_path_quote = f'"{cpptools_path}"'
+    python_paths = OCLSP_GetOriginPythonLibPaths()
+    if OCLSP_CompileProxy(oclsp_py_path):
+        # Found through PYTHONPATH, a stale bytecode file is recompiled if OCLSP.py is edited
+        proxy_arg = ["-OO", "-m", "OCLSP"]
+        python_paths = [app_dir] + python_paths
+    else:
+        proxy_arg = [oclsp_py_path_quote]
 
     config_json_path = os.path.join(OCLSP_GetOriginAppPath(), "OCLSP.json")
 
@@ -204,11 +225,11 @@ def OCLSP_UpdateLSPWithCpptools(cpptools_path):
             "ipc": "stdio",
             "process": {
                 "exe": OCLSP_GetOrignPythonPath(),
-                "arg": [oclsp_py_path_quote, cpptools_path_quote],
+                "arg": proxy_arg + [cpptools_path_quote],
                 # uncomment this so that errors can be captured
                 #"redirStdOut": True,
                 "env" : {
-                    "PYTHONPATH": ";".join(OCLSP_GetOriginPythonLibPaths()),
+                    "PYTHONPATH": ";".join(python_paths),
                     "PYTHONHOME": OCLSP_GetOriginPythonDLLPath(),
                     "OCLSP_TRACE": False,
                     "OCLSP_LOG": False,
@@ -1,16 +1,24 @@
+# Only what is needed before cpptools is started is imported here; pathlib,
+# ctypes, traceback and the like are imported where they're used
 import os
 import sys
 import subprocess
 import threading
-import json
+import re
 import itertools
+import bisect
+import collections
+import collections.abc
+import functools
 import queue
 import time
-import traceback
-import ctypes
-from pathlib import Path
+import types
+# Already loaded by re
 from enum import IntEnum
 
+# Start of the startup timeline, see _report_startup
+_PROXY_START = time.perf_counter()
+
 _enable_log = False
 _enable_trace = False
 _enable_cpptools_trace = False
@@ -29,227 +37,654 @@ _CPPTOOLS_PATH = ""
 # Global state for shutdown and synchronization
 _shutdown_event = threading.Event()
 _shutdown_lock = threading.Lock()
+# Called by trigger_shutdown, e.g. to wake the asyncio engine's event loop
+_shutdown_callbacks = []
 _cpptools_process = None
 _server_stdin_lock = threading.Lock()
 _client_stdout_lock = threading.Lock()
 _log_lock = None
 _log_lock_lazy_store = {}
 
+###############################################################################
+# JSON codec
+###############################################################################
+
+def _make_json_codec(name):
+    """
+    Return (name, loads, dumps) for a JSON backend, or None if it can't be
+    imported. loads() accepts str, bytes, bytearray and memoryview; dumps()
+    returns compact UTF-8 bytes.
+    """
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            return None
+        # orjson parses any buffer directly and always emits compact output
+        return name, orjson.loads, orjson.dumps
+
+    if name == "ujson":
+        try:
+            import ujson
+        except ImportError:
+            return None
+
+        def ujson_loads(data):
+            if isinstance(data, memoryview):
+                data = bytes(data)
+            return ujson.loads(data)
+
+        def ujson_dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+
+        return name, ujson_loads, ujson_dumps
+
+    if name == "json":
+        import json
+        decode = json.loads
+        encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+        def std_loads(data):
+            if isinstance(data, memoryview):
+                data = bytes(data)
+            return decode(data)
+
+        def std_dumps(obj):
+            return encoder.encode(obj).encode("utf-8")
+
+        return name, std_loads, std_dumps
+
+    return None
+
+_JSON_BACKENDS = ("orjson", "ujson", "json")
+
+def _select_json_codec():
+    # OCLSP_JSON forces a backend, e.g. to compare them or work around a bug
+    preferred = os.environ.get("OCLSP_JSON", "").strip().lower()
+    names = (preferred,) + _JSON_BACKENDS if preferred else _JSON_BACKENDS
+    for name in names:
+        codec = _make_json_codec(name)
+        if codec is not None:
+            return codec
+    return _make_json_codec("json")
+
+# Selected on first use: importing a backend (even the stdlib json package)
+# before cpptools is started would add to Origin's wait for it
+_JSON_BACKEND = None
+_json_codec_lock = threading.Lock()
+
+def _json_backend():
+    """Name of the JSON backend, binding json_loads and json_dumps to it on the first call."""
+    global _JSON_BACKEND, json_loads, json_dumps
+    with _json_codec_lock:
+        if _JSON_BACKEND is None:
+            _JSON_BACKEND, json_loads, json_dumps = _select_json_codec()
+    return _JSON_BACKEND
+
+def json_loads(data):
+    _json_backend()
+    return json_loads(data)
+
+def json_dumps(obj):
+    _json_backend()
+    return json_dumps(obj)
+
 def get_log_lock():
     global _log_lock
     if _log_lock is None:
         _log_lock = _log_lock_lazy_store.setdefault("lock", threading.Lock())
     return _log_lock
 
-def get_oclsp_config():
-    global _GLOBAL_OCLSP_CONFIG
-    if _GLOBAL_OCLSP_CONFIG is None:
-        # Load Global Config
-        global_config = {}
-        if _GLOBAL_OCLSP_CONFIG_JSON_PATH and os.path.isfile(_GLOBAL_OCLSP_CONFIG_JSON_PATH):
-            try:
-                with open(_GLOBAL_OCLSP_CONFIG_JSON_PATH, "r", encoding="utf-8") as f:
-                    global_config = json.load(f)
-            except Exception as e:
-                _trace_log(f"Error reading global config {_GLOBAL_OCLSP_CONFIG_JSON_PATH}: {e}")
-                global_config = {}
-        
-        # Load User Config (Versioned)
-        user_config = {}
-        if _CUR_VER_OCLSP_CONFIG_JSON_PATH and os.path.isfile(_CUR_VER_OCLSP_CONFIG_JSON_PATH):
+# How often the sweep looks at the config files' mtimes
+_CONFIG_CHECK_INTERVAL = 2.0
+_config_lock = threading.Lock()
+# path -> _ConfigFile
+_config_files = {}
+
+class _ConfigFile:
+    """One config file's parsed content, re-read only when its mtime or size changes."""
+    __slots__ = ("path", "stamp", "data")
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.data = None
+
+    def refresh(self):
+        """Re-read the file if it changed since the last call. Returns True if its content did."""
+        try:
+            st = os.stat(self.path) if self.path else None
+        except OSError:
+            st = None
+        stamp = (st.st_mtime_ns, st.st_size) if st is not None else None
+        if self.data is not None and stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        data = {}
+        if stamp is not None:
             try:
-                with open(_CUR_VER_OCLSP_CONFIG_JSON_PATH, "r", encoding="utf-8") as f:
-                    user_config = json.load(f)
+                with open(self.path, "rb") as f:
+                    data = json_loads(f.read())
             except Exception as e:
-                _trace_log(f"Error reading user config {_CUR_VER_OCLSP_CONFIG_JSON_PATH}: {e}")
-                user_config = {}
+                _trace_log("Error reading config %s: %s", self.path, e, level=LOG_WARNING)
+                if self.data is not None:
+                    # Most likely caught halfway through being saved, keep the
+                    # last good content until the file changes again
+                    return False
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+        changed = data != self.data
+        self.data = data
+        return changed
 
-        # Merge Configs
-        # Start with global config
-        _GLOBAL_OCLSP_CONFIG = global_config.copy()
-        
-        # Update with user config (scalars overwrite)
-        for key, value in user_config.items():
-            if key not in ["workspaceFolders", "additionalIncludePath"]:
-                _GLOBAL_OCLSP_CONFIG[key] = value
-
-        # Smart Merge: workspaceFolders
-        # We want to merge workspace entries by matching URI (path).
-        # If a workspace exists in both, we merge their properties (e.g. combine includePath).
-        wf_global = global_config.get("workspaceFolders", [])
-        wf_user = user_config.get("workspaceFolders", [])
-        if not isinstance(wf_global, list): wf_global = []
-        if not isinstance(wf_user, list): wf_user = []
-
-        # Map normalized URI -> workspace dict
-        wf_map = {}
-
-        def normalize_wf_uri(folder_item):
-            uri = folder_item.get("uri", "")
-            # Normalize to lower case for key matching
-            return uri.strip().lower()
-
-        # 1. Add Global Workspaces
-        for wf in wf_global:
-            if isinstance(wf, dict):
-                key = normalize_wf_uri(wf)
-                if key:
-                    # Deep copy to avoid mutating original global config if needed
-                    wf_map[key] = json.loads(json.dumps(wf))
-
-        # 2. Merge User Workspaces
-        for wf in wf_user:
-            if isinstance(wf, dict):
-                key = normalize_wf_uri(wf)
-                if not key:
-                    continue
-                
-                if key in wf_map:
-                    # Exists in global, merge it
-                    existing = wf_map[key]
-                    
-                    # Merge includePath lists
-                    existing_inc = existing.get("includePath", [])
-                    new_inc = wf.get("includePath", [])
-                    if not isinstance(existing_inc, list): existing_inc = []
-                    if not isinstance(new_inc, list): new_inc = []
-                    
-                    # Combine and deduplicate include paths
-                    # Use a set for deduplication, preserving order if possible
-                    merged_inc = []
-                    seen_inc = set()
-                    for p in (existing_inc + new_inc):
-                        if p and p not in seen_inc:
-                            merged_inc.append(p)
-                            seen_inc.add(p)
-                    existing["includePath"] = merged_inc
-
-                    # Overwrite other scalar properties from user config (e.g. name)
-                    for k, v in wf.items():
-                        if k != "includePath":
-                            existing[k] = v
-                else:
-                    # New workspace, just add it
-                    wf_map[key] = json.loads(json.dumps(wf))
-        
-        # 3. Inject Default Workspaces (XFC, AppXFC) if missing
-        default_wfs = []
-        if _ORGDIR_EXE:
-            default_wfs.append({"name": "XFC", "path": os.path.join(_ORGDIR_EXE, "XFC")})
-        if _ORGDIR_USER_APPDATA:
-            default_wfs.append({"name": "AppXFC", "path": os.path.join(_ORGDIR_USER_APPDATA, "TMP", "OriginC", "X-Functions")})
-            
-        for item in default_wfs:
-            try:
-                uri_str = item["path"]
-                key = uri_str.strip().lower()
-                if key not in wf_map:
-                    wf_map[key] = {
-                        "uri": uri_str,
-                        "name": item["name"]
-                    }
-            except Exception:
-                pass
+def _freeze_config(value):
+    """Read-only view of parsed JSON: dicts become MappingProxyType, lists tuples."""
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: _freeze_config(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze_config(v) for v in value)
+    return value
 
-        _GLOBAL_OCLSP_CONFIG["workspaceFolders"] = list(wf_map.values())
+def get_oclsp_config():
+    """
+    The merged OCLSP.json + OCLSP_User.json, as a read-only mapping (lists are
+    tuples). _check_config swaps in a new one when the files change, so hold on
+    to the result only for the duration of one message.
+    """
+    config = _GLOBAL_OCLSP_CONFIG
+    if config is None:
+        _reload_oclsp_config()
+        config = _GLOBAL_OCLSP_CONFIG
+    return config
 
-        # Smart Merge: additionalIncludePath
-        # Concatenate and deduplicate
-        inc_global = global_config.get("additionalIncludePath", [])
-        inc_user = user_config.get("additionalIncludePath", [])
-        if not isinstance(inc_global, list): inc_global = []
-        if not isinstance(inc_user, list): inc_user = []
-        
-        merged_additional_inc = []
-        seen_additional_inc = set()
-        for p in (inc_global + inc_user):
-            if p and p not in seen_additional_inc:
-                merged_additional_inc.append(p)
-                seen_additional_inc.add(p)
-                
-        _GLOBAL_OCLSP_CONFIG["additionalIncludePath"] = merged_additional_inc
+def _reload_oclsp_config():
+    """Re-merge the config if either file changed. Returns the previous view if the result differs."""
+    global _GLOBAL_OCLSP_CONFIG
+    with _config_lock:
+        files = []
+        for path in (_GLOBAL_OCLSP_CONFIG_JSON_PATH, _CUR_VER_OCLSP_CONFIG_JSON_PATH):
+            config_file = _config_files.get(path)
+            if config_file is None:
+                config_file = _config_files[path] = _ConfigFile(path)
+            files.append(config_file)
+        changed = False
+        for config_file in files:
+            changed |= config_file.refresh()
+        old = _GLOBAL_OCLSP_CONFIG
+        if old is not None and not changed:
+            return None
+        new = _merge_oclsp_config(files[0].data, files[1].data)
+        if new == old:
+            return None
+        _GLOBAL_OCLSP_CONFIG = new
+        return old
+
+def _merge_oclsp_config(global_config, user_config):
+    # Both are the files' cached content, they are only read here
+    # Start with global config
+    merged = global_config.copy()
+
+    # Update with user config (scalars overwrite)
+    for key, value in user_config.items():
+        if key not in ["workspaceFolders", "additionalIncludePath"]:
+            merged[key] = value
+
+    # Smart Merge: workspaceFolders
+    # We want to merge workspace entries by matching URI (path).
+    # If a workspace exists in both, we merge their properties (e.g. combine includePath).
+    wf_global = global_config.get("workspaceFolders", [])
+    wf_user = user_config.get("workspaceFolders", [])
+    if not isinstance(wf_global, list): wf_global = []
+    if not isinstance(wf_user, list): wf_user = []
+
+    # Map normalized URI -> workspace dict
+    wf_map = {}
+
+    def normalize_wf_uri(folder_item):
+        uri = folder_item.get("uri", "")
+        # Normalize to lower case for key matching
+        return uri.strip().lower()
+
+    # 1. Add Global Workspaces
+    for wf in wf_global:
+        if isinstance(wf, dict):
+            key = normalize_wf_uri(wf)
+            if key:
+                # Only top-level keys are replaced below, a shallow copy keeps
+                # the cached file content intact
+                wf_map[key] = dict(wf)
+
+    # 2. Merge User Workspaces
+    for wf in wf_user:
+        if isinstance(wf, dict):
+            key = normalize_wf_uri(wf)
+            if not key:
+                continue
+
+            if key in wf_map:
+                # Exists in global, merge it
+                existing = wf_map[key]
 
-    return _GLOBAL_OCLSP_CONFIG
+                # Merge includePath lists
+                existing_inc = existing.get("includePath", [])
+                new_inc = wf.get("includePath", [])
+                if not isinstance(existing_inc, list): existing_inc = []
+                if not isinstance(new_inc, list): new_inc = []
+
+                # Combine and deduplicate include paths
+                # Use a set for deduplication, preserving order if possible
+                merged_inc = []
+                seen_inc = set()
+                for p in (existing_inc + new_inc):
+                    if p and p not in seen_inc:
+                        merged_inc.append(p)
+                        seen_inc.add(p)
+                existing["includePath"] = merged_inc
+
+                # Overwrite other scalar properties from user config (e.g. name)
+                for k, v in wf.items():
+                    if k != "includePath":
+                        existing[k] = v
+            else:
+                # New workspace, just add it
+                wf_map[key] = dict(wf)
+
+    # 3. Inject Default Workspaces (XFC, AppXFC) if missing
+    default_wfs = []
+    if _ORGDIR_EXE:
+        default_wfs.append({"name": "XFC", "path": os.path.join(_ORGDIR_EXE, "XFC")})
+    if _ORGDIR_USER_APPDATA:
+        default_wfs.append({"name": "AppXFC", "path": os.path.join(_ORGDIR_USER_APPDATA, "TMP", "OriginC", "X-Functions")})
+
+    for item in default_wfs:
+        try:
+            uri_str = item["path"]
+            key = uri_str.strip().lower()
+            if key not in wf_map:
+                wf_map[key] = {
+                    "uri": uri_str,
+                    "name": item["name"]
+                }
+        except Exception:
+            pass
+
+    merged["workspaceFolders"] = list(wf_map.values())
+
+    # Smart Merge: additionalIncludePath
+    # Concatenate and deduplicate
+    inc_global = global_config.get("additionalIncludePath", [])
+    inc_user = user_config.get("additionalIncludePath", [])
+    if not isinstance(inc_global, list): inc_global = []
+    if not isinstance(inc_user, list): inc_user = []
+
+    merged_additional_inc = []
+    seen_additional_inc = set()
+    for p in (inc_global + inc_user):
+        if p and p not in seen_additional_inc:
+            merged_additional_inc.append(p)
+            seen_additional_inc.add(p)
+
+    merged["additionalIncludePath"] = merged_additional_inc
+
+    return _freeze_config(merged)
+
+# (config view, {name: validated number}), started over when the view is swapped
+_config_numbers = (None, {})
+
+def _checked_number(name, value, default, integer=False):
+    """`value` if it is a non-negative number (an int if `integer`), otherwise `default` with a warning."""
+    if (isinstance(value, bool) or not isinstance(value, int if integer else (int, float))
+            or not value >= 0):
+        _trace_log("%s: expected a non-negative %s, got %r; using %s",
+                   name, "integer" if integer else "number", value, default, level=LOG_WARNING)
+        return default
+    return value
+
+def _config_numbers_view():
+    """The current config and its cache of validated numbers."""
+    global _config_numbers
+    config = get_oclsp_config()
+    checked, numbers = _config_numbers
+    if checked is not config:
+        numbers = {}
+        _config_numbers = (config, numbers)
+    return config, numbers
+
+def _config_number(name, default, integer=False):
+    """
+    A numeric setting from OCLSP.json, validated once per config. A value of
+    the wrong type falls back to `default` rather than raising in whichever
+    thread reads it first.
+    """
+    config, numbers = _config_numbers_view()
+    value = numbers.get(name)
+    if value is None:
+        value = numbers[name] = _checked_number(name, config.get(name, default), default, integer)
+    return value
 
 ###############################################################################
 # LSP framing (binary-safe)
 ###############################################################################
 
-def read_exactly(stream, n):
-    """
-    Read exactly n bytes from stream.
-    Returns bytes, or None if EOF is hit before n bytes are read.
+class LspFrameReader:
     """
-    data = b""
-    while len(data) < n:
-        chunk = stream.read(n - len(data))
-        if not chunk:
-            return None
-        data += chunk
-    return data
+    Incremental LSP frame parser over a binary stream.
 
-def read_lsp_message(stream, from_lsp_server):
-    """
-    Read exactly one LSP message from stream.
-    Returns raw JSON bytes, or None on EOF.
+    Reads large blocks into a reusable bytearray and locates the header
+    terminator in place, so a message costs one or two syscalls instead of
+    one per header line, and bodies are never rebuilt by concatenation.
+
+    read_message() returns the body as a memoryview into the internal buffer.
+    The view is only valid until the next call to read_message().
     """
-    while True:
-        # Check shutdown before blocking read (though readline might still block)
-        if _shutdown_event.is_set():
-            return None
+    CHUNK_SIZE = 64 * 1024
+    # Buffers grown beyond this for a huge message are dropped once drained
+    MAX_IDLE_CAPACITY = 1024 * 1024
+    MAX_HEADER_SIZE = 64 * 1024
 
-        headers = {}
-        while True:
-            # readline on binary stream includes \n
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buf = bytearray(chunk_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        # Read from the raw stream, one syscall returns whatever is available.
+        # BufferedReader.readinto1 can't be used: once it has handed out
+        # buffered bytes, a request larger than its own buffer still blocks
+        # in a raw read (CPython 3.11), stalling a frame that straddles the
+        # end of ours. Nothing must have been read through the buffer yet.
+        raw = getattr(stream, "raw", None)
+        self._readinto = raw.readinto if raw is not None else stream.readinto
+
+    def _reserve(self, needed):
+        """Make room for at least `needed` unread bytes in the buffer."""
+        pending = self._end - self._start
+        capacity = len(self._buf)
+        if needed <= capacity and (self._start > 0 or pending == 0):
+            if pending == 0 and capacity > self.MAX_IDLE_CAPACITY:
+                self._buf = bytearray(max(self._chunk_size, needed))
+                self._view = memoryview(self._buf)
+            elif pending:
+                # Same-size slice assignment, allowed even while views exist
+                self._buf[0:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+            return
+        if needed > capacity:
+            # Allocate a new buffer rather than resizing: a caller may still
+            # hold a view into the old one, which would make resizing fail.
+            new_buf = bytearray(max(needed, capacity * 2))
+            new_buf[0:pending] = self._view[self._start:self._end]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+            self._start = 0
+            self._end = pending
+
+    def _fill(self, needed):
+        """
+        Read until at least `needed` bytes are buffered past _start.
+        Returns False on EOF.
+        """
+        while self._end - self._start < needed:
+            if self._end == len(self._buf) or self._start + needed > len(self._buf):
+                self._reserve(max(needed, self._end - self._start + 1))
             try:
-                line = stream.readline()
+                n = self._readinto(self._view[self._end:])
             except (ValueError, OSError):
+                return False
+            if not n:
+                return False
+            self._end += n
+        return True
+
+    def read_message(self):
+        """
+        Read exactly one LSP message.
+        Returns the body as a memoryview, or None on EOF.
+        """
+        while True:
+            if _shutdown_event.is_set():
                 return None
 
-            if not line:
+            header_end = self._buf.find(b"\r\n\r\n", self._start, self._end)
+            if header_end < 0:
+                if self._end - self._start > self.MAX_HEADER_SIZE:
+                    # Garbage without a header terminator, drop it
+                    self._start = self._end
+                if not self._fill(self._end - self._start + 1):
+                    return None
+                continue
+
+            length = None
+            for line in bytes(self._view[self._start:header_end]).split(b"\r\n"):
+                key, sep, value = line.partition(b":")
+                if sep and key.strip().lower() == b"content-length":
+                    try:
+                        length = int(value)
+                    except ValueError:
+                        length = None
+
+            body_start = header_end + 4
+            self._start = body_start
+            if length is None:
+                continue
+
+            if not self._fill(length):
                 return None
-            
-            # Decode carefully. LSP headers are ASCII.
-            line_str = line.decode("ascii", errors="replace").strip()
-            
-            if line_str == "":
-                break
-            
-            if ":" in line_str:
-                key, value = line_str.split(":", 1)
-                headers[key.lower()] = value.strip()
+            body_start = self._start
+            self._start = body_start + length
+            return self._view[body_start:self._start]
 
-        length_str = headers.get("content-length")
-        if length_str is None:
-            continue
 
-        try:
-            length = int(length_str)
-        except ValueError:
-            continue
-        
-        body = read_exactly(stream, length)
-        if body is None or len(body) != length:
+###############################################################################
+# Byte-level fast path
+###############################################################################
+
+_WS = rb"[ \t\r\n]*"
+_JSON_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_OBJECT_START_RE = re.compile(_WS + rb"\{")
+_KEY_RE = re.compile(_WS + rb"(" + _JSON_STRING + rb")" + _WS + rb":" + _WS)
+_STRING_RE = re.compile(_JSON_STRING)
+_STRUCTURAL_RE = re.compile(rb'[\[\]{}"]')
+_SCALAR_END_RE = re.compile(_WS + rb"[,}\]]")
+_MEMBER_END_RE = re.compile(_WS + rb"([,}])")
+
+def _skip_json_value(body, pos):
+    """
+    Return the offset just past the JSON value starting at `pos`, or -1.
+    Strings are skipped by a single regex match, so multi-megabyte text
+    payloads are never walked in Python.
+    """
+    first = body[pos]
+    if first == 0x22:  # '"'
+        m = _STRING_RE.match(body, pos)
+        return m.end() if m else -1
+    if first == 0x7B or first == 0x5B:  # '{' or '['
+        depth = 0
+        while True:
+            m = _STRUCTURAL_RE.search(body, pos)
+            if not m:
+                return -1
+            c = body[m.start()]
+            if c == 0x22:
+                sm = _STRING_RE.match(body, m.start())
+                if not sm:
+                    return -1
+                pos = sm.end()
+                continue
+            pos = m.end()
+            if c == 0x7B or c == 0x5B:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+    m = _SCALAR_END_RE.search(body, pos)
+    return m.start() if m else -1
+
+# Notifications per the LSP spec never carry an id, so once one of these
+# methods is seen the scan can stop before walking a multi-megabyte params.
+_NOTIFICATION_METHODS = frozenset((
+    "initialized",
+    "exit",
+    "$/cancelRequest",
+    "$/progress",
+    "$/setTrace",
+    "$/logTrace",
+    "textDocument/didOpen",
+    "textDocument/didChange",
+    "textDocument/didSave",
+    "textDocument/didClose",
+    "textDocument/publishDiagnostics",
+    "workspace/didChangeConfiguration",
+    "workspace/didChangeWatchedFiles",
+    "workspace/didChangeWorkspaceFolders",
+    "window/logMessage",
+    "window/showMessage",
+    "telemetry/event",
+))
+
+class RawMessage:
+    """
+    An undecoded message body plus what the proxy needs to route it:
+    its top-level method and id, located in place by scan_envelope().
+    The writer splices a replacement id in without re-encoding the body.
+    """
+    __slots__ = ("body", "method", "id", "id_span", "is_response", "is_error", "_id_bytes")
+
+    def __init__(self, body, method, msg_id, id_span, is_response, is_error=False):
+        self.body = body
+        self.method = method
+        self.id = msg_id
+        self.id_span = id_span
+        self.is_response = is_response
+        self.is_error = is_error
+        self._id_bytes = None
+
+    def replace_id(self, new_id):
+        self.id = new_id
+        self._id_bytes = json_dumps(new_id)
+
+    def parts(self):
+        if self._id_bytes is None:
+            return (self.body,)
+        start, end = self.id_span
+        return (self.body[:start], self._id_bytes, self.body[end:])
+
+def scan_envelope(body):
+    """
+    Read the top-level "method" and "id" of a JSON-RPC body straight from the
+    bytes. Returns a RawMessage, or None if the body is not a JSON object the
+    scanner understands (the caller then falls back to a full parse).
+    """
+    try:
+        m = _OBJECT_START_RE.match(body)
+        if not m:
             return None
-            
-        return body
+        pos = m.end()
+        method = None
+        id_span = None
+        is_response = False
+        is_error = False
+        while True:
+            km = _KEY_RE.match(body, pos)
+            if not km:
+                # Empty object or malformed input
+                return None
+            key = km.group(1)
+            value_start = km.end()
+            if key == b'"result"' or key == b'"error"':
+                is_response = True
+                is_error = key == b'"error"'
+                if id_span is not None:
+                    # Don't walk the (possibly huge) result just to skip it
+                    break
+            value_end = _skip_json_value(body, value_start)
+            if value_end < 0:
+                return None
+            if key == b'"method"':
+                method = json_loads(body[value_start:value_end])
+            elif key == b'"id"':
+                id_span = (value_start, value_end)
+            if id_span is not None and (method is not None or is_response):
+                # A request or a response, the remaining members don't matter
+                break
+            if method in _NOTIFICATION_METHODS:
+                break
+            em = _MEMBER_END_RE.match(body, value_end)
+            if not em:
+                return None
+            if em.group(1) == b"}":
+                break
+            pos = em.end()
+        msg_id = None
+        if id_span is not None:
+            msg_id = json_loads(body[id_span[0]:id_span[1]])
+        return RawMessage(body, method, msg_id, id_span, is_response, is_error)
+    except (ValueError, IndexError):
+        return None
 
+###############################################################################
+# LSP writing
+###############################################################################
 
-def write_lsp_message(stream, body_bytes, to_lsp_server, lock=None):
+def encode_lsp_body(payload):
+    """
+    Serialize a message object for the wire.
+    Raw bytes-like bodies (passthrough) are returned unchanged.
+    """
+    if isinstance(payload, (dict, list)):
+        return json_dumps(payload)
+    return payload
+
+# Bodies above this size are written part by part instead of being joined
+_JOIN_WRITE_LIMIT = 64 * 1024
+
+def _write_all(stream, data):
+    # Raw (unbuffered) pipes may accept only part of a large write
+    view = memoryview(data)
+    while view:
+        n = stream.write(view)
+        if n is None or n >= len(view):
+            break
+        view = view[n:]
+
+def write_lsp_message(stream, payload, to_lsp_server, lock=None):
+    """
+    Write one LSP message. `payload` is a message object, which is
+    serialized here (the only place it happens), a RawMessage, whose id is
+    spliced in place, or raw body bytes.
+    """
     if _shutdown_event.is_set():
         return
 
-    header = f"Content-Length: {len(body_bytes)}\r\n\r\n"
-    data = header.encode("ascii") + body_bytes
-    
+    if isinstance(payload, RawMessage):
+        parts = payload.parts()
+    else:
+        parts = (encode_lsp_body(payload),)
+    length = sum(len(p) for p in parts)
+    _count_traffic("toServer" if to_lsp_server else "toOrigin", length)
+    if _capture is not None:
+        _capture_frame("toServer" if to_lsp_server else "toOrigin", *parts)
+    header = f"Content-Length: {length}\r\n\r\n".encode("ascii")
+    if length <= _JOIN_WRITE_LIMIT:
+        # Parts may be memoryviews from LspFrameReader, join accepts both
+        chunks = (b"".join((header,) + parts),)
+    else:
+        chunks = (header,) + parts
+
     try:
         if lock:
-            with lock:
-                stream.write(data)
-                stream.flush()
-        else:
-            stream.write(data)
+            lock.acquire()
+        try:
+            for chunk in chunks:
+                _write_all(stream, chunk)
             stream.flush()
+        finally:
+            if lock:
+                lock.release()
     except (BrokenPipeError, OSError):
         # If pipe is broken, we probably should shut down
         trigger_shutdown("Write failed (BrokenPipe)")
@@ -261,23 +696,698 @@ def send_notification(stream, method, params, to_lsp_server, lock=None):
         "method": method,
         "params": params
     }
-    body = json.dumps(msg).encode("utf-8")
-    write_lsp_message(stream, body, to_lsp_server, lock)
+    write_lsp_message(stream, msg, to_lsp_server, lock)
+
+###############################################################################
+# Metrics
+###############################################################################
+
+# Upper bounds (ms) of the latency histogram buckets, the last bucket is open
+_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+class _LatencyStats:
+    """Call count, error count and latency histogram of one method."""
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(_LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, seconds, error=False):
+        ms = seconds * 1000
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.buckets[bisect.bisect_left(_LATENCY_BUCKETS_MS, ms)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket the given fraction of calls falls into."""
+        target = fraction * self.count
+        seen = 0
+        for bound, n in zip(_LATENCY_BUCKETS_MS, self.buckets):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self):
+        labels = [f"<={bound}ms" for bound in _LATENCY_BUCKETS_MS] + [f">{_LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "meanMs": round(self.total_ms / self.count, 3) if self.count else 0,
+            "maxMs": round(self.max_ms, 3),
+            "p50Ms": round(self.percentile(0.5), 3),
+            "p90Ms": round(self.percentile(0.9), 3),
+            "p99Ms": round(self.percentile(0.99), 3),
+            "histogram": {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+_metrics_lock = threading.Lock()
+_metrics_started = time.time()
+# Method sent to cpptools -> time from reading the request from Origin to
+# having its reply ready for Origin
+_request_latency = {}
+# Time spent in the proxy's own hooks: Origin method -> request hook,
+# cpptools method -> reply hook
+_origin_handler_time = {}
+_server_handler_time = {}
+# Origin method -> requests the proxy answered itself (caches, cancellation)
+_answered_locally = {}
+# direction -> [messages, body bytes]
+_traffic = {
+    "fromOrigin": [0, 0],
+    "toServer": [0, 0],
+    "fromServer": [0, 0],
+    "toOrigin": [0, 0],
+}
+
+def _count_traffic(direction, size):
+    with _metrics_lock:
+        entry = _traffic[direction]
+        entry[0] += 1
+        entry[1] += size
+
+def _add_latency(table, method, seconds, error=False):
+    with _metrics_lock:
+        stats = table.get(method)
+        if stats is None:
+            stats = table[method] = _LatencyStats()
+        stats.add(seconds, error)
+
+def _count_answered_locally(method):
+    with _metrics_lock:
+        _answered_locally[method] = _answered_locally.get(method, 0) + 1
+
+def _metrics_snapshot():
+    with _metrics_lock:
+        snapshot = {
+            "uptimeSeconds": round(time.time() - _metrics_started, 1),
+            "jsonBackend": _json_backend(),
+            "traffic": {direction: {"messages": n, "bytes": size} for direction, (n, size) in _traffic.items()},
+            "requests": {method: stats.snapshot() for method, stats in _request_latency.items()},
+            "originHandlers": {method: stats.snapshot() for method, stats in _origin_handler_time.items()},
+            "serverHandlers": {method: stats.snapshot() for method, stats in _server_handler_time.items()},
+            "answeredLocally": dict(_answered_locally),
+        }
+    snapshot["pendingRequests"] = _request_table.stats()
+    snapshot["cpptoolsRestarts"] = _restart_count
+    if _daemon:
+        snapshot["sessions"] = [session.name for session in _all_sessions()]
+    snapshot["caches"] = {
+        "completion": dict(_completion_cache_stats, documents=len(_completion_cache)),
+        "hover": dict(_hover_cache_stats, entries=len(_hover_cache)),
+        "documentSymbols": {"documents": len(_document_symbol_cache)},
+        "symbolIndex": dict(_symbol_index_stats, symbols=_symbol_index.count if _symbol_index else 0,
+                            cpptoolsReady=not _cpptools_cold()),
+    }
+    with _startup_lock:
+        snapshot["startup"] = dict(_startup_steps)
+    if _prewarm_stats:
+        snapshot["prewarm"] = dict(_prewarm_stats)
+    snapshot["incrementalSync"] = dict(_incremental_sync_stats, enabled=bool(_incremental_sync_enabled()))
+    return snapshot
+
+# Name of the file _dump_metrics writes in the OCLSP folder, None for none
+_stats_file = "oclsp_stats.json"
+
+def _dump_metrics():
+    """Write the final metrics next to the log, for a look after Origin exits."""
+    if not _DATASTORAGE_DIR or not _stats_file:
+        return
+    path = os.path.join(_DATASTORAGE_DIR, "OCLSP", _stats_file)
+    try:
+        with open(path, "wb") as f:
+            f.write(json_dumps(_metrics_snapshot()))
+    except Exception as e:
+        _trace_log("Error writing %s: %s", path, e, level=LOG_WARNING)
+
+###############################################################################
+# Startup timeline
+###############################################################################
+
+# Most recent startups kept in startup_history.jsonl
+_STARTUP_HISTORY_MAX = 200
+
+# Step name -> seconds since _PROXY_START, the first time it happened
+_startup_steps = {}
+_startup_lock = threading.Lock()
+# Set by the first completion, later steps aren't recorded
+_startup_reported = False
+# serverInfo from cpptools' initialize result, to tell its versions apart
+_startup_server_info = None
+
+def _mark_startup(step):
+    """Record when `step` first happened, until the first completion ends the timeline."""
+    if _startup_reported:
+        return
+    elapsed = time.perf_counter() - _PROXY_START
+    with _startup_lock:
+        _startup_steps.setdefault(step, elapsed)
+
+def _process_age():
+    """Seconds since the OS started this process, None if it can't tell."""
+    try:
+        if sys.platform == "win32":
+            import ctypes.wintypes
+            created, exited, kernel, user = (ctypes.wintypes.FILETIME() for _ in range(4))
+            if not ctypes.windll.kernel32.GetProcessTimes(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                          ctypes.byref(created), ctypes.byref(exited),
+                                                          ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            # 100 ns intervals since 1601
+            ticks = (created.dwHighDateTime << 32) | created.dwLowDateTime
+            return time.time() - (ticks - 116444736000000000) / 1e7
+        with open("/proc/self/stat", "rb") as f:
+            # Fields after the parenthesized command name, starttime is the 22nd overall
+            start_ticks = int(f.read().rpartition(b")")[2].split()[19])
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _report_startup():
+    """End the timeline: tell Origin's log how startup went and add it to the history."""
+    global _startup_reported
+    with _startup_lock:
+        if _startup_reported:
+            return
+        _startup_steps.setdefault("first completion", time.perf_counter() - _PROXY_START)
+        _startup_reported = True
+        steps = dict(_startup_steps)
+    # Measured from the process launch when the OS tells, so interpreter startup counts too
+    age = _process_age()
+    launch = max(0.0, age - (time.perf_counter() - _PROXY_START)) if age is not None else 0.0
+    timeline = {"proxy start": round(launch, 3)}
+    timeline.update((step, round(launch + elapsed, 3)) for step, elapsed in sorted(steps.items(), key=lambda item: item[1]))
+    summary = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timeline.items())
+    origin = "launch" if age is not None else "proxy start"
+    _trace_log("[Startup] %s", summary, level=LOG_INFO)
+    send_to_client({
+        "jsonrpc": "2.0",
+        "method": "window/logMessage",
+        "params": {"type": 4, "message": f"OCLSP startup, since {origin}: {summary}"},
+    })
+    _append_startup_history({
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "originVersion": _ORG_VERSION,
+        "cpptools": _CPPTOOLS_PATH,
+        "serverInfo": _startup_server_info,
+        "since": origin,
+        "steps": timeline,
+    })
+
+def _append_startup_history(entry):
+    if not _DATASTORAGE_DIR:
+        return
+    path = os.path.join(_DATASTORAGE_DIR, "OCLSP", "startup_history.jsonl")
+    try:
+        try:
+            with open(path, "rb") as f:
+                lines = [line for line in f.read().splitlines() if line.strip()]
+        except FileNotFoundError:
+            lines = []
+        lines = lines[-(_STARTUP_HISTORY_MAX - 1):] + [json_dumps(entry)]
+        with open(path, "wb") as f:
+            f.write(b"\n".join(lines) + b"\n")
+    except OSError as e:
+        _trace_log("Error writing %s: %s", path, e, level=LOG_WARNING)
 
 ###############################################################################
 # Proxy request ID management
 ###############################################################################
 
 _proxy_id_gen = itertools.count(start=1)
-_pending_proxy_requests = set()
-_id_map_cpptools_to_client = {}
+
+class _PendingRequest:
+    """A request sent to cpptools that hasn't been answered yet."""
+    __slots__ = ("cpptools_id", "client_id", "session", "method", "context", "sent", "deadline")
+
+    def __init__(self, cpptools_id, client_id, method, context, timeout, received=None, session=None):
+        self.cpptools_id = cpptools_id
+        # None for requests injected by the proxy itself
+        self.client_id = client_id
+        # The Origin session the reply goes to, None with client_id
+        self.session = session
+        self.method = method
+        self.context = context
+        # When Origin's request was read, on the time.perf_counter() clock
+        self.sent = received if received is not None else time.perf_counter()
+        self.deadline = self.sent + timeout if timeout else None
+
+class _RequestTable:
+    """
+    In-flight requests to cpptools, indexed by cpptools id and by Origin's id
+    (with its session, ids of different Origins attached to the shared daemon
+    overlap). The size is capped: adding past the cap evicts the oldest request. Evicted
+    and overdue requests are handed out by take_expired() so the caller can
+    answer Origin and tell cpptools to stop.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_cpptools_id = {}
+        self._by_client_id = {}
+        self._evicted = []
+        self.peak = 0
+        self.timed_out = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._by_cpptools_id)
+
+    def add(self, record, max_size):
+        with self._lock:
+            self._by_cpptools_id[record.cpptools_id] = record
+            if record.client_id is not None:
+                self._by_client_id[(record.session, record.client_id)] = record.cpptools_id
+            # Ids are handed out in order, so the first entry is the oldest
+            while max_size and len(self._by_cpptools_id) > max_size:
+                oldest = self._by_cpptools_id.pop(next(iter(self._by_cpptools_id)))
+                self._unlink_client(oldest)
+                self._evicted.append(oldest)
+                self.evicted += 1
+            self.peak = max(self.peak, len(self._by_cpptools_id))
+
+    def pop(self, cpptools_id):
+        with self._lock:
+            record = self._by_cpptools_id.pop(cpptools_id, None)
+            if record is not None:
+                self._unlink_client(record)
+            return record
+
+    def pop_client(self, session, client_id):
+        with self._lock:
+            cpptools_id = self._by_client_id.pop((session, client_id), None)
+            if cpptools_id is None:
+                return None
+            return self._by_cpptools_id.pop(cpptools_id, None)
+
+    def take_expired(self, now):
+        """Remove and return (record, reason) for evicted and overdue requests."""
+        with self._lock:
+            expired = [(record, "evicted") for record in self._evicted]
+            self._evicted = []
+            overdue = [record for record in self._by_cpptools_id.values()
+                       if record.deadline is not None and record.deadline <= now]
+            for record in overdue:
+                del self._by_cpptools_id[record.cpptools_id]
+                self._unlink_client(record)
+                expired.append((record, "timed out"))
+            self.timed_out += len(overdue)
+            return expired
+
+    def take_all(self):
+        """Remove and return every request not answered yet, e.g. when cpptools is gone."""
+        with self._lock:
+            records = self._evicted + list(self._by_cpptools_id.values())
+            self._evicted = []
+            self._by_cpptools_id.clear()
+            self._by_client_id.clear()
+            return records
+
+    def take_session(self, session):
+        """Remove and return the requests of an Origin that detached from the shared daemon."""
+        with self._lock:
+            records = [record for record in self._by_cpptools_id.values() if record.session is session]
+            for record in records:
+                del self._by_cpptools_id[record.cpptools_id]
+                self._unlink_client(record)
+            return records
+
+    def stats(self):
+        return {"pending": len(self), "peak": self.peak, "timedOut": self.timed_out, "evicted": self.evicted}
+
+    def _unlink_client(self, record):
+        key = (record.session, record.client_id)
+        if record.client_id is not None and self._by_client_id.get(key) == record.cpptools_id:
+            del self._by_client_id[key]
+
+_request_table = _RequestTable()
+
+# Seconds cpptools gets to answer, by the method sent to cpptools (0 = no limit).
+# Overridden per method by "requestTimeouts" in OCLSP.json.
+_DEFAULT_REQUEST_TIMEOUTS = {
+    "default": 60,
+    "initialize": 0,
+    "cpptools/initialize": 0,
+    "cpptools/didChangeCppProperties": 0,
+    "shutdown": 0,
+    "cpptools/hover": 15,
+    "textDocument/completion": 15,
+    "textDocument/signatureHelp": 15,
+    "cpptools/findAllReferences": 300,
+}
+_DEFAULT_MAX_PENDING_REQUESTS = 1024
+# How often overdue requests are looked for
+_REQUEST_SWEEP_INTERVAL = 1.0
+# Messages from Origin the asyncio engine holds while cpptools isn't reading
+# its stdin; beyond that it stops reading Origin's
+_ASYNC_ORIGIN_BACKLOG = 64
+
+def _request_timeout(method):
+    config, numbers = _config_numbers_view()
+    key = "requestTimeouts." + method
+    timeout = numbers.get(key)
+    if timeout is not None:
+        return timeout
+    timeout = _DEFAULT_REQUEST_TIMEOUTS.get(method, _DEFAULT_REQUEST_TIMEOUTS["default"])
+    timeouts = config.get("requestTimeouts")
+    if isinstance(timeouts, collections.abc.Mapping):
+        if method in timeouts:
+            timeout = _checked_number(key, timeouts[method], timeout)
+        elif method not in _DEFAULT_REQUEST_TIMEOUTS and "default" in timeouts:
+            timeout = _checked_number("requestTimeouts.default", timeouts["default"], timeout)
+    elif timeouts is not None:
+        _trace_log("requestTimeouts: expected an object, got %r; using the defaults", timeouts, level=LOG_WARNING)
+    numbers[key] = timeout
+    return timeout
+
+def _track_request(cpptools_id, client_id, method, context=None, received=None, timeout=None):
+    session = _current_session() if client_id is not None else None
+    if timeout is None:
+        timeout = _request_timeout(method)
+    record = _PendingRequest(cpptools_id, client_id, method, context, timeout, received, session)
+    _request_table.add(record, _config_number("maxPendingRequests", _DEFAULT_MAX_PENDING_REQUESTS, integer=True))
+
+# Origin hooks may stash proxy-only state for the response hook under this key.
+# forward_to_lsp_server pops it before serializing, so cpptools never sees it.
+_CONTEXT_KEY = "__oclsp_context"
+
+###############################################################################
+# Origin sessions
+###############################################################################
+
+# Origin's stdout, set by main()
+_client_out = None
+
+class _StdioSession:
+    """The Origin that started this process, on stdin/stdout."""
+    name = "stdio"
+
+    def __init__(self):
+        self.documents = set()
+
+    def send(self, payload):
+        write_lsp_message(_client_out, payload, to_lsp_server=False, lock=_client_stdout_lock)
+
+class _PipeSession:
+    """
+    An Origin attached to the shared daemon (OCLSP_SHARED) through its own
+    OCLSP.py. Each message body is one message on the connection, no framing.
+    """
+    def __init__(self, conn, name):
+        self.name = name
+        # uris this Origin has open, the daemon opens a document in cpptools once
+        self.documents = set()
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    def recv(self):
+        return self._conn.recv_bytes()
+
+    def send(self, payload):
+        if isinstance(payload, RawMessage):
+            body = b"".join(payload.parts())
+        else:
+            body = encode_lsp_body(payload)
+        _count_traffic("toOrigin", len(body))
+        try:
+            with self._lock:
+                self._conn.send_bytes(body)
+        except (OSError, ValueError):
+            # Gone, its reader ends the session
+            pass
+
+    def close(self):
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+
+_stdio_session = _StdioSession()
+# Set when this process is the shared daemon
+_daemon = False
+# Sessions attached to the daemon, oldest first
+_sessions = []
+_sessions_lock = threading.Lock()
+# The session whose message is being handled on this thread
+_session_local = threading.local()
+
+def _current_session():
+    return getattr(_session_local, "session", None) or _stdio_session
+
+def _primary_session():
+    """Where cpptools' own requests and notifications go: the oldest Origin, None if none is attached."""
+    if not _daemon:
+        return _stdio_session
+    with _sessions_lock:
+        return _sessions[0] if _sessions else None
+
+def _all_sessions():
+    if not _daemon:
+        return [_stdio_session]
+    with _sessions_lock:
+        return list(_sessions)
+
+def send_to_client(payload):
+    """Write a message to the Origin being handled, e.g. a reply answered by the proxy itself."""
+    _current_session().send(payload)
+
+def _broadcast(payload):
+    for session in _all_sessions():
+        session.send(payload)
+
+def _make_response(client_id, result):
+    return {"jsonrpc": "2.0", "id": client_id, "result": result}
+
+# JSON-RPC / LSP error codes
+REQUEST_CANCELLED = -32800
+# Clients retry the request or drop it without bothering the user
+CONTENT_MODIFIED = -32801
+REQUEST_FAILED = -32803
+
+def _make_error_response(client_id, code, message):
+    return {"jsonrpc": "2.0", "id": client_id, "error": {"code": code, "message": message}}
+
+###############################################################################
+# Open documents
+###############################################################################
+
+class _OpenDocument:
+    """Proxy-side copy of a document Origin has open, kept in sync from didOpen/didChange."""
+    __slots__ = ("uri", "language_id", "version", "text", "_line_starts")
+
+    def __init__(self, uri, language_id, version, text):
+        self.uri = uri
+        self.language_id = language_id
+        self.version = version
+        self.text = text
+        self._line_starts = None
+
+    def line_starts(self):
+        if self._line_starts is None:
+            starts = [0]
+            starts.extend(m.end() for m in _NEWLINE_RE.finditer(self.text))
+            self._line_starts = starts
+        return self._line_starts
+
+    def line_text(self, line):
+        starts = self.line_starts()
+        if line < 0 or line >= len(starts):
+            return ""
+        end = starts[line + 1] - 1 if line + 1 < len(starts) else len(self.text)
+        return self.text[starts[line]:end].rstrip("\r")
+
+    def offset_at(self, position):
+        """Offset in self.text of an LSP position (UTF-16 character units)."""
+        starts = self.line_starts()
+        line = position.get("line", 0)
+        if line >= len(starts):
+            return len(self.text)
+        if line < 0:
+            return 0
+        return starts[line] + _utf16_col_to_index(self.line_text(line), position.get("character", 0))
+
+    def position_at(self, offset):
+        """LSP position (UTF-16 character units) of an offset in self.text."""
+        if self._line_starts is not None:
+            line = bisect.bisect_right(self._line_starts, offset) - 1
+            line_start = self._line_starts[line]
+        else:
+            # Counting is much cheaper than building the line index of a big
+            # document that is about to change again
+            line = self.text.count("\n", 0, offset)
+            line_start = self.text.rfind("\n", 0, offset) + 1
+        prefix = self.text[line_start:offset]
+        character = len(prefix) if prefix.isascii() else len(prefix.encode("utf-16-le")) // 2
+        return {"line": line, "character": character}
+
+    def apply_change(self, change):
+        change_range = change.get("range")
+        new_text = change.get("text", "")
+        if change_range is None:
+            self.text = new_text
+        else:
+            start = self.offset_at(change_range["start"])
+            end = self.offset_at(change_range["end"])
+            self.text = self.text[:start] + new_text + self.text[end:]
+        self._line_starts = None
+
+_NEWLINE_RE = re.compile("\n")
+_open_documents = {}
+
+def _common_prefix_length(a, b, limit):
+    # Bisect on slice comparisons, each one runs in C
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _common_suffix_length(a, b, limit):
+    len_a, len_b = len(a), len(b)
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len_a - mid:len_a - lo] == b[len_b - mid:len_b - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _text_edit(old, new):
+    """
+    The single replacement turning `old` into `new`, as (start, old end, new
+    end) offsets: old[start:old end] becomes new[start:new end].
+    """
+    limit = min(len(old), len(new))
+    start = _common_prefix_length(old, new, limit)
+    suffix = _common_suffix_length(old, new, limit - start)
+    old_end, new_end = len(old) - suffix, len(new) - suffix
+    # A position between \r and \n is ambiguous, keep the pair out of the edges
+    if start and old[start - 1] == "\r":
+        start -= 1
+    if old_end and old[old_end - 1] == "\r" and old[old_end:old_end + 1] == "\n":
+        old_end += 1
+        new_end += 1
+    return start, old_end, new_end
+
+def _has_lone_cr(text):
+    """
+    LSP also breaks lines at a \r on its own, positions here only know \n and
+    \r\n. Cheap for the usual text without \r.
+    """
+    return "\r" in text and text.count("\r") != text.count("\r\n")
+
+def _utf16_col_to_index(line_text, col):
+    if line_text.isascii():
+        return min(col, len(line_text))
+    units = 0
+    for i, ch in enumerate(line_text):
+        if units >= col:
+            return i
+        units += 2 if ord(ch) > 0xFFFF else 1
+    return len(line_text)
+
+# TextDocumentSyncKind.Incremental
+_SYNC_INCREMENTAL = 2
+# Set from cpptools' initialize reply: it takes range edits in didChange
+_server_incremental_sync = False
+_incremental_sync_stats = {"converted": 0, "charsSaved": 0}
+
+def _incremental_sync_enabled():
+    return _server_incremental_sync and get_oclsp_config().get("incrementalSync", True)
+
+def _handle_origin_textDocument_didChange(msg, inject_queue):
+    """Send cpptools the range edit a full-text change amounts to, instead of the whole document again."""
+    params = msg.get("params", {})
+    changes = params.get("contentChanges")
+    if not changes or len(changes) != 1 or "range" in changes[0] or not _incremental_sync_enabled():
+        return _UNCHANGED
+    document = _open_documents.get(params.get("textDocument", {}).get("uri"))
+    if document is None:
+        return _UNCHANGED
+    text = changes[0].get("text", "")
+    if _has_lone_cr(text) or _has_lone_cr(document.text):
+        # Its line numbers wouldn't match cpptools', the full text is always right
+        return _UNCHANGED
+    start, old_end, new_end = _text_edit(document.text, text)
+    changes[0] = {
+        "range": {"start": document.position_at(start), "end": document.position_at(old_end)},
+        "text": text[start:new_end],
+    }
+    _incremental_sync_stats["converted"] += 1
+    _incremental_sync_stats["charsSaved"] += len(text) - (new_end - start)
+    # For _observe_origin_didChange
+    msg[_CONTEXT_KEY] = text
+    return None
+
+def _observe_origin_didOpen(msg, context):
+    _mark_startup("first didOpen")
+    doc = msg.get("params", {}).get("textDocument", {})
+    uri = doc.get("uri")
+    if uri:
+        _open_documents[uri] = _OpenDocument(uri, doc.get("languageId", "cpp"), doc.get("version", 0), doc.get("text", ""))
+
+def _observe_origin_didChange(msg, context):
+    params = msg.get("params", {})
+    text_document = params.get("textDocument", {})
+    document = _open_documents.get(text_document.get("uri"))
+    if document is None:
+        return
+    if isinstance(context, str):
+        # Converted from a full-text change, which is cheaper to apply than its range edit
+        document.apply_change({"text": context})
+    else:
+        for change in params.get("contentChanges", []):
+            document.apply_change(change)
+    # Entries for older versions no longer match and age out of the hover cache
+    document.version = text_document.get("version", document.version)
+
+def _observe_origin_didClose(msg, context):
+    uri = msg.get("params", {}).get("textDocument", {}).get("uri")
+    _open_documents.pop(uri, None)
+    _completion_cache.pop(uri, None)
+    _hover_cache_invalidate(uri)
+    _document_symbol_cache.pop(uri, None)
+
+# Notifications whose content the proxy tracks. They are forwarded first and
+# decoded afterwards, off the latency path, unless a hook needed them already.
+# Observers get what that hook stashed under _CONTEXT_KEY.
+_origin_method_observers = {
+    "textDocument/didOpen": _observe_origin_didOpen,
+    "textDocument/didChange": _observe_origin_didChange,
+    "textDocument/didClose": _observe_origin_didClose,
+}
 
 ###############################################################################
 # Interception hooks
 ###############################################################################
 
+# Origin's initialize params as sent to cpptools, replayed to a restarted cpptools
+_origin_initialize_params = None
+
 def _handle_origin_initialize(msg, inject_queue):
+    global _origin_initialize_params
+    _mark_startup("Origin initialize")
     params = msg.setdefault("params", {})
+    _origin_initialize_params = params
+    _prepare_initialize_params(params)
+    _trace_log("modified initalize request: %s", msg)
+    return [msg]
+
+def _prepare_initialize_params(params):
+    """Origin's initialize params as cpptools gets them, with the workspace folders of the current config."""
     params["clientInfo"] = {
         "name": "Visual Studio Code",
         "version": "1.108.1",
@@ -286,39 +1396,148 @@ def _handle_origin_initialize(msg, inject_queue):
     ocPath = os.path.join(_ORGDIR_EXE, "OriginC")
     params["rootPath"] = ocPath
     workspace_folders = [{
-        "uri": Path(ocPath).absolute().as_uri(),
+        "uri": _file_uri(ocPath),
         "name": "OriginC"
     }]
     
     config = get_oclsp_config()
     if "workspaceFolders" in config:
         extra_folders = config["workspaceFolders"]
-        if isinstance(extra_folders, list):
+        if isinstance(extra_folders, tuple):
             for folder in extra_folders:
                 if "uri" in folder and "name" in folder:
-                    folder_copy = folder.copy()
-                    uri = folder_copy.get("uri")
-                    if uri and not uri.startswith("file://"):
-                        uri = Path(uri).absolute().as_uri()
-                        folder_copy["uri"] = uri
-                    workspace_folders.append(folder_copy)
-                    _trace_log(f"added extra workspace folder: {folder_copy}")
+                    folder_item = _lsp_workspace_folder(folder)
+                    workspace_folders.append(folder_item)
+                    _trace_log("added extra workspace folder: %s", folder_item)
 
     params["workspaceFolders"] = workspace_folders
+    if _daemon:
+        # cpptools exits with the process it is given, the daemon outlives every Origin
+        params["processId"] = os.getpid()
     if _enable_cpptools_trace:
         opts["loggingLevel"] = 1
         params["trace"] = "verbose"
-    _trace_log(f"modified initalize request: {msg}")
-    out = [json.dumps(msg).encode("utf-8")]
-    return out
 
-def send_cpptools_didChangeCppProperties(inject_queue, workspace_item):
-    json_path = Path(__file__).with_name("cpptools_didChangeCppProperties.json")
+def _file_uri(path):
+    """The absolute file:// uri of a local path."""
+    from pathlib import Path
+    return Path(path).absolute().as_uri()
+
+def _workspace_uri(uri):
+    """OCLSP.json accepts plain paths as workspace uris, cpptools wants file:// ones."""
+    if uri and not uri.startswith("file://"):
+        uri = _file_uri(uri)
+    return uri
+
+def _lsp_workspace_folder(folder):
+    """The LSP WorkspaceFolder for an OCLSP.json workspaceFolders entry."""
+    return {"uri": _workspace_uri(folder.get("uri")), "name": folder.get("name")}
+
+def _oc_ver_define():
+    # Extract major and first two decimals
+    # Ensure we have a string representation of the version with enough decimals
+    ver_str = f"{_ORG_VERSION:.6f}"
+    parts = ver_str.split(".")
+    major = int(parts[0])
+    minor_str = (parts[1] + "00")[:2]
+    # e.g. 10.35 -> 0x0A35 (Major converted to Hex, Minor kept as digits)
+    orgOCVerHex = f"0x{major:02X}{minor_str}"
+    return f"_OC_VER={orgOCVerHex}"
+
+def _load_payload_template(name):
+    json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
     try:
-        with json_path.open("r", encoding="utf-8") as f:
-            params = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        params = {}  # fallback to empty dict if file missing or invalid
+        with open(json_path, "rb") as f:
+            template = json_loads(f.read())
+    except (OSError, ValueError) as e:
+        _trace_log("Error reading %s: %s", json_path, e, level=LOG_WARNING)
+        template = {}  # fallback to empty dict if file missing or invalid
+    return template if isinstance(template, dict) else {}
+
+class _CppToolsPayloads:
+    """
+    cpptools_initialize.json and cpptools_didChangeCppProperties.json, read
+    once, with everything that is the same for all workspaces filled in.
+    Per-workspace payloads copy only the dicts on the path to the fields they
+    change and share the rest with the template, so they must not be modified
+    after they are built.
+    """
+    def __init__(self):
+        ocPath = os.path.join(_ORGDIR_EXE, "OriginC")
+        # example: \UFF\OCLSP\extension\bin\cpptools.exe
+        cpptoolsBinDir = os.path.dirname(_CPPTOOLS_PATH)
+        cpptoolsExtDir = os.path.dirname(cpptoolsBinDir)
+
+        init_params = _load_payload_template("cpptools_initialize.json")
+        # Override/customize with runtime paths
+        init_params.update({
+            "extensionPath": cpptoolsExtDir,
+            "databaseStoragePath": os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "databaseStorage"),
+            "workspaceStoragePath": os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "workspaceStorage"),
+            "cacheStoragePath": os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "cacheStorage"),
+            "edgeMessagesDirectory": os.path.join(cpptoolsBinDir, "messages", "en-us"),
+        })
+        # Ensure settings and workspaceFolderSettings exist
+        settings = init_params.get("settings")
+        if not isinstance(settings, dict):
+            settings = init_params["settings"] = {}
+        folder_settings = settings.get("workspaceFolderSettings")
+        if not isinstance(folder_settings, list) or not folder_settings:
+            folder_settings = settings["workspaceFolderSettings"] = [{}]
+        # The first element is OriginC's, extra workspaces get copies of it
+        folder_settings[0].update({
+            "defaultSystemIncludePath": [f"{ocPath}/System"],
+            "uri": _file_uri(ocPath),
+        })
+        self._initialize = init_params
+
+        properties = _load_payload_template("cpptools_didChangeCppProperties.json")
+        configurations = properties.get("configurations")
+        if not isinstance(configurations, list) or not configurations:
+            configurations = properties["configurations"] = [{}]
+        configuration = configurations[0]
+        configuration["defines"] = list(configuration.get("defines", ())) + [_oc_ver_define()]
+        configuration["forcedInclude"] = [
+            # somehow cpptools doesn't recognize Folder class, it seems like folder.h is ignored
+            # Forcing it to include fixes it
+            os.path.join(ocPath, "System", "folder.h")
+        ]
+        self._properties = properties
+
+    def initialize_params(self, config):
+        """cpptools/initialize params for OriginC and the workspaces in config."""
+        settings = self.settings(config)
+        return dict(self._initialize, settings=settings)
+
+    def settings(self, config):
+        """The settings part of cpptools/initialize, also sent as cpptools/didChangeSettings."""
+        base = self._initialize["settings"]
+        first = base["workspaceFolderSettings"][0]
+        folder_settings = [first]
+        extra_folders = config.get("workspaceFolders")
+        if isinstance(extra_folders, tuple):
+            for folder in extra_folders:
+                if "uri" in folder:
+                    folder_settings.append(dict(first, uri=_workspace_uri(folder.get("uri"))))
+        return dict(base, workspaceFolderSettings=folder_settings)
+
+    def cpp_properties_params(self, folder_uri, include_path):
+        """cpptools/didChangeCppProperties params for one workspace."""
+        configurations = self._properties["configurations"]
+        configuration = dict(configurations[0], includePath=include_path)
+        return dict(self._properties, configurations=[configuration] + configurations[1:],
+                    workspaceFolderUri=folder_uri)
+
+_payloads = None
+
+def _cpptools_payloads():
+    """The payload templates, loaded on first use (main() loads them while cpptools starts)."""
+    global _payloads
+    if _payloads is None:
+        _payloads = _CppToolsPayloads()
+    return _payloads
+
+def send_cpptools_didChangeCppProperties(inject_queue, workspace_item):
     ocPath = os.path.join(_ORGDIR_EXE, "OriginC")
 
     # Extract folder_path from workspace_item
@@ -332,179 +1551,935 @@ def send_cpptools_didChangeCppProperties(inject_queue, workspace_item):
              folder_path = uri
 
     if not folder_path:
-        _trace_log(f"send_cpptools_didChangeCppProperties: could not determine folder_path for {workspace_item}")
+        _trace_log("send_cpptools_didChangeCppProperties: could not determine folder_path for %s", workspace_item, level=LOG_WARNING)
         return
 
     is_oc_folder = folder_path == ocPath
 
     # Always use ocPath/** as include path
-    params["configurations"][0]["includePath"] = [f"{ocPath}/**"]
+    include_path = [f"{ocPath}/**"]
 
     config = get_oclsp_config()
     if not is_oc_folder:
         # 1. Global Additional Include Paths
         if "additionalIncludePath" in config:
             additional_paths = config["additionalIncludePath"]
-            if isinstance(additional_paths, list):
+            if isinstance(additional_paths, tuple):
                 for path in additional_paths:
                     if path:
-                        params["configurations"][0]["includePath"].append(f"{path}/**")
-        
+                        include_path.append(f"{path}/**")
+
         # 2. Per-Workspace Include Paths
         if workspace_item and "includePath" in workspace_item:
             wf_includes = workspace_item["includePath"]
-            if isinstance(wf_includes, list):
+            if isinstance(wf_includes, tuple):
                 for inc in wf_includes:
                     if inc:
-                        params["configurations"][0]["includePath"].append(f"{inc}/**")
+                        include_path.append(f"{inc}/**")
 
-    # Extract major and first two decimals
-    # Ensure we have a string representation of the version with enough decimals
-    ver_str = f"{_ORG_VERSION:.6f}"
-    parts = ver_str.split(".")
-    major = int(parts[0])
-    minor_str = (parts[1] + "00")[:2]
-    # e.g. 10.35 -> 0x0A35 (Major converted to Hex, Minor kept as digits)
-    orgOCVerHex = f"0x{major:02X}{minor_str}"
-    params["configurations"][0]["defines"].append(f"_OC_VER={orgOCVerHex}")
-    params["configurations"][0]["forcedInclude"] = [
-        # somehow cpptools doesn't recognize Folder class, it seems like folder.h is ignored
-        # Forcing it to include fixes it
-        os.path.join(ocPath, "System", "folder.h")
-    ]
-    params["workspaceFolderUri"] = Path(folder_path).absolute().as_uri()
+    params = _cpptools_payloads().cpp_properties_params(_file_uri(folder_path), include_path)
     proxy_id = next(_proxy_id_gen)
-    _trace_log(f"[IDGEN] injected cpptools/didChangeCppProperties proxy_id={proxy_id}")
+    _trace_log("[IDGEN] injected cpptools/didChangeCppProperties proxy_id=%s", proxy_id)
     injected = {
         "jsonrpc": "2.0",
         "id": proxy_id,
         "method": "cpptools/didChangeCppProperties",
         "params": params,
     }
-    _pending_proxy_requests.add(proxy_id)
-    inject_queue.put(json.dumps(injected).encode("utf-8"))
+    _track_request(proxy_id, None, injected["method"],
+                   functools.partial(_mark_startup, f"{workspace_item.get('name') or folder_path} properties"))
+    inject_queue.put(injected)
 
 def send_cpptools_initialize(inject_queue):
-    # example: \UFF\OCLSP\extension\bin\cpptools.exe
-    cpptoolsBinDir = os.path.dirname(_CPPTOOLS_PATH)
-    cpptoolsExtDir = os.path.dirname(cpptoolsBinDir)
-
-    # Load base cpptools initialization parameters from JSON file
-    json_path = Path(__file__).with_name("cpptools_initialize.json")
-    try:
-        with json_path.open("r", encoding="utf-8") as f:
-            cpptools_init_params = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        cpptools_init_params = {}  # fallback to empty dict if file missing or invalid
-
-    # Override/customize with runtime paths
-    cpptools_init_params.update({
-        "extensionPath": cpptoolsExtDir,
-        "databaseStoragePath": os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "databaseStorage"),
-        "workspaceStoragePath": os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "workspaceStorage"),
-        "cacheStoragePath": os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "cacheStorage"),
-        "edgeMessagesDirectory": os.path.join(cpptoolsBinDir, "messages", "en-us"),
-    })
-
-    # Ensure settings and workspaceFolderSettings exist
-    if "settings" not in cpptools_init_params:
-        cpptools_init_params["settings"] = {}
-
-    if "workspaceFolderSettings" not in cpptools_init_params["settings"]:
-        cpptools_init_params["settings"]["workspaceFolderSettings"] = [{}]
-    elif not isinstance(cpptools_init_params["settings"]["workspaceFolderSettings"], list) or not cpptools_init_params["settings"]["workspaceFolderSettings"]:
-        cpptools_init_params["settings"]["workspaceFolderSettings"] = [{}]
-
-    # Update the uri in the first element
-    ocPath = os.path.join(_ORGDIR_EXE, "OriginC")
-    firstWorkspaceFolderSettings = cpptools_init_params["settings"]["workspaceFolderSettings"][0]
-    firstWorkspaceFolderSettings.update({
-        "defaultSystemIncludePath": [f"{ocPath}/System"],
-        "uri": Path(ocPath).absolute().as_uri(),
-    })
-
-    config = get_oclsp_config()
-    if "workspaceFolders" in config:
-        extra_folders = config["workspaceFolders"]
-        if isinstance(extra_folders, list):
-            for folder in extra_folders:
-                if "uri" in folder:
-                    uri = folder.get("uri")
-                    if uri and not uri.startswith("file://"):
-                        uri = Path(uri).absolute().as_uri()
-                    
-                    new_settings = firstWorkspaceFolderSettings.copy()
-                    new_settings["uri"] = uri
-                    cpptools_init_params["settings"]["workspaceFolderSettings"].append(new_settings)
-
+    cpptools_init_params = _cpptools_payloads().initialize_params(get_oclsp_config())
     proxy_id = next(_proxy_id_gen)
-    _trace_log(f"[IDGEN] injected cpptools/initialize proxy_id={proxy_id}")
+    _trace_log("[IDGEN] injected cpptools/initialize proxy_id=%s", proxy_id)
     injected = {
         "jsonrpc": "2.0",
         "id": proxy_id,
         "method": "cpptools/initialize",
         "params": cpptools_init_params,
     }
-    _pending_proxy_requests.add(proxy_id)
-    inject_queue.put(json.dumps(injected).encode("utf-8"))
+    _track_request(proxy_id, None, injected["method"])
+    inject_queue.put(injected)
+
+def _handle_origin_initialized(msg, inject_queue):
+    global _cpptools_configured
+    # A config change noticed meanwhile is either part of what is sent here or
+    # pushed after it, never before
+    with _config_push_lock:
+        # The other workspaces wait until they are used, so cpptools indexes
+        # OriginC first instead of everything at once
+        if _lazy_workspaces_enabled():
+            for key, folder in _config_workspaces(get_oclsp_config()).items():
+                _inactive_workspaces[key] = _workspace_prefix(folder)
+        if _inactive_workspaces:
+            _trace_log("[Workspaces] %d deferred until used or idle", len(_inactive_workspaces), level=LOG_INFO)
+        _send_cpptools_configuration(inject_queue)
+        _cpptools_configured = True
+
+    if _prewarm_enabled():
+        _start_prewarm(inject_queue)
+    return None
+
+def _send_cpptools_configuration(inject_queue):
+    """cpptools/initialize plus the properties of OriginC and every active workspace. Call with _config_push_lock held."""
+    send_cpptools_initialize(inject_queue)
+
+    ocPath = os.path.join(_ORGDIR_EXE, "OriginC")
+
+    # Create a temporary workspace item for OriginC
+    oc_workspace_item = {
+        "uri": ocPath,
+        "name": "OriginC"
+    }
+    send_cpptools_didChangeCppProperties(inject_queue, oc_workspace_item)
+
+    for key, folder in _config_workspaces(get_oclsp_config()).items():
+        if key not in _inactive_workspaces:
+            send_cpptools_didChangeCppProperties(inject_queue, folder)
+
+###############################################################################
+# IntelliSense prewarm
+###############################################################################
+
+# Notifications Origin sends on its own, they don't mean the user is at work
+_PREWARM_QUIET_METHODS = ("$/setTrace", "workspace/didChangeConfiguration")
+
+class _Prewarm:
+    """The synthetic document and throwaway completion that parse origin.h before the user needs it."""
+    def __init__(self, uri, inject_queue):
+        self.uri = uri
+        self.inject_queue = inject_queue
+        self.completion_id = None
+        self.started = time.perf_counter()
+
+    def answered(self):
+        # Called from the cpptools reader with the completion's reply
+        _end_prewarm(self, "completion answered")
+
+_PREWARM_FILE = "__oclsp_prewarm.c"
+_PREWARM_FILE_RE = re.compile(re.escape(_PREWARM_FILE.encode("ascii")))
+
+# The prewarm in progress, guarded by _prewarm_lock
+_prewarm = None
+# Normalized uri of the synthetic document once a prewarm started. cpptools'
+# notifications about it are Origin's business neither during the prewarm
+# nor after, e.g. the empty diagnostics that follow its didClose
+_prewarm_uri = None
+_prewarm_lock = threading.Lock()
+_prewarm_stats = {}
+
+def _prewarm_enabled():
+    return get_oclsp_config().get("prewarm", False)
+
+def _prewarm_text():
+    """The synthetic document and where to complete in it."""
+    extra = get_oclsp_config().get("prewarmHeaders", ())
+    if not isinstance(extra, tuple):
+        _trace_log("prewarmHeaders: expected a list of header names, got %r", extra, level=LOG_WARNING)
+        extra = ()
+    headers = ("origin.h",) + tuple(h for h in extra if isinstance(h, str))
+    lines = [f"#include <{header}>" for header in headers]
+    lines += ["", "void __oclsp_prewarm()", "{", "    ", "}", ""]
+    return "\n".join(lines), {"line": len(headers) + 3, "character": 4}
+
+def _start_prewarm(inject_queue):
+    """Open the synthetic document and ask for completions in it, after the configuration in the inject queue."""
+    global _prewarm, _prewarm_uri
+    uri = _file_uri(os.path.join(_ORGDIR_EXE, "OriginC", _PREWARM_FILE))
+    _prewarm_uri = _normalize_document_uri(uri)
+    text, position = _prewarm_text()
+    prewarm = _Prewarm(uri, inject_queue)
+    prewarm.completion_id = next(_proxy_id_gen)
+    with _prewarm_lock:
+        _prewarm = prewarm
+    inject_queue.put({"jsonrpc": "2.0", "method": "textDocument/didOpen", "params": {
+        "textDocument": {"uri": uri, "languageId": "cpp", "version": 1, "text": text},
+    }})
+    # No deadline, the first parse of origin.h can take longer than a completion may
+    _track_request(prewarm.completion_id, None, "textDocument/completion", prewarm.answered, timeout=0)
+    inject_queue.put({"jsonrpc": "2.0", "id": prewarm.completion_id, "method": "textDocument/completion", "params": {
+        "textDocument": {"uri": uri}, "position": position,
+    }})
+    _trace_log("[Prewarm] started, completion proxy_id=%s", prewarm.completion_id, level=LOG_INFO)
+
+def _about_prewarm_document(msg):
+    """True for a cpptools notification about the synthetic document, which Code Builder never opened."""
+    params = msg.get("params") if isinstance(msg, dict) else None
+    if not isinstance(params, dict):
+        return False
+    uri = params.get("uri")
+    if uri is None and isinstance(params.get("textDocument"), dict):
+        uri = params["textDocument"].get("uri")
+    return isinstance(uri, str) and _normalize_document_uri(uri) == _prewarm_uri
+
+def _drop_prewarm():
+    """cpptools exited, its synthetic document went with it."""
+    global _prewarm
+    with _prewarm_lock:
+        if _prewarm is not None:
+            _prewarm_stats.update(result="cpptools exited")
+        _prewarm = None
+
+def _end_prewarm(prewarm, reason):
+    """Close the synthetic document, cancelling the completion if cpptools is still on it."""
+    global _prewarm
+    with _prewarm_lock:
+        if prewarm is None or _prewarm is not prewarm:
+            return
+        _prewarm = None
+    # Through the inject queue, so it follows the prewarm messages
+    if _request_table.pop(prewarm.completion_id) is not None:
+        prewarm.inject_queue.put({"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": prewarm.completion_id}})
+    prewarm.inject_queue.put({"jsonrpc": "2.0", "method": "textDocument/didClose", "params": {
+        "textDocument": {"uri": prewarm.uri},
+    }})
+    elapsed = time.perf_counter() - prewarm.started
+    _prewarm_stats.update(result=reason, seconds=round(elapsed, 3))
+    _trace_log("[Prewarm] ended after %.2fs: %s", elapsed, reason, level=LOG_INFO)
+
+###############################################################################
+# Lazy workspace activation
+###############################################################################
+
+# Seconds Origin must have been quiet before the next inactive workspace is configured
+_DEFAULT_WORKSPACE_IDLE_DELAY = 10
+# Normalized workspaceFolders uri -> prefix of the uris of its documents, for
+# workspaces cpptools hasn't been sent properties for yet. Guarded by
+# _config_push_lock.
+_inactive_workspaces = {}
+# time.monotonic() of the last message from Origin or idle activation
+_last_activity = 0.0
+
+def _lazy_workspaces_enabled():
+    # Opt-in: until a deferred folder is configured, references and symbols across folders are incomplete
+    return get_oclsp_config().get("workspaceActivation", "eager") == "lazy"
+
+def _workspace_idle_delay():
+    return _config_number("workspaceIdleDelay", _DEFAULT_WORKSPACE_IDLE_DELAY)
+
+def _normalize_document_uri(uri):
+    from urllib.parse import unquote
+    # Origin and Path.as_uri() don't agree on case or percent-encoding (c%3A vs C:)
+    return unquote(uri).lower()
+
+def _workspace_prefix(folder):
+    return _normalize_document_uri(_workspace_uri(folder["uri"])).rstrip("/") + "/"
+
+def _activate_workspace(inject_queue, key, reason):
+    """Send cpptools the properties of an inactive workspace. Call with _config_push_lock held."""
+    if _inactive_workspaces.pop(key, None) is None:
+        return
+    # Properties come from the current config, it may have been reloaded meanwhile
+    folder = _config_workspaces(get_oclsp_config()).get(key)
+    # While cpptools restarts, the replay sends the properties of every active workspace
+    if folder is not None and not _cpptools_restarting:
+        _trace_log("[Workspaces] activating %s (%s)", folder.get("name") or key, reason, level=LOG_INFO)
+        send_cpptools_didChangeCppProperties(inject_queue, folder)
+
+def _handle_origin_textDocument_didOpen(msg, inject_queue):
+    """Configure the inactive workspace a document belongs to before cpptools opens it."""
+    if _inactive_workspaces:
+        uri = msg.get("params", {}).get("textDocument", {}).get("uri")
+        if uri:
+            uri = _normalize_document_uri(uri)
+            with _config_push_lock:
+                for key, prefix in list(_inactive_workspaces.items()):
+                    if uri.startswith(prefix):
+                        _activate_workspace(inject_queue, key, "document opened")
+    return None
+
+def _activate_idle_workspaces(inject_queue):
+    """Called periodically: configure the next inactive workspace once Origin has been quiet long enough."""
+    global _last_activity
+    if not _inactive_workspaces:
+        return
+    delay = _workspace_idle_delay()
+    if not delay or time.monotonic() - _last_activity < delay:
+        return
+    with _config_push_lock:
+        if _inactive_workspaces:
+            _activate_workspace(inject_queue, next(iter(_inactive_workspaces)), "idle")
+    # One at a time, the next one waits for another quiet period
+    _last_activity = time.monotonic()
+
+###############################################################################
+# Config reload
+###############################################################################
+
+# Set once cpptools got its settings from _handle_origin_initialized; config
+# changes before that are simply part of them
+_cpptools_configured = False
+_config_push_lock = threading.Lock()
+
+def _config_workspaces(config):
+    """Normalized uri -> workspaceFolders entry."""
+    workspaces = {}
+    for folder in config.get("workspaceFolders", ()):
+        if isinstance(folder, collections.abc.Mapping) and folder.get("uri"):
+            workspaces[folder["uri"].strip().lower()] = folder
+    return workspaces
+
+def _push_config_changes(old, new, inject_queue):
+    """Bring cpptools in line with a reloaded OCLSP.json, without restarting it."""
+    old_workspaces = _config_workspaces(old)
+    new_workspaces = _config_workspaces(new)
+    added = [folder for key, folder in new_workspaces.items() if key not in old_workspaces]
+    removed = [folder for key, folder in old_workspaces.items() if key not in new_workspaces]
+    for key in old_workspaces.keys() - new_workspaces.keys():
+        _inactive_workspaces.pop(key, None)
+
+    if added or removed:
+        inject_queue.put({
+            "jsonrpc": "2.0",
+            "method": "workspace/didChangeWorkspaceFolders",
+            "params": {"event": {
+                "added": [_lsp_workspace_folder(folder) for folder in added],
+                "removed": [_lsp_workspace_folder(folder) for folder in removed],
+            }},
+        })
+        # cpptools keeps per-folder settings next to the folder list
+        inject_queue.put({
+            "jsonrpc": "2.0",
+            "method": "cpptools/didChangeSettings",
+            "params": _cpptools_payloads().settings(new),
+        })
+
+    # Every workspace but OriginC's includes additionalIncludePath
+    if old.get("additionalIncludePath") != new.get("additionalIncludePath"):
+        refresh = list(new_workspaces.items())
+    else:
+        refresh = [(key, folder) for key, folder in new_workspaces.items()
+                   if key not in old_workspaces or old_workspaces[key] != folder]
+    # Inactive workspaces get the current properties when they are activated
+    refresh = [(key, folder) for key, folder in refresh if key not in _inactive_workspaces]
+    lazy = _lazy_workspaces_enabled()
+    for key, folder in refresh:
+        if lazy and key not in old_workspaces:
+            _inactive_workspaces[key] = _workspace_prefix(folder)
+        else:
+            send_cpptools_didChangeCppProperties(inject_queue, folder)
+    _trace_log("[Config] workspaces added %d, removed %d, reconfigured %d",
+               len(added), len(removed), len(refresh), level=LOG_INFO)
+
+def _check_config(inject_queue):
+    """Called periodically: reload OCLSP.json / OCLSP_User.json if they changed on disk."""
+    try:
+        with _config_push_lock:
+            old = _reload_oclsp_config()
+            if old is None:
+                return
+            new = get_oclsp_config()
+            changed = sorted(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+            _trace_log("[Config] reloaded, changed: %s", ", ".join(changed), level=LOG_INFO)
+            # A restart in progress sends cpptools the current config anyway
+            if _cpptools_configured and not _cpptools_restarting:
+                _push_config_changes(old, new, inject_queue)
+    except Exception as e:
+        # A half-edited config must not take the proxy down
+        log_exception(f"_check_config: {e}")
+
+
+def _handle_origin_textDocument_hover(msg, inject_queue):
+    key = _hover_cache_key(msg)
+    if key is not None:
+        result = _hover_cache_get(key)
+        if result is not None:
+            send_to_client(_make_response(msg.get("id"), result))
+            return []
+        msg[_CONTEXT_KEY] = key
+    # cpptools does not handle textDocument/hover, but handles cpptools/hover
+    msg["method"] = "cpptools/hover"
+    return [msg]
+
+def _handle_origin_textDocument_documentSymbol(msg, inject_queue):
+    # cpptools does not handle textDocument/documentSymbol, but handles cpptools/getDocumentSymbols
+    msg["method"] = "cpptools/getDocumentSymbols"
+    
+    # Align payload shape to VS Code's format: move uri at the top level
+    if "params" in msg and "textDocument" in msg["params"]:
+        uri = msg["params"]["textDocument"].get("uri")
+        if uri:
+            msg["params"] = {"uri": uri}
+            document = _open_documents.get(uri)
+            if document is not None:
+                cached = _document_symbol_cache.get(uri)
+                if cached is not None and cached[0] == document.version:
+                    _trace_log("[Symbols] cache hit %s v%s", uri, document.version)
+                    send_to_client(_document_symbol_response(uri, cached, msg.get("id")))
+                    return []
+                msg[_CONTEXT_KEY] = (uri, document.version)
+    
+    return [msg]
+
+def _handle_origin_textDocument_references(msg, inject_queue):
+    # cpptools does not handle textDocument/references, but handles cpptools/findAllReferences
+    # Note: cpptools/findAllReferences params structure is very similar to RenameParams (includes newName)
+    msg["method"] = "cpptools/findAllReferences"
+    
+    if "params" in msg:
+        params = msg["params"]
+        # Standard params: { textDocument, position, context }
+        # cpptools params: { textDocument, position, newName }
+        if "newName" not in params:
+            params["newName"] = ""
+        # Remove context if present (cpptools doesn't seem to use it in this custom request)
+        if "context" in params:
+            del params["context"]
+        # cpptools doesn't stream references; the proxy reports them in batches itself
+        partial_result_token = params.pop("partialResultToken", None)
+        if partial_result_token is not None:
+            msg[_CONTEXT_KEY] = partial_result_token
+            
+    return [msg]
+
+###############################################################################
+# Completion cache
+###############################################################################
+
+class _CompletionCacheEntry:
+    __slots__ = ("line", "word_start", "line_head", "prefix", "version", "result", "keys")
+
+    def __init__(self, line, word_start, line_head, prefix, version):
+        self.line = line
+        self.word_start = word_start
+        self.line_head = line_head
+        self.prefix = prefix
+        self.version = version
+        self.result = None
+        self.keys = None
+
+# uri -> _CompletionCacheEntry of the last complete (not isIncomplete) result
+_completion_cache = {}
+_completion_cache_stats = {"hits": 0, "misses": 0}
+_IDENTIFIER_TAIL_RE = re.compile(r"[A-Za-z0-9_]*$")
+
+def _completion_enabled():
+    return get_oclsp_config().get("completionCache", True) is not False
+
+def _completion_items(result):
+    if isinstance(result, list):
+        return result
+    if isinstance(result, dict):
+        return result.get("items", [])
+    return []
+
+def _fuzzy_match(key, prefix):
+    """Case-insensitive subsequence match anchored at the first character."""
+    if not prefix:
+        return True
+    if not key or key[0] != prefix[0]:
+        return False
+    pos = 1
+    for ch in prefix[1:]:
+        pos = key.find(ch, pos) + 1
+        if pos == 0:
+            return False
+    return True
+
+def _move_text_edit_end(item, position):
+    """Copy of `item` whose text edit ends at `position`, the cursor after more typing."""
+    edit = item.get("textEdit")
+    if not isinstance(edit, dict):
+        return item
+    edit = dict(edit)
+    if "range" in edit:
+        edit["range"] = {"start": edit["range"]["start"], "end": position}
+    else:
+        # InsertReplaceEdit
+        if "insert" in edit:
+            edit["insert"] = {"start": edit["insert"]["start"], "end": position}
+        if "replace" in edit:
+            end = edit["replace"]["end"]
+            if end.get("line") == position["line"] and end.get("character", 0) < position["character"]:
+                end = position
+            edit["replace"] = {"start": edit["replace"]["start"], "end": end}
+    item = dict(item)
+    item["textEdit"] = edit
+    return item
+
+def _completion_request_context(msg):
+    params = msg.get("params", {})
+    uri = params.get("textDocument", {}).get("uri")
+    position = params.get("position")
+    document = _open_documents.get(uri)
+    if document is None or not position:
+        return None
+    line_text = document.line_text(position.get("line", 0))
+    cursor = _utf16_col_to_index(line_text, position.get("character", 0))
+    head = line_text[:cursor]
+    prefix = _IDENTIFIER_TAIL_RE.search(head).group()
+    word_start = cursor - len(prefix)
+    context = _CompletionCacheEntry(position.get("line", 0), word_start, head[:word_start], prefix, document.version)
+    return uri, position, context
+
+def _handle_origin_textDocument_completion(msg, inject_queue):
+    """
+    Answer completion locally while the user keeps typing the same word:
+    if the last result for this word was complete, the candidates for a
+    longer prefix are a filtered subset of it.
+    """
+    if not _completion_enabled():
+        return None
+    request = _completion_request_context(msg)
+    if request is None:
+        return None
+    uri, position, context = request
+
+    cached = _completion_cache.get(uri)
+    if (cached is not None
+            and cached.line == context.line
+            and cached.word_start == context.word_start
+            and cached.line_head == context.line_head
+            and context.prefix.startswith(cached.prefix)
+            and context.version >= cached.version):
+        _completion_cache_stats["hits"] += 1
+        needle = context.prefix.lower()
+        items = []
+        for key, item in zip(cached.keys, _completion_items(cached.result)):
+            if _fuzzy_match(key, needle):
+                items.append(_move_text_edit_end(item, position))
+        if isinstance(cached.result, dict):
+            result = dict(cached.result)
+            result["items"] = items
+        else:
+            result = items
+        _trace_log("[Completion] cache hit %s prefix=%r %d/%d items",
+                   uri, context.prefix, len(items), len(cached.keys))
+        send_to_client(_make_response(msg.get("id"), result))
+        return []
+
+    _completion_cache_stats["misses"] += 1
+    msg[_CONTEXT_KEY] = (uri, context)
+    return [msg]
+
+def _store_completion_result(uri, context, result):
+    if isinstance(result, dict) and result.get("isIncomplete"):
+        _completion_cache.pop(uri, None)
+        return
+    items = _completion_items(result)
+    keys = []
+    for item in items:
+        key = ""
+        if isinstance(item, dict):
+            key = item.get("filterText") or item.get("label") or ""
+        keys.append(key.lower() if isinstance(key, str) else "")
+    context.result = result
+    context.keys = keys
+    _completion_cache[uri] = context
+
+###############################################################################
+# Cancellation
+###############################################################################
+
+# Interactive requests that are stale as soon as a newer one for the same
+# document is sent (keyed by the method forwarded to cpptools)
+_SUPERSEDED_METHODS = frozenset((
+    "cpptools/hover",
+    "textDocument/completion",
+    "textDocument/signatureHelp",
+))
+# (method, uri, session) -> cpptools id of the latest in-flight request, and
+# back; an entry goes when its request is answered, cancelled or failed
+_latest_interactive_request = {}
+_interactive_request_keys = {}
+_latest_interactive_lock = threading.Lock()
+
+def _supersede_enabled():
+    return get_oclsp_config().get("supersedeRequests", True) is not False
+
+def _forget_interactive_request(record):
+    """A request taken out of the request table is no longer the latest for its document."""
+    if record.method not in _SUPERSEDED_METHODS:
+        return
+    with _latest_interactive_lock:
+        key = _interactive_request_keys.pop(record.cpptools_id, None)
+        if key is not None and _latest_interactive_request.get(key) == record.cpptools_id:
+            del _latest_interactive_request[key]
+
+def _fail_request(record, server_out, code, message):
+    """
+    Give up on a request already taken out of the request table: tell cpptools
+    to stop working on it and answer Origin with an error. Its late reply is
+    then dropped as unknown.
+    """
+    _forget_interactive_request(record)
+    _trace_log("[Cancel] %s cpptools_id=%s client_id=%s", message, record.cpptools_id, record.client_id)
+    send_notification(server_out, "$/cancelRequest", {"id": record.cpptools_id}, to_lsp_server=True, lock=_server_stdin_lock)
+    if record.client_id is not None:
+        record.session.send(_make_error_response(record.client_id, code, message))
+
+def _cancel_in_flight(cpptools_id, server_out, reason):
+    record = _request_table.pop(cpptools_id)
+    if record is None:
+        return False
+    _fail_request(record, server_out, REQUEST_CANCELLED, f"Request cancelled: {reason}")
+    return True
+
+def _expire_requests(server_out):
+    """Answer Origin for requests cpptools didn't reply to in time, or that were evicted."""
+    for record, reason in _request_table.take_expired(time.perf_counter()):
+        elapsed = time.perf_counter() - record.sent
+        _trace_log("[Requests] %s %s %s after %.1fs (%s)", record.method, record.cpptools_id, reason,
+                   elapsed, _request_table.stats(), level=LOG_WARNING)
+        if record.client_id is None:
+            # The proxy's own request, nobody is waiting on it; a late reply is dropped
+            continue
+        _add_latency(_request_latency, record.method, elapsed, error=True)
+        _fail_request(record, server_out, REQUEST_FAILED, f"{record.method} {reason} after {elapsed:.1f}s")
+
+def _supersede_previous_request(server_out, method, out, cpptools_id):
+    if isinstance(out, RawMessage):
+        params = json_loads(out.body).get("params", {})
+    else:
+        params = out.get("params", {})
+    uri = params.get("textDocument", {}).get("uri") if isinstance(params, dict) else None
+    if not uri:
+        return
+    key = (method, uri, _current_session())
+    with _latest_interactive_lock:
+        previous = _latest_interactive_request.get(key)
+        _latest_interactive_request[key] = cpptools_id
+        _interactive_request_keys[cpptools_id] = key
+    if previous is not None:
+        _cancel_in_flight(previous, server_out, f"superseded by a newer {method}")
+
+def _handle_origin_cancelRequest(msg, inject_queue):
+    """Translate the id of Origin's $/cancelRequest to the one cpptools knows."""
+    params = msg.get("params", {})
+    record = _request_table.pop_client(_current_session(), params.get("id"))
+    if record is None:
+        # Already answered, or answered by the proxy itself
+        return []
+    _forget_interactive_request(record)
+    _trace_log("[Cancel] client_id=%s -> cpptools_id=%s", params.get("id"), record.cpptools_id)
+    send_to_client(_make_error_response(params.get("id"), REQUEST_CANCELLED, "Request cancelled"))
+    params["id"] = record.cpptools_id
+    return [msg]
+
+def _handle_origin_oclsp_stats(msg, inject_queue):
+    """Custom request: answer with the proxy's metrics, cpptools isn't involved."""
+    send_to_client(_make_response(msg.get("id"), _metrics_snapshot()))
+    return []
+
+###############################################################################
+# Hover cache
+###############################################################################
+
+# (uri, version, line, word start) -> hover result, least recently used first.
+# Looked up by the Origin reader and filled by the cpptools reader, hence the lock
+_hover_cache = collections.OrderedDict()
+_hover_cache_lock = threading.Lock()
+_hover_cache_stats = {"hits": 0, "misses": 0}
+_IDENTIFIER_HEAD_RE = re.compile(r"[A-Za-z0-9_]*")
+
+def _identifier_at(line_text, cursor):
+    """(start, identifier) under the cursor in a line, the identifier is empty if there is none."""
+    head = _IDENTIFIER_TAIL_RE.search(line_text, 0, cursor).group()
+    tail = _IDENTIFIER_HEAD_RE.match(line_text, cursor).group()
+    return cursor - len(head), head + tail
+
+_DEFAULT_HOVER_CACHE_SIZE = 256
+
+def _hover_cache_size():
+    return _config_number("hoverCacheSize", _DEFAULT_HOVER_CACHE_SIZE, integer=True)
+
+def _hover_cache_key(msg):
+    """
+    Key a hover request by document version and the start of the identifier
+    under the cursor, so hovering anywhere over the same symbol hits.
+    None if the document isn't tracked or caching is off.
+    """
+    if not _hover_cache_size():
+        return None
+    params = msg.get("params", {})
+    uri = params.get("textDocument", {}).get("uri")
+    position = params.get("position")
+    document = _open_documents.get(uri)
+    if document is None or not position:
+        return None
+    line = position.get("line", 0)
+    line_text = document.line_text(line)
+    start, _ = _identifier_at(line_text, _utf16_col_to_index(line_text, position.get("character", 0)))
+    return (uri, document.version, line, start)
+
+def _hover_cache_get(key):
+    with _hover_cache_lock:
+        result = _hover_cache.get(key)
+        if result is None:
+            _hover_cache_stats["misses"] += 1
+            return None
+        _hover_cache.move_to_end(key)
+        _hover_cache_stats["hits"] += 1
+    _trace_log("[Hover] cache hit %s (hits=%d misses=%d)", key,
+               _hover_cache_stats["hits"], _hover_cache_stats["misses"])
+    return result
+
+def _hover_cache_put(key, result):
+    limit = _hover_cache_size()
+    with _hover_cache_lock:
+        _hover_cache[key] = result
+        _hover_cache.move_to_end(key)
+        while len(_hover_cache) > limit:
+            _hover_cache.popitem(last=False)
+
+def _hover_cache_invalidate(uri):
+    """Drop a closed document's entries, it may be reopened with its versions counting from 1 again."""
+    with _hover_cache_lock:
+        for key in [k for k in _hover_cache if k[0] == uri]:
+            del _hover_cache[key]
+
+###############################################################################
+# Document symbol cache
+###############################################################################
+
+# uri -> (document version, final symbol list sent to Origin, or its JSON)
+_document_symbol_cache = {}
+
+def _document_symbol_response(uri, cached, client_id):
+    """
+    Build the reply for a cache hit as raw bytes. The symbol list is encoded
+    on the first hit and the encoded form is kept, so pressing Alt+M again
+    costs no JSON work no matter how large the file is.
+    """
+    version, result = cached
+    if not isinstance(result, bytes):
+        result = json_dumps(result)
+        _document_symbol_cache[uri] = (version, result)
+    return b"".join((b'{"jsonrpc":"2.0","id":', json_dumps(client_id), b',"result":', result, b"}"))
+
+###############################################################################
+# Symbol index
+###############################################################################
+
+# Bumped when the stored format or what is indexed changes
+_SYMBOL_INDEX_VERSION = 1
+# cpptools is taken to be ready this long after it started, even if it never
+# reported its tag parser done
+_COLD_START_LIMIT = 300.0
+# Most symbols a workspace/symbol answered from the index returns
+_SYMBOL_INDEX_MAX_RESULTS = 200
+
+# LSP SymbolKind
+_SYMBOL_CLASS = 5
+_SYMBOL_ENUM = 10
+_SYMBOL_FUNCTION = 12
+_SYMBOL_CONSTANT = 14
+_SYMBOL_ENUM_MEMBER = 22
+_SYMBOL_STRUCT = 23
+
+_COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_NOT_NEWLINE_RE = re.compile(r"[^\n]")
+_MACRO_RE = re.compile(r"^[ \t]*#[ \t]*define[ \t]+([A-Za-z_]\w*)", re.M)
+# Definitions only, a forward declaration ends with ;
+_CLASS_RE = re.compile(r"^[ \t]*(?:typedef[ \t]+)?(class|struct)[ \t]+([A-Za-z_]\w*)[ \t]*(?=[:{\r\n])", re.M)
+_ENUM_RE = re.compile(r"\benum\b[ \t]*([A-Za-z_]\w*)?[^;{}]*\{([^}]*)\}")
+_ENUMERATOR_RE = re.compile(r"(?:^|,)\s*([A-Za-z_]\w*)")
+# Global functions are declared from the first column, members are indented
+_FUNCTION_RE = re.compile(
+    r"^(?!(?:return|if|else|while|for|switch|case|do|typedef|using|class|struct|enum|union|template|goto|delete|new)\b)"
+    r"[A-Za-z_][\w \t\*&:<>,]*?[ \t\*&]([A-Za-z_]\w*)[ \t]*\(", re.M)
+
+# The index of the OriginC headers, None until it is loaded
+_symbol_index = None
+# Set once cpptools reports its tag parser done, cleared when it restarts
+_cpptools_ready = False
+_cpptools_started = time.monotonic()
+_symbol_index_stats = {"answered": 0, "filled": 0}
+
+def _symbol_index_enabled():
+    return get_oclsp_config().get("symbolIndex", True)
+
+def _symbol_index_path():
+    return os.path.join(_DATASTORAGE_DIR, "OCLSP", "storage", "oclsp_symbols.json")
+
+def _cpptools_cold():
+    return not _cpptools_ready and time.monotonic() - _cpptools_started < _COLD_START_LIMIT
+
+def _index_header(text):
+    """[name, kind, line, character] of the functions, classes, macros and enums declared in a header."""
+    # Blank out comments, keeping offsets and line breaks
+    text = _COMMENT_RE.sub(lambda m: _NOT_NEWLINE_RE.sub(" ", m.group()), text)
+    line_starts = [0]
+    line_starts.extend(m.end() for m in _NEWLINE_RE.finditer(text))
+    symbols = []
 
-def _handle_origin_initialized(msg, inject_queue):
-    
-    send_cpptools_initialize(inject_queue)
+    def add(name, kind, offset):
+        line = bisect.bisect_right(line_starts, offset) - 1
+        symbols.append([name, kind, line, offset - line_starts[line]])
 
-    ocPath = os.path.join(_ORGDIR_EXE, "OriginC")
-    
-    # Create a temporary workspace item for OriginC
-    oc_workspace_item = {
-        "uri": ocPath,
-        "name": "OriginC"
-    }
-    send_cpptools_didChangeCppProperties(inject_queue, oc_workspace_item)
+    for m in _MACRO_RE.finditer(text):
+        add(m.group(1), _SYMBOL_CONSTANT, m.start(1))
+    for m in _CLASS_RE.finditer(text):
+        add(m.group(2), _SYMBOL_CLASS if m.group(1) == "class" else _SYMBOL_STRUCT, m.start(2))
+    for m in _ENUM_RE.finditer(text):
+        if m.group(1):
+            add(m.group(1), _SYMBOL_ENUM, m.start(1))
+        for enumerator in _ENUMERATOR_RE.finditer(m.group(2)):
+            add(enumerator.group(1), _SYMBOL_ENUM_MEMBER, m.start(2) + enumerator.start(1))
+    for m in _FUNCTION_RE.finditer(text):
+        add(m.group(1), _SYMBOL_FUNCTION, m.start(1))
+    return symbols
 
-    config = get_oclsp_config()
-    if "workspaceFolders" in config:
-        extra_folders = config["workspaceFolders"]
-        if isinstance(extra_folders, list):
-            for folder in extra_folders:
-                if "uri" in folder:
-                    send_cpptools_didChangeCppProperties(inject_queue, folder)
+class _SymbolIndex:
+    """Declarations in the OriginC headers by name."""
+    def __init__(self, files):
+        # path -> {"mtime", "size", "symbols"}, as stored
+        self.files = files
+        self.by_name = {}
+        count = 0
+        for path, entry in files.items():
+            for name, kind, line, character in entry["symbols"]:
+                self.by_name.setdefault(name, []).append((path, kind, line, character))
+                count += 1
+        self.count = count
 
-    return None
+    @staticmethod
+    def _location(name, path, line, character):
+        return {
+            "uri": _path_to_uri(path),
+            "range": {
+                "start": {"line": line, "character": character},
+                "end": {"line": line, "character": character + len(name)},
+            },
+        }
 
+    def locations(self, name):
+        return [self._location(name, path, line, character) for path, _, line, character in self.by_name.get(name, ())]
 
-def _handle_origin_textDocument_hover(msg, inject_queue):
-    # cpptools does not handle textDocument/hover, but handles cpptools/hover
-    msg["method"] = "cpptools/hover"
-    return [json.dumps(msg).encode("utf-8")]
+    def symbols(self, query, limit):
+        """SymbolInformation for the names containing `query`, ignoring case."""
+        query = query.lower()
+        result = []
+        for name, entries in self.by_name.items():
+            if query not in name.lower():
+                continue
+            for path, kind, line, character in entries:
+                result.append({"name": name, "kind": kind, "location": self._location(name, path, line, character)})
+                if len(result) >= limit:
+                    return result
+        return result
 
-def _handle_origin_textDocument_documentSymbol(msg, inject_queue):
-    # cpptools does not handle textDocument/documentSymbol, but handles cpptools/getDocumentSymbols
-    msg["method"] = "cpptools/getDocumentSymbols"
-    
-    # Align payload shape to VS Code's format: move uri at the top level
-    if "params" in msg and "textDocument" in msg["params"]:
-        uri = msg["params"]["textDocument"].get("uri")
-        if uri:
-            msg["params"] = {"uri": uri}
-    
-    return [json.dumps(msg).encode("utf-8")]
+def _load_stored_symbols(path):
+    try:
+        with open(path, "rb") as f:
+            stored = json_loads(f.read())
+    except (OSError, ValueError) as e:
+        _trace_log("[SymbolIndex] nothing usable in %s: %s", path, e)
+        return {}
+    if not isinstance(stored, dict) or stored.get("version") != _SYMBOL_INDEX_VERSION:
+        return {}
+    return stored.get("files") or {}
 
-def _handle_origin_textDocument_references(msg, inject_queue):
-    # cpptools does not handle textDocument/references, but handles cpptools/findAllReferences
-    # Note: cpptools/findAllReferences params structure is very similar to RenameParams (includes newName)
-    msg["method"] = "cpptools/findAllReferences"
-    
-    if "params" in msg:
-        params = msg["params"]
-        # Standard params: { textDocument, position, context }
-        # cpptools params: { textDocument, position, newName }
-        if "newName" not in params:
-            params["newName"] = ""
-        # Remove context if present (cpptools doesn't seem to use it in this custom request)
-        if "context" in params:
-            del params["context"]
-            
-    return [json.dumps(msg).encode("utf-8")]
+def _scan_headers(root, stored):
+    """
+    The index entries of the headers under `root`, reusing the stored ones
+    whose file has the same mtime and size. Returns (files, changed).
+    """
+    files = {}
+    changed = False
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if not name.lower().endswith(".h"):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = stored.get(path)
+            if entry is not None and entry.get("mtime") == st.st_mtime and entry.get("size") == st.st_size:
+                files[path] = entry
+                continue
+            try:
+                with open(path, "rb") as f:
+                    text = f.read().decode("utf-8", errors="replace")
+            except OSError:
+                continue
+            files[path] = {"mtime": st.st_mtime, "size": st.st_size, "symbols": _index_header(text)}
+            changed = True
+    return files, changed or len(files) != len(stored)
+
+def _build_symbol_index():
+    """Thread: use the stored index at once, then bring it up to date with the headers and store it."""
+    global _symbol_index
+    try:
+        start = time.perf_counter()
+        path = _symbol_index_path()
+        stored = _load_stored_symbols(path)
+        if stored:
+            _symbol_index = _SymbolIndex(stored)
+        files, changed = _scan_headers(os.path.join(_ORGDIR_EXE, "OriginC"), stored)
+        if changed:
+            _symbol_index = _SymbolIndex(files)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(json_dumps({"version": _SYMBOL_INDEX_VERSION, "files": files}))
+            os.replace(tmp_path, path)
+        index = _symbol_index
+        _trace_log("[SymbolIndex] %d symbols from %d headers in %.2fs (%s)",
+                   index.count if index else 0, len(files), time.perf_counter() - start,
+                   "updated" if changed else "unchanged", level=LOG_INFO)
+    except Exception as e:
+        log_exception(f"_build_symbol_index: {e}")
+
+def _start_symbol_index():
+    if _ORGDIR_EXE and _symbol_index_enabled():
+        threading.Thread(target=_build_symbol_index, daemon=True).start()
+
+def _observe_lsp_reportStatus(msg):
+    global _cpptools_ready
+    status = msg.get("params", {}).get("status")
+    if not _cpptools_ready and isinstance(status, str) and status.endswith("Parsing done"):
+        _cpptools_ready = True
+        _trace_log("[SymbolIndex] cpptools parsed the workspace after %.1fs, no longer answering from the index",
+                   time.monotonic() - _cpptools_started, level=LOG_INFO)
+
+def _handle_origin_textDocument_definition(msg, inject_queue):
+    """
+    While cpptools is still indexing, answer F11 from the symbol index if it
+    knows the name. Otherwise the name goes along for cpptools' reply, which
+    is empty until cpptools has indexed the headers; the index may be loaded
+    by then.
+    """
+    if not _cpptools_cold() or not _symbol_index_enabled():
+        return None
+    params = msg.get("params", {})
+    document = _open_documents.get(params.get("textDocument", {}).get("uri"))
+    position = params.get("position")
+    if document is None or not position:
+        return None
+    line_text = document.line_text(position.get("line", 0))
+    _, name = _identifier_at(line_text, _utf16_col_to_index(line_text, position.get("character", 0)))
+    if not name:
+        return None
+    index = _symbol_index
+    locations = index.locations(name) if index is not None else None
+    if not locations:
+        msg[_CONTEXT_KEY] = name
+        return None
+    _symbol_index_stats["answered"] += 1
+    send_to_client(_make_response(msg.get("id"), locations))
+    return []
+
+def _handle_origin_workspace_symbol(msg, inject_queue):
+    index = _symbol_index
+    query = msg.get("params", {}).get("query")
+    if index is None or not query or not _cpptools_cold() or not _symbol_index_enabled():
+        return None
+    symbols = index.symbols(query, _SYMBOL_INDEX_MAX_RESULTS)
+    if not symbols:
+        return None
+    _symbol_index_stats["answered"] += 1
+    send_to_client(_make_response(msg.get("id"), symbols))
+    return []
+
+# A hook returns None to forward the (possibly modified) message, a list of
+# messages to forward instead ([] when the proxy answered it itself), or
+# _UNCHANGED to forward the original bytes without re-encoding them
+_UNCHANGED = object()
 
 _origin_method_handlers = {
     "initialize": _handle_origin_initialize,
@@ -512,23 +2487,74 @@ _origin_method_handlers = {
     "textDocument/hover": _handle_origin_textDocument_hover,
     "textDocument/documentSymbol": _handle_origin_textDocument_documentSymbol,
     "textDocument/references": _handle_origin_textDocument_references,
+    "textDocument/completion": _handle_origin_textDocument_completion,
+    "textDocument/didOpen": _handle_origin_textDocument_didOpen,
+    "textDocument/didChange": _handle_origin_textDocument_didChange,
+    "textDocument/definition": _handle_origin_textDocument_definition,
+    "workspace/symbol": _handle_origin_workspace_symbol,
+    "$/cancelRequest": _handle_origin_cancelRequest,
+    "oclsp/stats": _handle_origin_oclsp_stats,
+}
+
+# Hooks only worth decoding a message for while their gate returns true,
+# otherwise it stays on the fast path
+_origin_handler_gates = {
+    "textDocument/didChange": _incremental_sync_enabled,
 }
 
 
+def _trace_raw(prefix, raw):
+    if _log_enabled(LOG_TRACE):
+        # Only decode what the truncation limit would keep
+        body = raw.body[:_log_max_msg_chars] if _log_max_msg_chars else raw.body
+        _trace_log("%s: %s", prefix, bytes(body).decode("utf-8", errors="replace"), level=LOG_TRACE)
+
 def handle_origin_client_message(body_bytes, inject_queue):
     """
     Handle messages from Origin → cpptools.
-    Return a list of messages (bytes) to forward.
+    Return a list of messages to forward: RawMessage for the byte-level fast
+    path, message objects, which the writer remaps and serializes, or raw
+    bytes if the body is not valid JSON.
     """
-    msg = json.loads(body_bytes)
-    _trace_log(f"[Client]: {msg}")
+    global _last_activity
+    _last_activity = time.monotonic()
+    _count_traffic("fromOrigin", len(body_bytes))
+    if _capture is not None:
+        _capture_frame("fromOrigin", body_bytes)
+    raw = scan_envelope(body_bytes)
+    if _prewarm is not None and (raw is None or raw.method not in _PREWARM_QUIET_METHODS):
+        # Real work for cpptools, it must not wait for the warm-up
+        _end_prewarm(_prewarm, f"Origin sent {raw.method if raw is not None else 'a message'}")
+    if raw is not None:
+        gate = _origin_handler_gates.get(raw.method)
+        if raw.method not in _origin_method_handlers or (gate is not None and not gate()):
+            # No handler needs the payload, only the id will be rewritten
+            _trace_raw("[Client]", raw)
+            return [raw]
+
+    try:
+        msg = json_loads(body_bytes)
+    except Exception:
+        _trace_log("[Client raw]: %r", body_bytes.tobytes() if isinstance(body_bytes, memoryview) else body_bytes)
+        return [body_bytes]
+
+    _trace_log("[Client]: %s", msg, level=LOG_TRACE)
     method = msg.get("method")
     handler = _origin_method_handlers.get(method)
     if handler is not None:
+        start = time.perf_counter()
         out = handler(msg, inject_queue)
+        _add_latency(_origin_handler_time, method, time.perf_counter() - start)
+        if out is _UNCHANGED:
+            return [raw if raw is not None else body_bytes]
         if out is not None:
+            if not out and "id" in msg:
+                _count_answered_locally(method)
             return out
-    return [body_bytes]
+    elif "id" not in msg or method is None:
+        # Nothing to transform or remap, forward the original bytes untouched
+        return [body_bytes]
+    return [msg]
 
 
 def _fix_completion_documentation(msg):
@@ -562,7 +2588,12 @@ def _fix_completion_documentation(msg):
             # Replace with string value for older Origin versions
             item["documentation"] = doc.get("value", "")
 
-def _handle_lsp_initialize(msg):
+def _handle_lsp_initialize(msg, context):
+    global _server_incremental_sync, _startup_server_info
+    _mark_startup("cpptools initialize")
+    _startup_server_info = (msg.get("result") or {}).get("serverInfo")
+    sync = ((msg.get("result") or {}).get("capabilities") or {}).get("textDocumentSync")
+    _server_incremental_sync = (sync.get("change") if isinstance(sync, dict) else sync) == _SYNC_INCREMENTAL
     # Modify the initialize response to enable hoverProvider
     # Ensure the result and capabilities exist
     if "result" not in msg:
@@ -576,20 +2607,25 @@ def _handle_lsp_initialize(msg):
         msg["result"]["capabilities"]["documentSymbolProvider"] = True
         msg["result"]["capabilities"]["referencesProvider"] = True
         msg["result"]["capabilities"]["general"]["positionEncodings"] = ["utf-8"]
-    _trace_log(f"modified initialize response: {msg}")
-    out = [json.dumps(msg).encode("utf-8")]
-    return out
+    _trace_log("modified initialize response: %s", msg)
+    if _daemon:
+        _answer_initialize_waiters(msg)
 
-def _handle_lsp_completion(msg):
+def _handle_lsp_completion(msg, context):
+    if not _startup_reported and msg.get("result") is not None:
+        _report_startup()
     if _ORG_VERSION < 10.35:
         _fix_completion_documentation(msg)
+    if context is not None and "result" in msg:
+        uri, entry = context
+        _store_completion_result(uri, entry, msg["result"])
 
 
-def _handle_lsp_hover(msg):
+def _handle_lsp_hover(msg, context):
     """
     Intercept and modify the hover response from cpptools before sending to Origin.
     """
-    _trace_log(f"Intercepted cpptools/hover response: {msg}")
+    _trace_log("Intercepted cpptools/hover response: %s", msg, level=LOG_TRACE)
     
     result = msg.get("result")
     if result and "contents" in result:
@@ -603,37 +2639,50 @@ def _handle_lsp_hover(msg):
             if "value" in contents and "kind" not in contents:
                 contents["kind"] = "markdown"
 
-def _flatten_symbols(symbols, parent_name=None):
+    if context is not None and result and "error" not in msg:
+        _hover_cache_put(context, result)
+
+def _handle_lsp_definition(msg, context):
+    # context: the name under the cursor, if cpptools was asked while still indexing
+    if context is None or "error" in msg or msg.get("result") or _symbol_index is None:
+        return
+    locations = _symbol_index.locations(context)
+    if locations:
+        msg["result"] = locations
+        _symbol_index_stats["filled"] += 1
+
+def _flatten_symbols(symbols):
+    """
+    Flatten the symbol tree in document order (parent before its children).
+    Children get the name of their parent as detail; top-level symbols get
+    an empty detail if they have none. Uses an explicit stack of iterators
+    so deeply nested structs can't hit the recursion limit.
+    """
     flat_list = []
-    for sym in symbols:
-        # Create a shallow copy to avoid modifying the original dict in nested calls unexpectedly
-        # though we are popping children, so we are modifying it.
-        
-        # 1. Handle detail
-        if parent_name:
-            sym['detail'] = parent_name
-        else:
-            # Ensure detail is a string if it exists, or empty string
-            detail = sym.get('detail')
-            if detail is None or not isinstance(detail, str):
+    append = flat_list.append
+    stack = [(iter(symbols), None)]
+    while stack:
+        siblings, parent_name = stack[-1]
+        for sym in siblings:
+            if parent_name:
+                sym['detail'] = parent_name
+            elif not isinstance(sym.get('detail'), str):
                 sym['detail'] = ""
-        
-        # 2. Extract children
-        children = sym.pop('children', [])
-        
-        flat_list.append(sym)
-        
-        if children:
-            flat_list.extend(_flatten_symbols(children, sym.get('name', '')))
-            
+            append(sym)
+            children = sym.pop('children', None)
+            if children:
+                stack.append((iter(children), sym.get('name', '')))
+                break
+        else:
+            stack.pop()
     return flat_list
 
-def _handle_lsp_documentSymbol(msg):
+def _handle_lsp_documentSymbol(msg, context):
     """
     Intercept and modify the documentSymbol response from cpptools.
     cpptools returns { "symbols": [...] }, but LSP expects [...] or null.
     """
-    _trace_log(f"Intercepted cpptools/getDocumentSymbols response: {msg}")
+    _trace_log("Intercepted cpptools/getDocumentSymbols response: %s", msg, level=LOG_TRACE)
     
     result = msg.get("result")
     if isinstance(result, dict) and "symbols" in result:
@@ -645,6 +2694,13 @@ def _handle_lsp_documentSymbol(msg):
         if isinstance(symbols, list):
             msg["result"] = _flatten_symbols(symbols)
 
+    if context is not None and "error" not in msg:
+        uri, version = context
+        document = _open_documents.get(uri)
+        # Don't keep a result computed for a version that is already stale
+        if document is not None and document.version == version:
+            _document_symbol_cache[uri] = (version, msg.get("result"))
+
 
 class ReferenceType(IntEnum):
     Confirmed = 0
@@ -655,28 +2711,65 @@ class ReferenceType(IntEnum):
     CannotConfirm = 5
     NotAReference = 6
 
-def _handle_lsp_references(msg):
+@functools.lru_cache(maxsize=4096)
+def _path_to_uri(file_path):
+    from pathlib import Path
+    # References come in runs from the same file; don't rebuild the URI each time
+    return Path(file_path).as_uri()
+
+_DEFAULT_REFERENCES_BATCH_SIZE = 1000
+
+def _references_batch_size():
+    return _config_number("referencesBatchSize", _DEFAULT_REFERENCES_BATCH_SIZE, integer=True)
+
+_DEFAULT_ALLOWED_REF_TYPES = frozenset((
+    ReferenceType.Confirmed,
+    ReferenceType.ConfirmationInProgress,
+    #ReferenceType.Comment,
+    #ReferenceType.String,
+    ReferenceType.Inactive,
+    ReferenceType.CannotConfirm,
+    #ReferenceType.NotAReference
+))
+# (config view, reference types kept), validated once per config
+_allowed_ref_types = (None, _DEFAULT_ALLOWED_REF_TYPES)
+
+def _allowed_reference_types():
+    """The ReferenceType values "allowed_ref_type" in OCLSP.json keeps, the default if it isn't a list of ints."""
+    global _allowed_ref_types
+    config = get_oclsp_config()
+    checked, allowed = _allowed_ref_types
+    if checked is config:
+        return allowed
+    value = config.get("allowed_ref_type")
+    allowed = _DEFAULT_ALLOWED_REF_TYPES
+    if value is not None:
+        ints = [v for v in value if isinstance(v, int) and not isinstance(v, bool)] if isinstance(value, tuple) else []
+        if not ints and value != ():
+            _trace_log("allowed_ref_type: expected a list of integers, got %s; using the default", value, level=LOG_WARNING)
+        else:
+            if len(ints) != len(value):
+                _trace_log("allowed_ref_type: ignoring entries that aren't integers in %s", value, level=LOG_WARNING)
+            allowed = frozenset(ints)
+    _allowed_ref_types = (config, allowed)
+    return allowed
+
+def _handle_lsp_references(msg, context):
     """
     Intercept and modify the references response from cpptools.
     cpptools returns { "referenceInfos": [...] }, but LSP expects Location[].
+    If Origin passed a partialResultToken (the context), the locations are
+    sent in batches through $/progress as they are converted, and the final
+    reply is empty.
     """
-    _trace_log(f"Intercepted cpptools/findAllReferences response: {msg}")
+    _trace_log("Intercepted cpptools/findAllReferences response: %s", msg, level=LOG_TRACE)
     
     result = msg.get("result")
     locations = []
 
-    allowed_ref_type = [
-        ReferenceType.Confirmed,
-        ReferenceType.ConfirmationInProgress,
-        #ReferenceType.Comment,
-        #ReferenceType.String,
-        ReferenceType.Inactive,
-        ReferenceType.CannotConfirm,
-        #ReferenceType.NotAReference
-    ]
-    config = get_oclsp_config()
-    if "allowed_ref_type" in config:
-        allowed_ref_type = config["allowed_ref_type"]
+    allowed_ref_type = _allowed_reference_types()
+
+    batch_size = _references_batch_size() if context is not None else 0
     
     if isinstance(result, dict) and "referenceInfos" in result:
         infos = result["referenceInfos"]
@@ -691,7 +2784,7 @@ def _handle_lsp_references(msg):
                 ref_type = info.get("type", 0)
                 if ref_type not in allowed_ref_type:
                     continue
-                uri = Path(file_path).as_uri()
+                uri = _path_to_uri(file_path)
                 
                 # cpptools returns just a start position. We need a range.
                 # We'll create a zero-length range or try to guess length from text if reliable.
@@ -707,205 +2800,1400 @@ def _handle_lsp_references(msg):
                     "type": ref_type
                 }
                 locations.append(loc)
-                
+                if batch_size and len(locations) >= batch_size:
+                    _send_partial_result(context, locations)
+                    locations = []
+
+    if batch_size:
+        if locations:
+            _send_partial_result(context, locations)
+        locations = []
     msg["result"] = locations
 
+def _send_partial_result(token, values):
+    _trace_log("[References] partial result: %d locations", len(values))
+    send_to_client({
+        "jsonrpc": "2.0",
+        "method": "$/progress",
+        "params": {"token": token, "value": values},
+    })
+
 
 _lsp_method_handlers = {
     "initialize": _handle_lsp_initialize,
     "textDocument/completion": _handle_lsp_completion,
+    "textDocument/definition": _handle_lsp_definition,
     "cpptools/hover": _handle_lsp_hover,
     "cpptools/getDocumentSymbols": _handle_lsp_documentSymbol,
     "cpptools/findAllReferences": _handle_lsp_references,
 }
 
+# Handlers with nothing to do unless the request was tracked with a context,
+# replies without one stay on the fast path
+_lsp_context_handlers = frozenset((
+    "textDocument/definition",
+))
+
+# Notifications from cpptools whose content the proxy tracks, they are
+# forwarded to Origin as they are
+_lsp_notification_observers = {
+    "cpptools/reportStatus": _observe_lsp_reportStatus,
+}
+
+
+def handle_lsp_server_message(body_bytes):
+    """
+    Handle messages from cpptools -> Origin.
+    Return the message to forward (a RawMessage, a message object or the
+    original bytes), or None to swallow; _send_from_server writes it to the
+    right Origin. Only responses whose method has a registered handler are fully decoded.
+    """
+    _count_traffic("fromServer", len(body_bytes))
+    if _capture is not None:
+        _capture_frame("fromServer", body_bytes)
+    # Set to the session a reply goes to, see _send_from_server
+    _session_local.session = None
+    raw = scan_envelope(body_bytes)
+    msg = None
+    if raw is None:
+        try:
+            msg = json_loads(body_bytes)
+        except Exception:
+            _trace_log("[LSP Server raw]: %r", body_bytes.tobytes() if isinstance(body_bytes, memoryview) else body_bytes)
+            return None
+        _trace_log("[LSP Server]: %s", msg, level=LOG_TRACE)
+        if not isinstance(msg, dict) or "id" not in msg or "method" in msg:
+            if _prewarm_uri is not None and _about_prewarm_document(msg) and "id" not in msg:
+                _trace_log("[Prewarm] swallow %s", msg.get("method"))
+                return None
+            observer = _lsp_notification_observers.get(msg.get("method")) if isinstance(msg, dict) else None
+            if observer is not None:
+                observer(msg)
+            return body_bytes
+        msg_id = msg["id"]
+    else:
+        _trace_raw("[LSP Server]", raw)
+        # Requests from cpptools carry their own id space, only responses are remapped
+        if raw.method is not None or raw.id_span is None:
+            if (_prewarm_uri is not None and raw.id_span is None and _PREWARM_FILE_RE.search(raw.body)
+                    and _about_prewarm_document(json_loads(raw.body))):
+                _trace_log("[Prewarm] swallow %s", raw.method)
+                return None
+            observer = _lsp_notification_observers.get(raw.method)
+            if observer is not None:
+                observer(json_loads(raw.body))
+            return raw
+        msg_id = raw.id
+
+    record = _request_table.pop(msg_id)
+    if record is None:
+        # Reply to a cancelled, superseded or timed out request, Origin already got an error
+        _trace_log("[IDMAP] drop reply to cancelled id=%s", msg_id)
+        return None
+
+    if record.client_id is None:
+        _trace_log("[IDMAP] swallow injected response id=%s", msg_id)
+        if isinstance(record.context, threading.Event):
+            # Someone is waiting for this reply, e.g. a restart for initialize
+            record.context.set()
+        elif callable(record.context):
+            record.context()
+        return None
+
+    client_id, method, context = record.client_id, record.method, record.context
+    _forget_interactive_request(record)
+    _session_local.session = record.session
+    _trace_log("[IDMAP] map back cpptools_id=%s -> client_id=%s", msg_id, client_id)
+
+    handler = _lsp_method_handlers.get(method)
+    if context is None and method in _lsp_context_handlers:
+        handler = None
+    if handler is None and raw is not None:
+        raw.replace_id(client_id)
+        _add_latency(_request_latency, method, time.perf_counter() - record.sent, raw.is_error)
+        return raw
+
+    if msg is None:
+        msg = json_loads(body_bytes)
+    msg["id"] = client_id
+    # Dispatch to handler based on method
+    if handler:
+        start = time.perf_counter()
+        handler(msg, context)
+        _add_latency(_server_handler_time, method, time.perf_counter() - start)
+    _add_latency(_request_latency, method, time.perf_counter() - record.sent, "error" in msg)
+    return msg
+
+###############################################################################
+# cpptools restarts
+###############################################################################
+
+# Restarts allowed within _RESTART_WINDOW seconds before the proxy exits with
+# cpptools, overridden by "cpptoolsRestarts" in OCLSP.json (0 = never restart)
+_DEFAULT_MAX_RESTARTS = 3
+_RESTART_WINDOW = 600.0
+# Delay before the n-th restart within the window: 1, 2, 4... seconds
+_RESTART_BACKOFF_BASE = 1.0
+_RESTART_BACKOFF_MAX = 30.0
+# How long a restarted cpptools gets to answer the replayed initialize
+_RESTART_INITIALIZE_TIMEOUT = 60.0
+
+# Held while a message from Origin is forwarded, and by a restart while it
+# switches _cpptools_restarting and reopens the documents
+_restart_lock = threading.Lock()
+# Set from cpptools' exit until the new one has been sent the session
+_cpptools_restarting = False
+# Origin sent shutdown or exit, so cpptools exiting is expected
+_client_exiting = False
+# time.monotonic() of the restarts within the window
+_restart_times = collections.deque()
+_restart_count = 0
+
+def _max_restarts():
+    return _config_number("cpptoolsRestarts", _DEFAULT_MAX_RESTARTS, integer=True)
+
+def _restarts_enabled():
+    return not _client_exiting and _max_restarts() > 0
+
+class _ServerPipe:
+    """
+    cpptools' stdin as the writers see it. A restart swaps in the new
+    process' pipe. While cpptools is down, writes are dropped rather than
+    shutting the proxy down; whatever matters is replayed after the restart.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        try:
+            return self.stream.write(data)
+        except (OSError, ValueError):
+            if not _restarts_enabled():
+                raise
+            return None
+
+    def flush(self):
+        try:
+            self.stream.flush()
+        except (OSError, ValueError):
+            if not _restarts_enabled():
+                raise
+
+class _DirectInjectQueue:
+    """Stand-in for the inject queue that writes at once, so a replay keeps its order."""
+    def __init__(self, server_out):
+        self._server_out = server_out
+
+    def put(self, msg):
+        write_lsp_message(self._server_out, msg, to_lsp_server=True, lock=_server_stdin_lock)
+
+def _begin_restart(code):
+    """
+    cpptools exited with `code`. Returns the delay before starting a new one,
+    or None if the proxy should exit instead. Requests cpptools didn't answer
+    are failed with ContentModified, so Origin can simply send them again.
+    """
+    global _cpptools_restarting, _restart_count, _cpptools_ready, _cpptools_started
+    if _shutdown_event.is_set() or not _restarts_enabled() or _origin_initialize_params is None:
+        return None
+    now = time.monotonic()
+    while _restart_times and now - _restart_times[0] > _RESTART_WINDOW:
+        _restart_times.popleft()
+    if len(_restart_times) >= _max_restarts():
+        _trace_log("[Restart] cpptools exited %d times within %.0fs, giving up",
+                   len(_restart_times) + 1, _RESTART_WINDOW, level=LOG_ERROR)
+        return None
+    delay = min(_RESTART_BACKOFF_BASE * 2 ** len(_restart_times), _RESTART_BACKOFF_MAX)
+    _restart_times.append(now)
+    _restart_count += 1
+
+    with _restart_lock:
+        _cpptools_restarting = True
+    # The new cpptools indexes the workspace again, the symbol index covers for it meanwhile
+    _cpptools_ready = False
+    _drop_prewarm()
+    _cpptools_started = time.monotonic() + delay
+    with _latest_interactive_lock:
+        _latest_interactive_request.clear()
+        _interactive_request_keys.clear()
+    failed = 0
+    for record in _request_table.take_all():
+        if record.client_id is not None:
+            failed += 1
+            record.session.send(_make_error_response(record.client_id, CONTENT_MODIFIED, "cpptools exited, please retry"))
+    _trace_log("[Restart] cpptools exited with code %s, restarting in %.0fs (%d requests failed)",
+               code, delay, failed, level=LOG_WARNING)
+    _broadcast({
+        "jsonrpc": "2.0",
+        "method": "window/logMessage",
+        "params": {"type": 2, "message": f"OCLSP: cpptools exited with code {code}, restarting it"},
+    })
+    return delay
+
+def _replay_initialize(server_out):
+    """
+    Send a new cpptools the initialize Origin sent, with the workspace folders
+    of the current config. Returns an Event that is set when it is answered.
+    """
+    answered = threading.Event()
+    proxy_id = next(_proxy_id_gen)
+    msg = {"jsonrpc": "2.0", "id": proxy_id, "method": "initialize", "params": _origin_initialize_params}
+    _prepare_initialize_params(msg["params"])
+    _track_request(proxy_id, None, "initialize", answered)
+    write_lsp_message(server_out, msg, to_lsp_server=True, lock=_server_stdin_lock)
+    return answered
+
+def _replay_session(server_out):
+    """Once the replayed initialize is answered: configure cpptools as before and reopen Origin's documents."""
+    global _cpptools_restarting
+    # Both locks until the end: a workspace activated or a config change
+    # noticed meanwhile must not fall between the replay and going live
+    with _config_push_lock, _restart_lock:
+        if _cpptools_configured:
+            send_notification(server_out, "initialized", {}, to_lsp_server=True, lock=_server_stdin_lock)
+            _send_cpptools_configuration(_DirectInjectQueue(server_out))
+        for document in list(_open_documents.values()):
+            send_notification(server_out, "textDocument/didOpen", {"textDocument": {
+                "uri": document.uri,
+                "languageId": document.language_id,
+                "version": document.version,
+                "text": document.text,
+            }}, to_lsp_server=True, lock=_server_stdin_lock)
+        _cpptools_restarting = False
+    _trace_log("[Restart] session replayed, %d documents reopened", len(_open_documents), level=LOG_INFO)
+
+def _spawn_cpptools(cpptools_path):
+    return subprocess.Popen(
+        [cpptools_path, "--stdio"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        bufsize=0
+    )
+
+def _start_server_threads(process):
+    """The threads reading one cpptools process, they end with it."""
+    for target, stream in ((lsp_server_to_origin_client, process.stdout), (handle_lsp_server_stderr, process.stderr)):
+        threading.Thread(target=target, args=(stream,), daemon=True).start()
+
+def _restart_cpptools(cpptools_path, server_out, code):
+    """Thread engine: replace an exited cpptools and replay the session to it. False to exit instead."""
+    global _cpptools_process
+    delay = _begin_restart(code)
+    if delay is None or _shutdown_event.wait(delay):
+        return False
+    start = time.perf_counter()
+    try:
+        process = _spawn_cpptools(cpptools_path)
+    except OSError as e:
+        _trace_log("[Restart] starting cpptools failed: %s", e, level=LOG_ERROR)
+        return False
+    _cpptools_process = process
+    server_out.stream = process.stdin
+    _start_server_threads(process)
+    answered = _replay_initialize(server_out)
+    deadline = time.monotonic() + _RESTART_INITIALIZE_TIMEOUT
+    while not answered.wait(0.1):
+        if process.poll() is not None or _shutdown_event.is_set():
+            # The main loop sees it exit and decides what's next
+            return True
+        if time.monotonic() > deadline:
+            _trace_log("[Restart] cpptools didn't answer initialize, killing it", level=LOG_ERROR)
+            process.kill()
+            return True
+    _replay_session(server_out)
+    _trace_log("[Restart] cpptools restarted in %.2fs", time.perf_counter() - start, level=LOG_INFO)
+    return True
+
+###############################################################################
+# Worker threads
+###############################################################################
+
+def _send_from_server(out):
+    """
+    Write what handle_lsp_server_message returned: a reply to the Origin that
+    asked, diagnostics to every Origin that has the document open, and
+    anything else cpptools sends on its own to the primary session.
+    """
+    session = getattr(_session_local, "session", None)
+    if session is not None:
+        session.send(out)
+        return
+    if _daemon:
+        method = out.method if isinstance(out, RawMessage) else out.get("method") if isinstance(out, dict) else None
+        if method == "textDocument/publishDiagnostics":
+            msg = json_loads(out.body) if isinstance(out, RawMessage) else out
+            uri = msg.get("params", {}).get("uri")
+            sessions = [s for s in _all_sessions() if uri in s.documents]
+            if sessions:
+                for session in sessions:
+                    session.send(out)
+                return
+    session = _primary_session()
+    if session is not None:
+        session.send(out)
+
+def _send_server_stderr(line):
+    text = line.decode("utf-8", errors="replace").rstrip()
+    _trace_log("[LSP Server stderr]: %s", text)
+    session = _primary_session()
+    if session is not None:
+        session.send({
+            "jsonrpc": "2.0",
+            "method": "cpptools/stderr",
+            "params": {
+                "message": text,
+                "timestamp": time.time()
+            }
+        })
+
+def forward_to_lsp_server(server_out, out, received=None):
+    """
+    Writer side of Origin -> cpptools: remap the request id and serialize once.
+    Responses from Origin (to cpptools requests) keep their id.
+    """
+    global _client_exiting
+    method = None
+    cpptools_id = None
+    context = None
+    if isinstance(out, RawMessage):
+        method = out.method
+        client_id = out.id if out.id_span is not None else None
+    elif isinstance(out, dict):
+        method = out.get("method")
+        client_id = out.get("id")
+        context = out.pop(_CONTEXT_KEY, None)
+    if method == "shutdown" or method == "exit":
+        # cpptools is about to exit on purpose, don't restart it
+        _client_exiting = True
+    with _restart_lock:
+        if _cpptools_restarting:
+            # Notifications are dropped, the restart replays the documents
+            if method is not None and client_id is not None:
+                send_to_client(_make_error_response(client_id, CONTENT_MODIFIED, "cpptools is restarting"))
+        else:
+            if isinstance(out, RawMessage):
+                if method is not None and client_id is not None:
+                    cpptools_id = next(_proxy_id_gen)
+                    _track_request(cpptools_id, client_id, method, received=received)
+                    out.replace_id(cpptools_id)
+                    _trace_log("[IDMAP] client_id=%s -> cpptools_id=%s", client_id, cpptools_id)
+            elif isinstance(out, dict):
+                if "id" in out and method is not None:
+                    cpptools_id = next(_proxy_id_gen)
+                    _track_request(cpptools_id, client_id, method, context, received)
+                    out["id"] = cpptools_id
+                    _trace_log("[IDMAP] client_id=%s -> cpptools_id=%s", client_id, cpptools_id)
+            if cpptools_id is not None and method in _SUPERSEDED_METHODS and _supersede_enabled():
+                _supersede_previous_request(server_out, method, out, cpptools_id)
+            write_lsp_message(server_out, out, to_lsp_server=True, lock=_server_stdin_lock)
+
+    observer = _origin_method_observers.get(method)
+    if observer is not None:
+        msg = out if isinstance(out, dict) else json_loads(out.body)
+        observer(msg, context)
+
+
+def origin_client_to_lsp_server(client_in, server_out, inject_queue):
+    reader = LspFrameReader(client_in)
+    try:
+        while not _shutdown_event.is_set():
+            body = reader.read_message()
+            if body is None:
+                # EOF from client means we should shut down
+                trigger_shutdown("EOF from Origin client")
+                break
+
+            received = time.perf_counter()
+            out_messages = handle_origin_client_message(body, inject_queue)
+            for out in out_messages:
+                forward_to_lsp_server(server_out, out, received)
+    except Exception as e:
+        log_exception(f"origin_client_to_lsp_server: {e}")
+        trigger_shutdown("Exception in origin_client_to_lsp_server")
+
+
+def lsp_server_to_origin_client(server_in):
+    reader = LspFrameReader(server_in)
+    try:
+        while not _shutdown_event.is_set():
+            body = reader.read_message()
+            if body is None:
+                if not _restarts_enabled():
+                    trigger_shutdown("EOF from LSP server")
+                # else the main loop sees cpptools exit and restarts it
+                break
+
+            out = handle_lsp_server_message(body)
+            if out is not None:
+                _send_from_server(out)
+    except Exception as e:
+        log_exception(f"lsp_server_to_origin_client: {e}")
+        trigger_shutdown("Exception in lsp_server_to_origin_client")
+
+
+def msg_injection_to_lsp_server(server_out, inject_queue):
+    try:
+        while not _shutdown_event.is_set():
+            try:
+                body = inject_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            _trace_log("[Injected to LSP]: %s", body, level=LOG_TRACE)
+            write_lsp_message(server_out, body, to_lsp_server=True, lock=_server_stdin_lock)
+    except Exception as e:
+        log_exception(f"msg_injection_to_lsp_server: {e}")
+        trigger_shutdown("Exception in msg_injection_to_lsp_server")
+
+
+def handle_lsp_server_stderr(stderr):
+    try:
+        while not _shutdown_event.is_set():
+            try:
+                line = stderr.readline()
+            except (ValueError, OSError):
+                break
+
+            if not line:
+                break
+
+            _send_server_stderr(line)
+    except Exception as e:
+        log_exception(f"handle_lsp_server_stderr: {e}")
+        # Don't necessarily shutdown on stderr error, but logging it is good
+        pass
+
+###############################################################################
+# asyncio engine (OCLSP_ENGINE=asyncio)
+###############################################################################
+
+class _AsyncInjectQueue:
+    """
+    Stand-in for the queue.Queue handed to interception hooks.
+    put() is safe from any thread and wakes the injection task immediately
+    instead of being polled.
+    """
+    def __init__(self, loop, queue):
+        self._loop = loop
+        self._queue = queue
+
+    def put(self, item):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+class _AsyncPipeWriter:
+    """
+    Adapts an asyncio StreamWriter to the stream interface write_lsp_message
+    uses. A restart swaps in the new process' writer.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data):
+        # The transport sends what it can now and buffers the rest; once
+        # cpptools is gone it drops the data
+        self.writer.write(data)
+
+    def flush(self):
+        pass
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            if not _restarts_enabled():
+                raise
 
-def handle_lsp_server_message(body_bytes):
+class _QueuedPipeWriter:
     """
-    Handle messages from cpptools -> Origin.
-    Return modified bytes, or None to swallow.
+    Origin's stdout for the asyncio engine. Writes are queued and done by a
+    thread of its own, so an Origin slow to read doesn't stall the event
+    loop. Chunks are queued in order under the caller's lock, the thread is
+    the only one writing to the pipe.
     """
-    try:
-        msg = json.loads(body_bytes)
-    except Exception:
-        _trace_log(f"[LSP Server raw]: {body_bytes!r}")
-        return None
+    def __init__(self, stream):
+        self._stream = stream
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-    _trace_log(f"[LSP Server]: {msg}")
+    def write(self, data):
+        # Copied, a memoryview may point into a reader's buffer that is reused
+        self._queue.put(bytes(data))
+        return len(data)
 
-    if "id" in msg:
-        msg_id = msg["id"]
-        if msg_id in _pending_proxy_requests:
-            _trace_log(f"[IDMAP] swallow injected response id={msg_id}")
-            _pending_proxy_requests.discard(msg_id)
+    def flush(self):
+        self._queue.put(b"")
+
+    def close(self, timeout):
+        """Write what is queued, e.g. the reply to shutdown, then stop."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                if data:
+                    _write_all(self._stream, data)
+                else:
+                    self._stream.flush()
+            except OSError:
+                trigger_shutdown("Write failed (BrokenPipe)")
+                return
+
+async def _async_read_lsp_message(reader):
+    """Read one LSP message body from an asyncio StreamReader, or None on EOF."""
+    import asyncio
+    while True:
+        try:
+            header = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
             return None
-        if msg_id in _id_map_cpptools_to_client:
-            entry = _id_map_cpptools_to_client.pop(msg_id)
-            
-            # Handle tuple (client_id, method) or legacy client_id
-            if isinstance(entry, tuple):
-                client_id, method = entry
-            else:
-                client_id = entry
-                method = None
+        length = None
+        for line in header.split(b"\r\n"):
+            key, sep, value = line.partition(b":")
+            if sep and key.strip().lower() == b"content-length":
+                try:
+                    length = int(value)
+                except ValueError:
+                    length = None
+        if length is None:
+            continue
+        try:
+            return await reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+async def _async_lsp_server_to_origin_client(server_in):
+    try:
+        while not _shutdown_event.is_set():
+            body = await _async_read_lsp_message(server_in)
+            if body is None:
+                if not _restarts_enabled():
+                    trigger_shutdown("EOF from LSP server")
+                break
+
+            out = handle_lsp_server_message(body)
+            if out is not None:
+                _send_from_server(out)
+    except Exception as e:
+        log_exception(f"_async_lsp_server_to_origin_client: {e}")
+        trigger_shutdown("Exception in _async_lsp_server_to_origin_client")
+
+async def _async_msg_injection_to_lsp_server(server_out, queue):
+    try:
+        while not _shutdown_event.is_set():
+            body = await queue.get()
+            _trace_log("[Injected to LSP]: %s", body, level=LOG_TRACE)
+            write_lsp_message(server_out, body, to_lsp_server=True, lock=_server_stdin_lock)
+            await server_out.drain()
+    except ConnectionError:
+        trigger_shutdown("Write failed (BrokenPipe)")
+    except Exception as e:
+        log_exception(f"_async_msg_injection_to_lsp_server: {e}")
+        trigger_shutdown("Exception in _async_msg_injection_to_lsp_server")
 
-            _trace_log(f"[IDMAP] map back cpptools_id={msg_id} -> client_id={client_id}")
-            msg["id"] = client_id
+async def _async_forward_origin_messages(server_out, client_queue, backlog, process_message):
+    """Forward Origin's messages in order, each once cpptools has taken the previous ones."""
+    try:
+        while not _shutdown_event.is_set():
+            body = await client_queue.get()
+            try:
+                process_message(body)
+                await server_out.drain()
+            finally:
+                backlog.release()
+    except ConnectionError:
+        trigger_shutdown("Write failed (BrokenPipe)")
+    except Exception as e:
+        log_exception(f"_async_forward_origin_messages: {e}")
+        trigger_shutdown("Exception in _async_forward_origin_messages")
 
-            # Dispatch to handler based on method
-            handler = _lsp_method_handlers.get(method)
-            if handler:
-                handler(msg)
+async def _async_expire_requests(server_out):
+    import asyncio
+    try:
+        while not _shutdown_event.is_set():
+            await asyncio.sleep(_REQUEST_SWEEP_INTERVAL)
+            _expire_requests(server_out)
+    except ConnectionError:
+        trigger_shutdown("Write failed (BrokenPipe)")
+    except Exception as e:
+        log_exception(f"_async_expire_requests: {e}")
+        trigger_shutdown("Exception in _async_expire_requests")
 
-            return json.dumps(msg).encode("utf-8")
+async def _async_watch_config(inject_queue):
+    import asyncio
+    while not _shutdown_event.is_set():
+        await asyncio.sleep(_CONFIG_CHECK_INTERVAL)
+        _check_config(inject_queue)
+        _activate_idle_workspaces(inject_queue)
 
-    return body_bytes
+async def _async_handle_lsp_server_stderr(stderr):
+    try:
+        while not _shutdown_event.is_set():
+            line = await stderr.readline()
+            if not line:
+                break
 
-###############################################################################
-# Worker threads
-###############################################################################
+            _send_server_stderr(line)
+    except Exception as e:
+        log_exception(f"_async_handle_lsp_server_stderr: {e}")
 
-def origin_client_to_lsp_server(client_in, server_out, inject_queue):
+def _async_origin_client_reader(client_in, loop, client_queue, backlog):
+    """
+    Origin's stdin is read on a plain thread: Windows can't do overlapped
+    reads on the anonymous pipe Origin hands us. Bodies are handed to the
+    event loop without waiting for it; they are copied out first because the
+    reader reuses its buffer for the next message. Once `backlog` is used up,
+    reading stops until cpptools takes messages again.
+    """
+    reader = LspFrameReader(client_in)
     try:
         while not _shutdown_event.is_set():
-            body = read_lsp_message(client_in, from_lsp_server=False)
+            body = reader.read_message()
             if body is None:
                 # EOF from client means we should shut down
                 trigger_shutdown("EOF from Origin client")
                 break
+            body = bytes(body)
+            while not backlog.acquire(timeout=_REQUEST_SWEEP_INTERVAL):
+                if _shutdown_event.is_set():
+                    return
+            loop.call_soon_threadsafe(client_queue.put_nowait, body)
+    except Exception as e:
+        if not _shutdown_event.is_set():
+            log_exception(f"_async_origin_client_reader: {e}")
+            trigger_shutdown("Exception in _async_origin_client_reader")
+
+def _async_server_tasks(process):
+    """The tasks reading one cpptools process, they end with it."""
+    import asyncio
+    return [
+        asyncio.create_task(_async_lsp_server_to_origin_client(process.stdout)),
+        asyncio.create_task(_async_handle_lsp_server_stderr(process.stderr)),
+    ]
+
+async def _async_restart_cpptools(cpptools_path, server_out, code):
+    """
+    asyncio engine: replace an exited cpptools and replay the session to it.
+    Returns (process, its tasks), or None to exit instead.
+    """
+    import asyncio
+    global _cpptools_process
+    delay = _begin_restart(code)
+    if delay is None:
+        return None
+    await asyncio.sleep(delay)
+    if _shutdown_event.is_set():
+        return None
+    start = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            cpptools_path, "--stdio",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except OSError as e:
+        _trace_log("[Restart] starting cpptools failed: %s", e, level=LOG_ERROR)
+        return None
+    _cpptools_process = process
+    server_out.writer = process.stdin
+    tasks = _async_server_tasks(process)
+    answered = _replay_initialize(server_out)
+    deadline = time.monotonic() + _RESTART_INITIALIZE_TIMEOUT
+    while not answered.is_set():
+        if process.returncode is not None or _shutdown_event.is_set():
+            # The main loop sees it exit and decides what's next
+            return process, tasks
+        if time.monotonic() > deadline:
+            _trace_log("[Restart] cpptools didn't answer initialize, killing it", level=LOG_ERROR)
+            process.kill()
+            return process, tasks
+        await asyncio.sleep(0.05)
+    _replay_session(server_out)
+    _trace_log("[Restart] cpptools restarted in %.2fs", time.perf_counter() - start, level=LOG_INFO)
+    return process, tasks
+
+async def _async_main(cpptools_path):
+    import asyncio
+    global _cpptools_process
+    loop = asyncio.get_running_loop()
+
+    shutdown = asyncio.Event()
+    _shutdown_callbacks.append(lambda: loop.call_soon_threadsafe(shutdown.set))
+
+    process = await asyncio.create_subprocess_exec(
+        cpptools_path, "--stdio",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _cpptools_process = process
+    _mark_startup("cpptools spawned")
+    _trace_log("JSON backend: %s", _json_backend())
+    _cpptools_payloads()
+    _start_symbol_index()
+    server_out = _AsyncPipeWriter(process.stdin)
+    injected_msg_queue = asyncio.Queue()
+    inject_queue = _AsyncInjectQueue(loop, injected_msg_queue)
+    global _client_out
+    _client_out = _QueuedPipeWriter(sys.stdout.buffer)
+    client_queue = asyncio.Queue()
+    backlog = threading.BoundedSemaphore(_ASYNC_ORIGIN_BACKLOG)
 
+    def process_client_message(body):
+        try:
+            received = time.perf_counter()
             out_messages = handle_origin_client_message(body, inject_queue)
             for out in out_messages:
-                try:
-                    msg = json.loads(out)
-                except Exception:
-                    # Forward raw bytes if not valid JSON
-                    write_lsp_message(server_out, out, to_lsp_server=True, lock=_server_stdin_lock)
-                    continue
+                forward_to_lsp_server(server_out, out, received)
+        except ConnectionError:
+            trigger_shutdown("Write failed (BrokenPipe)")
+        except Exception as e:
+            log_exception(f"process_client_message: {e}")
+            trigger_shutdown("Exception in process_client_message")
 
-                if "id" in msg:
-                    client_id = msg["id"]
-                    method = msg.get("method")
-                    cpptools_id = next(_proxy_id_gen)
-                    _id_map_cpptools_to_client[cpptools_id] = (client_id, method)
-                    msg["id"] = cpptools_id
-                    _trace_log(f"[IDMAP] client_id={client_id} -> cpptools_id={cpptools_id}")
-                    out = json.dumps(msg).encode("utf-8")
+    tasks = [
+        asyncio.create_task(_async_msg_injection_to_lsp_server(server_out, injected_msg_queue)),
+        asyncio.create_task(_async_forward_origin_messages(server_out, client_queue, backlog, process_client_message)),
+        asyncio.create_task(_async_expire_requests(server_out)),
+        asyncio.create_task(_async_watch_config(inject_queue)),
+    ]
+    tasks += _async_server_tasks(process)
+    threading.Thread(
+        target=_async_origin_client_reader,
+        args=(sys.stdin.buffer, loop, client_queue, backlog),
+        daemon=True
+    ).start()
 
-                write_lsp_message(server_out, out, to_lsp_server=True, lock=_server_stdin_lock)
-    except Exception as e:
-        log_exception(f"origin_client_to_lsp_server: {e}")
-        trigger_shutdown("Exception in origin_client_to_lsp_server")
+    # Wait for cpptools to exit or shutdown signal, no polling
+    if _shutdown_event.is_set():
+        shutdown.set()
+    shutdown_task = asyncio.create_task(shutdown.wait())
+    while True:
+        exit_task = asyncio.create_task(process.wait())
+        await asyncio.wait((exit_task, shutdown_task), return_when=asyncio.FIRST_COMPLETED)
+        if exit_task.done():
+            code = process.returncode
+            _trace_log("cpptools exited with code %s", code)
+            restarted = await _async_restart_cpptools(cpptools_path, server_out, code)
+            if restarted is not None:
+                process, server_tasks = restarted
+                tasks += server_tasks
+                continue
+            trigger_shutdown(f"cpptools exited with code {code}")
+        else:
+            _trace_log("Shutdown event detected in main loop")
+            try:
+                await asyncio.wait_for(exit_task, timeout=2)
+            except asyncio.TimeoutError:
+                _trace_log("Killing cpptools...")
+                process.kill()
+                await exit_task
+        break
 
+    for task in tasks + [shutdown_task]:
+        task.cancel()
+    await asyncio.gather(*tasks, shutdown_task, return_exceptions=True)
+    _client_out.close(timeout=2)
+    _trace_log("[Requests] %s", _request_table.stats(), level=LOG_INFO)
 
-def lsp_server_to_origin_client(server_in, client_out):
-    try:
-        while not _shutdown_event.is_set():
-            body = read_lsp_message(server_in, from_lsp_server=True)
-            if body is None:
-                trigger_shutdown("EOF from LSP server")
-                break
+###############################################################################
+# Shared daemon (OCLSP_SHARED)
+###############################################################################
 
-            out = handle_lsp_server_message(body)
-            if out is not None:
-                write_lsp_message(client_out, out, to_lsp_server=False, lock=_client_stdout_lock)
-    except Exception as e:
-        log_exception(f"lsp_server_to_origin_client: {e}")
-        trigger_shutdown("Exception in lsp_server_to_origin_client")
+# Seconds the daemon keeps cpptools running after the last Origin detached,
+# overridden by "daemonIdleTimeout" in OCLSP.json
+_DEFAULT_DAEMON_IDLE_TIMEOUT = 60
+# How long a thin client waits for the daemon it started before running cpptools itself
+_DAEMON_CONNECT_TIMEOUT = 10.0
+_DAEMON_CONNECT_RETRY = 0.1
+_DAEMON_IDLE_REASON = "No Origin attached to the daemon"
 
+# Messages from the sessions are handled one at a time, as if one Origin sent them all
+_dispatch_lock = threading.Lock()
+# cpptools' answer to the first Origin's initialize, later Origins get the same one
+_initialize_lock = threading.Lock()
+_initialize_result = None
+# (session, client id) of initialize requests that came before that answer
+_initialize_waiters = []
+# time.monotonic() since no Origin is attached, None while one is
+_daemon_idle_since = None
+_daemon_lock_file = None
+_session_ids = itertools.count(start=1)
 
-def msg_injection_to_lsp_server(server_out, inject_queue):
+def _shared_enabled():
+    return os.environ.get("OCLSP_SHARED", "False").lower() == "true"
+
+def _daemon_address():
+    """(listener address, key file, lock file) of the daemon for this Origin installation and cpptools."""
+    import hashlib
+    import tempfile
+    user = os.environ.get("USERNAME") or os.environ.get("USER", "")
+    identity = "|".join((user, _DATASTORAGE_DIR, _ORGDIR_EXE, _CPPTOOLS_PATH, str(_ORG_VERSION)))
+    digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(_DATASTORAGE_DIR, "OCLSP", f"daemon-{digest}")
+    if sys.platform == "win32":
+        address = rf"\\.\pipe\OCLSP-{digest}"
+    else:
+        address = os.path.join(tempfile.gettempdir(), f"OCLSP-{digest}.sock")
+    return address, base + ".key", base + ".lock"
+
+def _lock_daemon_file(path):
+    """
+    The open lock file if this process is now the only daemon for `path`,
+    else None. The OS drops the lock when the process dies, however it dies.
+    """
+    f = open(path, "a+b")
     try:
-        while not _shutdown_event.is_set():
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def _daemon_listen():
+    """Listen for thin clients. None if another daemon already serves this installation."""
+    global _daemon_lock_file
+    from multiprocessing.connection import Listener
+    address, key_path, lock_path = _daemon_address()
+    _daemon_lock_file = _lock_daemon_file(lock_path)
+    if _daemon_lock_file is None:
+        _trace_log("[Daemon] another daemon is already running", level=LOG_INFO)
+        return None
+    # Only processes that can read the user's OCLSP folder may attach
+    key = os.urandom(32)
+    tmp_path = key_path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp_path, key_path)
+    if sys.platform != "win32" and os.path.exists(address):
+        # Left by a daemon that was killed, the lock says it is gone
+        os.unlink(address)
+    listener = Listener(address, authkey=key)
+    _trace_log("[Daemon] listening on %s", address, level=LOG_INFO)
+    return listener
+
+def _self_command():
+    """
+    How this proxy was started, for starting another one: with the same
+    optimization flags and, when run with -m, from its cached bytecode.
+    """
+    flags = ["-" + "O" * sys.flags.optimize] if sys.flags.optimize else []
+    if __spec__ is not None:
+        return [sys.executable, *flags, "-m", __spec__.name]
+    return [sys.executable, *flags, os.path.abspath(__file__)]
+
+def _start_daemon(cpptools_path):
+    """Start the daemon detached from this Origin, so it outlives it."""
+    args = _self_command() + ["--daemon", cpptools_path]
+    kwargs = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    if sys.platform == "win32":
+        flags = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        try:
+            subprocess.Popen(args, creationflags=flags | subprocess.CREATE_BREAKAWAY_FROM_JOB, **kwargs)
+            return
+        except OSError:
+            # The job Origin runs in doesn't allow breaking away
+            pass
+        subprocess.Popen(args, creationflags=flags, **kwargs)
+    else:
+        subprocess.Popen(args, start_new_session=True, **kwargs)
+
+def _connect_daemon(cpptools_path):
+    """A connection to the daemon, started if none is running. None if it can't be reached."""
+    import multiprocessing
+    from multiprocessing.connection import Client
+    address, key_path, _ = _daemon_address()
+    deadline = None
+    while True:
+        try:
+            with open(key_path, "rb") as f:
+                key = f.read()
+            return Client(address, authkey=key)
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+            error = e
+        if deadline is None:
+            _trace_log("[Daemon] none running (%s), starting one", error, level=LOG_INFO)
             try:
-                body = inject_queue.get(timeout=1.0)
-            except queue.Empty:
-                continue
+                _start_daemon(cpptools_path)
+            except OSError as e:
+                _trace_log("[Daemon] starting it failed: %s", e, level=LOG_WARNING)
+                return None
+            deadline = time.monotonic() + _DAEMON_CONNECT_TIMEOUT
+        elif time.monotonic() > deadline:
+            _trace_log("[Daemon] not reachable (%s), running cpptools in this process", error, level=LOG_WARNING)
+            return None
+        time.sleep(_DAEMON_CONNECT_RETRY)
 
-            _trace_log(f"[Injected to LSP]: {body}")
-            write_lsp_message(server_out, body, to_lsp_server=True, lock=_server_stdin_lock)
-    except Exception as e:
-        log_exception(f"msg_injection_to_lsp_server: {e}")
-        trigger_shutdown("Exception in msg_injection_to_lsp_server")
+def _run_shared_client(cpptools_path):
+    """
+    Thin client: relay Origin's messages to the daemon and its messages back,
+    until either side goes away. False if no daemon could be reached.
+    """
+    conn = _connect_daemon(cpptools_path)
+    if conn is None:
+        return False
+    _trace_log("Attached to the shared daemon", level=LOG_INFO)
+    client_out = sys.stdout.buffer
 
+    def relay_to_origin():
+        try:
+            while True:
+                body = conn.recv_bytes()
+                write_lsp_message(client_out, body, to_lsp_server=False, lock=_client_stdout_lock)
+        except (EOFError, OSError):
+            pass
+        trigger_shutdown("Shared daemon closed the connection")
+
+    def relay_to_daemon():
+        reader = LspFrameReader(sys.stdin.buffer)
+        try:
+            while not _shutdown_event.is_set():
+                body = reader.read_message()
+                if body is None:
+                    break
+                _count_traffic("fromOrigin", len(body))
+                conn.send_bytes(body)
+        except (OSError, ValueError) as e:
+            _trace_log("relay_to_daemon: %s", e, level=LOG_WARNING)
+        trigger_shutdown("EOF from Origin client")
+
+    for target in (relay_to_origin, relay_to_daemon):
+        threading.Thread(target=target, daemon=True).start()
+    _shutdown_event.wait()
+    conn.close()
+    return True
+
+def _daemon_idle_timeout():
+    return _config_number("daemonIdleTimeout", _DEFAULT_DAEMON_IDLE_TIMEOUT)
+
+def _daemon_idle_expired():
+    with _sessions_lock:
+        idle_since = _daemon_idle_since
+    return idle_since is not None and time.monotonic() - idle_since >= _daemon_idle_timeout()
+
+def _accept_sessions(listener, server_out, inject_queue):
+    import multiprocessing
+    global _daemon_idle_since
+    while not _shutdown_event.is_set():
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+            if _shutdown_event.is_set():
+                break
+            _trace_log("[Daemon] connection rejected: %s", e, level=LOG_WARNING)
+            continue
+        session = _PipeSession(conn, f"origin-{next(_session_ids)}")
+        with _sessions_lock:
+            _sessions.append(session)
+            _daemon_idle_since = None
+            count = len(_sessions)
+        _trace_log("[Daemon] %s attached, %d sessions", session.name, count, level=LOG_INFO)
+        threading.Thread(target=_daemon_session_reader, args=(session, server_out, inject_queue), daemon=True).start()
 
-def handle_lsp_server_stderr(stderr, client_out):
+def _daemon_session_reader(session, server_out, inject_queue):
+    _session_local.session = session
     try:
         while not _shutdown_event.is_set():
             try:
-                line = stderr.readline()
-            except (ValueError, OSError):
+                body = session.recv()
+            except (EOFError, OSError):
                 break
+            received = time.perf_counter()
+            with _dispatch_lock:
+                for out in handle_origin_client_message(body, inject_queue):
+                    forward_to_lsp_server(server_out, out, received)
+    except Exception as e:
+        log_exception(f"_daemon_session_reader: {e}")
+    with _dispatch_lock:
+        _end_session(session, server_out)
 
-            if not line:
-                break
+def _end_session(session, server_out):
+    """
+    An Origin detached: cancel its requests and close the documents no other
+    Origin has open. Call with _dispatch_lock held.
+    """
+    global _daemon_idle_since
+    with _sessions_lock:
+        if session not in _sessions:
+            return
+        _sessions.remove(session)
+        still_open = set().union(*(other.documents for other in _sessions))
+        if not _sessions:
+            _daemon_idle_since = time.monotonic()
+        count = len(_sessions)
+    session.close()
+    with _initialize_lock:
+        _initialize_waiters[:] = [waiter for waiter in _initialize_waiters if waiter[0] is not session]
+    # Nobody is left to read the replies, cpptools can stop working on them
+    records = _request_table.take_session(session)
+    for record in records:
+        send_notification(server_out, "$/cancelRequest", {"id": record.cpptools_id}, to_lsp_server=True, lock=_server_stdin_lock)
+    with _latest_interactive_lock:
+        for key in [key for key in _latest_interactive_request if key[2] is session]:
+            _interactive_request_keys.pop(_latest_interactive_request.pop(key), None)
+    for uri in session.documents - still_open:
+        forward_to_lsp_server(server_out, {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didClose",
+            "params": {"textDocument": {"uri": uri}},
+        })
+    _trace_log("[Daemon] %s detached, %d sessions, %d requests cancelled", session.name, count, len(records), level=LOG_INFO)
 
-            text = line.decode("utf-8", errors="replace").rstrip()
-            _trace_log(f"[LSP Server stderr]: {text}")
-            send_notification(
-                client_out,
-                method="cpptools/stderr",
-                params={
-                    "message": text,
-                    "timestamp": time.time()
-                }
-                , to_lsp_server=False,
-                lock=_client_stdout_lock
-            )
-    except Exception as e:
-        log_exception(f"handle_lsp_server_stderr: {e}")
-        # Don't necessarily shutdown on stderr error, but logging it is good
-        pass
+def _answer_initialize_waiters(msg):
+    """cpptools answered the first initialize, answer the Origins that attached meanwhile."""
+    global _initialize_result
+    with _initialize_lock:
+        _initialize_result = msg.get("result")
+        waiters = list(_initialize_waiters)
+        _initialize_waiters.clear()
+    for session, client_id in waiters:
+        session.send(_make_response(client_id, _initialize_result))
+
+def _handle_daemon_initialize(msg, inject_queue):
+    """The first Origin's initialize goes to cpptools, later ones are answered with its result."""
+    with _initialize_lock:
+        if _origin_initialize_params is None:
+            return _handle_origin_initialize(msg, inject_queue)
+        if _initialize_result is None:
+            _initialize_waiters.append((_current_session(), msg.get("id")))
+            return []
+    send_to_client(_make_response(msg.get("id"), _initialize_result))
+    return []
+
+def _handle_daemon_initialized(msg, inject_queue):
+    if _cpptools_configured:
+        return []
+    return _handle_origin_initialized(msg, inject_queue)
+
+def _handle_daemon_shutdown(msg, inject_queue):
+    # cpptools keeps serving the other Origins
+    send_to_client(_make_response(msg.get("id"), None))
+    return []
+
+def _handle_daemon_exit(msg, inject_queue):
+    # The session's reader sees the connection closed and ends the session
+    _current_session().close()
+    return []
+
+def _handle_daemon_textDocument_didOpen(msg, inject_queue):
+    """cpptools is sent a document once, however many Origins open it."""
+    uri = msg.get("params", {}).get("textDocument", {}).get("uri")
+    session = _current_session()
+    open_elsewhere = any(uri in other.documents for other in _all_sessions() if other is not session)
+    session.documents.add(uri)
+    if open_elsewhere:
+        return []
+    return _handle_origin_textDocument_didOpen(msg, inject_queue)
+
+def _handle_daemon_textDocument_didClose(msg, inject_queue):
+    uri = msg.get("params", {}).get("textDocument", {}).get("uri")
+    _current_session().documents.discard(uri)
+    if any(uri in other.documents for other in _all_sessions()):
+        return []
+    return None
+
+# Replace the Origin hooks in the daemon
+_daemon_method_handlers = {
+    "initialize": _handle_daemon_initialize,
+    "initialized": _handle_daemon_initialized,
+    "shutdown": _handle_daemon_shutdown,
+    "exit": _handle_daemon_exit,
+    "textDocument/didOpen": _handle_daemon_textDocument_didOpen,
+    "textDocument/didClose": _handle_daemon_textDocument_didClose,
+}
 
 ###############################################################################
 # Logging (NEVER stdout)
 ###############################################################################
-def log_to_file(file, msg):
-    try:
-        with get_log_lock():
-            with open(file, "a", encoding="utf-8") as f:
-                ts = time.strftime("%H:%M:%S") + f".{int(time.time() * 1000) % 1000:03d}"
-                f.write(f"\n[{ts}] {msg}\n")
-    except Exception:
-        pass
+LOG_ERROR = 40
+LOG_WARNING = 30
+LOG_INFO = 20
+LOG_DEBUG = 10
+# Full message payloads, only logged when OCLSP_LOG_LEVEL=trace
+LOG_TRACE = 5
+
+_LOG_LEVEL_NAMES = {
+    "error": LOG_ERROR,
+    "warning": LOG_WARNING,
+    "info": LOG_INFO,
+    "debug": LOG_DEBUG,
+    "trace": LOG_TRACE,
+}
+
+_log_level = LOG_DEBUG
+# Longest message written as-is, longer ones are cut (0 = no limit)
+_log_max_msg_chars = 8192
+_log_writer = None
+
+def _format_log_line(ts, msg):
+    stamp = time.strftime("%H:%M:%S", time.localtime(ts)) + f".{int(ts * 1000) % 1000:03d}"
+    return f"\n[{stamp}] {msg}\n"
+
+class _LogWriter:
+    """
+    Background sink for trace/log messages. Callers only enqueue; this thread
+    keeps oclsp_proxy.log open, writes in batches and rotates it by size, so
+    logging costs the proxy threads no file I/O and no lock.
+    """
+    def __init__(self, path, to_file, to_debugger, max_bytes, backups):
+        self._path = path
+        self._to_file = to_file
+        self._to_debugger = to_debugger
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._file = None
+        self._size = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="oclsp-log", daemon=True)
+        self._thread.start()
+
+    def write(self, ts, msg):
+        self._queue.put((ts, msg))
+
+    def close(self, timeout=2.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _open(self):
+        try:
+            self._file = open(self._path, "a", encoding="utf-8", errors="replace")
+            self._size = self._file.tell()
+        except OSError:
+            self._file = None
+            self._to_file = False
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        try:
+            if self._backups > 0:
+                for i in range(self._backups - 1, 0, -1):
+                    src = f"{self._path}.{i}"
+                    if os.path.exists(src):
+                        os.replace(src, f"{self._path}.{i + 1}")
+                os.replace(self._path, f"{self._path}.1")
+            else:
+                os.remove(self._path)
+        except OSError:
+            pass
+        self._open()
+
+    def _emit(self, ts, msg):
+        if self._to_debugger:
+            trace_impl(msg)
+        if self._to_file:
+            if self._file is None:
+                self._open()
+                if self._file is None:
+                    return
+            line = _format_log_line(ts, msg)
+            self._file.write(line)
+            self._size += len(line)
+            if self._max_bytes and self._size >= self._max_bytes:
+                self._rotate()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 256:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = False
+            for record in batch:
+                if record is None:
+                    stop = True
+                    continue
+                try:
+                    self._emit(*record)
+                except Exception:
+                    pass
+            if self._file is not None:
+                try:
+                    self._file.flush()
+                except Exception:
+                    pass
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
 
 def log_exception(where):
     try:
         with get_log_lock():
             with open(os.path.join(_DATASTORAGE_DIR, "OCLSP", "oclsp_proxy_error.log"), "a", encoding="utf-8") as f:
-                ts = time.strftime("%H:%M:%S") + f".{int(time.time() * 1000) % 1000:03d}"
-                f.write(f"\n[{ts}] {where}\n")
+                f.write(_format_log_line(time.time(), where))
+                import traceback
                 traceback.print_exc(file=f)
     except Exception:
         pass
+    _trace_log("%s", where, level=LOG_ERROR)
     # Send window/logMessage to client
+    import traceback
     msg = f"Error: {where}, traceback:\n{traceback.format_exc()}"
     log_msg = {
         "type": 1,  # Error = 1
         "message": f"[OCLSP] {msg}"
     }
     try:
-        send_notification(sys.stdout.buffer, "window/logMessage", params=log_msg, to_lsp_server=False, lock=_client_stdout_lock)
+        send_notification(_client_out or sys.stdout.buffer, "window/logMessage", params=log_msg, to_lsp_server=False, lock=_client_stdout_lock)
     except Exception:
         pass
 
-def trace_log_noop(msg):
+def trace_log_noop(msg, *args, level=LOG_DEBUG):
     pass
 
-_trace = trace_log_noop
-_log = trace_log_noop
 _trace_log = trace_log_noop
 
+def _log_enabled(level=LOG_DEBUG):
+    """True if a message at `level` would be written; guards costly arguments."""
+    return _trace_log is not trace_log_noop and level >= _log_level
+
 def trace_impl(msg):
+    import ctypes
     ctypes.windll.kernel32.OutputDebugStringW(msg)
 
-def log_impl(msg):
-    log_to_file(os.path.join(_DATASTORAGE_DIR, "OCLSP", "oclsp_proxy.log"), msg)
+def trace_log_impl(msg, *args, level=LOG_DEBUG):
+    """
+    Log `msg % args` at `level`. Formatting is deferred until the level
+    check passes, so pass payloads as arguments rather than in an f-string.
+    """
+    if level < _log_level:
+        return
+    if args:
+        try:
+            msg = msg % args
+        except Exception:
+            msg = f"{msg} {args!r}"
+    if _log_max_msg_chars and len(msg) > _log_max_msg_chars:
+        msg = f"{msg[:_log_max_msg_chars]}... ({len(msg) - _log_max_msg_chars} more chars)"
+    _log_writer.write(time.time(), "[OCLSP] " + msg + "\n")
+
+def _env_int(name, default):
+    """An integer environment variable, `default` if it is unset or not an integer."""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _start_logging(enable_trace, enable_log, name="oclsp_proxy.log"):
+    global _trace_log, _log_writer, _log_level, _log_max_msg_chars
+    _log_level = _LOG_LEVEL_NAMES.get(os.environ.get("OCLSP_LOG_LEVEL", "debug").strip().lower(), LOG_DEBUG)
+    _log_max_msg_chars = _env_int("OCLSP_LOG_MAX_MSG_CHARS", _log_max_msg_chars)
+    if not (enable_trace or enable_log):
+        _trace_log = trace_log_noop
+        return
+    _log_writer = _LogWriter(
+        os.path.join(_DATASTORAGE_DIR, "OCLSP", name),
+        to_file=enable_log,
+        to_debugger=enable_trace,
+        max_bytes=_env_int("OCLSP_LOG_MAX_BYTES", 10 * 1024 * 1024),
+        backups=_env_int("OCLSP_LOG_BACKUPS", 3),
+    )
+    _trace_log = trace_log_impl
+
+def _stop_logging():
+    global _trace_log
+    if _log_writer is not None:
+        _trace_log = trace_log_noop
+        _log_writer.close()
+
+###############################################################################
+# Traffic capture (OCLSP_CAPTURE)
+###############################################################################
+
+# Recorded directions: frames read from Origin and cpptools, frames written to them
+CAPTURE_DIRECTIONS = ("fromOrigin", "toServer", "fromServer", "toOrigin")
+
+class _CaptureWriter:
+    """
+    Records every frame in both directions to a session file for
+    benchmarks/replay.py. Like _LogWriter, callers only enqueue a copy of the
+    body; a background thread does the file I/O.
+
+    The file is JSON lines: a header object, then one
+    {"t": seconds since start, "dir": direction, "body": text} per frame.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, "wb")
+        self._start = time.perf_counter()
+        self._queue = queue.SimpleQueue()
+        header = {
+            "oclspCapture": 1,
+            "started": time.time(),
+            "orgVersion": _ORG_VERSION,
+            "engine": os.environ.get("OCLSP_ENGINE", "thread"),
+        }
+        self._file.write(json_dumps(header) + b"\n")
+        self._thread = threading.Thread(target=self._run, name="oclsp-capture", daemon=True)
+        self._thread.start()
+
+    def frame(self, direction, parts):
+        self._queue.put((time.perf_counter() - self._start, direction, b"".join(parts)))
+
+    def close(self, timeout=2.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            t, direction, body = record
+            line = {"t": round(t, 6), "dir": direction, "body": body.decode("utf-8", errors="replace")}
+            try:
+                self._file.write(json_dumps(line) + b"\n")
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception:
+                pass
+        self._file.close()
+
+_capture = None
+
+def _capture_frame(direction, *parts):
+    # Callers test _capture first so that not capturing costs nothing; read
+    # it once here since _stop_capture() may clear it from another thread
+    capture = _capture
+    if capture is not None:
+        capture.frame(direction, parts)
+
+def _start_capture():
+    """OCLSP_CAPTURE=true records to OCLSP/oclsp_session_<time>.jsonl, any other value is the path."""
+    global _capture
+    value = os.environ.get("OCLSP_CAPTURE", "").strip()
+    if not value or value.lower() == "false":
+        return
+    if value.lower() == "true":
+        name = time.strftime("oclsp_session_%Y%m%d_%H%M%S.jsonl")
+        value = os.path.join(_DATASTORAGE_DIR, "OCLSP", name)
+    try:
+        _capture = _CaptureWriter(value)
+        _trace_log("Capturing traffic to %s", value, level=LOG_INFO)
+    except OSError as e:
+        _trace_log("Error opening capture file %s: %s", value, e, level=LOG_WARNING)
 
-def trace_log_impl(msg):
-    msg = "[OCLSP] " + msg + "\n"
-    _trace(msg)
-    _log(msg)
+def _stop_capture():
+    global _capture
+    capture, _capture = _capture, None
+    if capture is not None:
+        capture.close()
 
 ###############################################################################
 # Main
@@ -919,7 +4207,7 @@ def trigger_shutdown(reason):
         _shutdown_event.set()
         
         msg = f"Triggering shutdown: {reason}"
-        if reason != "EOF from Origin client":
+        if reason not in ("EOF from Origin client", _DAEMON_IDLE_REASON):
             log_exception(msg)
         _trace_log(msg)  # Also log to main trace/log file so it's visible
         
@@ -934,10 +4222,17 @@ def trigger_shutdown(reason):
             except Exception:
                 pass
 
-def main(cpptools_path):
+        for callback in _shutdown_callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+def main(cpptools_path, daemon=False):
     global _enable_log, _enable_trace, _enable_cpptools_trace
-    global _cpptools_process
+    global _cpptools_process, _daemon, _daemon_idle_since
     global _ORGDIR_EXE, _ORGDIR_UFF, _ORGDIR_USER_APPDATA
+    global _stats_file
     _enable_log = os.environ.get("OCLSP_LOG", "False").lower() == "true"
     _enable_trace = os.environ.get("OCLSP_TRACE", "False").lower() == "true"
     _enable_cpptools_trace = os.environ.get("OCLSP_CPPTOOLS_TRACE", "False").lower() == "true"
@@ -951,60 +4246,99 @@ def main(cpptools_path):
     global _CUR_VER_OCLSP_CONFIG_JSON_PATH
     _CUR_VER_OCLSP_CONFIG_JSON_PATH = os.path.join(_DATASTORAGE_DIR, "OCLSP", "OCLSP_User.json")
 
-    global _trace_log, _trace, _log
-    _trace = trace_impl if _enable_trace else trace_log_noop
-    _log = log_impl if _enable_log else trace_log_noop
-    _trace_log = trace_log_impl if (_enable_trace or _enable_log) else trace_log_noop
-    _trace_log("Starting up..")
+    _daemon = daemon
+    if daemon:
+        _stats_file = "oclsp_daemon_stats.json"
+    _start_logging(_enable_trace, _enable_log, "oclsp_daemon.log" if daemon else "oclsp_proxy.log")
+    _trace_log("Starting up as the shared daemon.." if daemon else "Starting up..")
     
     global _CPPTOOLS_PATH
     _CPPTOOLS_PATH = cpptools_path
     global _ORG_VERSION
     _ORG_VERSION = float(os.environ.get("ORG_VER", "10.0"))
+    if not daemon and _shared_enabled() and _run_shared_client(cpptools_path):
+        # The daemon has the request and cache counters, it writes its own file
+        _stats_file = None
+        return
+    listener = None
+    if daemon:
+        listener = _daemon_listen()
+        if listener is None:
+            return
+        _origin_method_handlers.update(_daemon_method_handlers)
+        _daemon_idle_since = time.monotonic()
+        _shutdown_callbacks.append(listener.close)
+        _shutdown_callbacks.append(lambda: [session.close() for session in _all_sessions()])
+    _start_capture()
+    global _client_out
+    _client_out = sys.stdout.buffer
 
-    _cpptools_process = subprocess.Popen(
-        [cpptools_path, "--stdio"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        bufsize=0
-    )
+    engine = os.environ.get("OCLSP_ENGINE", "thread").strip().lower()
+    # The daemon serves its sessions from threads
+    if engine == "asyncio" and not daemon:
+        import asyncio
+        _trace_log("Using asyncio engine")
+        try:
+            asyncio.run(_async_main(cpptools_path))
+        except KeyboardInterrupt:
+            trigger_shutdown("KeyboardInterrupt")
+        return
+
+    _cpptools_process = _spawn_cpptools(cpptools_path)
+    _mark_startup("cpptools spawned")
+    _trace_log("JSON backend: %s", _json_backend())
+    # Read the payload templates and the symbol index while cpptools starts up
+    _cpptools_payloads()
+    _start_symbol_index()
 
+    server_out = _ServerPipe(_cpptools_process.stdin)
     injected_msg_queue = queue.Queue()
 
     threads = [
-        threading.Thread(
-            target=origin_client_to_lsp_server,
-            args=(sys.stdin.buffer, _cpptools_process.stdin, injected_msg_queue),
-            daemon=True
-        ),
-        threading.Thread(
-            target=lsp_server_to_origin_client,
-            args=(_cpptools_process.stdout, sys.stdout.buffer),
-            daemon=True
-        ),
         threading.Thread(
             target=msg_injection_to_lsp_server,
-            args=(_cpptools_process.stdin, injected_msg_queue),
-            daemon=True
-        ),
-        threading.Thread(
-            target=handle_lsp_server_stderr,
-            args=(_cpptools_process.stderr, sys.stdout.buffer),
+            args=(server_out, injected_msg_queue),
             daemon=True
         ),
     ]
+    if daemon:
+        threads.append(threading.Thread(
+            target=_accept_sessions,
+            args=(listener, server_out, injected_msg_queue),
+            daemon=True
+        ))
+    else:
+        threads.append(threading.Thread(
+            target=origin_client_to_lsp_server,
+            args=(sys.stdin.buffer, server_out, injected_msg_queue),
+            daemon=True
+        ))
 
     for t in threads:
         t.start()
+    _start_server_threads(_cpptools_process)
 
     # Wait for cpptools to exit or shutdown signal
+    next_sweep = time.monotonic() + _REQUEST_SWEEP_INTERVAL
+    next_config_check = time.monotonic() + _CONFIG_CHECK_INTERVAL
     while True:
         try:
+            if time.monotonic() >= next_sweep:
+                _expire_requests(server_out)
+                next_sweep = time.monotonic() + _REQUEST_SWEEP_INTERVAL
+            if time.monotonic() >= next_config_check:
+                _check_config(injected_msg_queue)
+                _activate_idle_workspaces(injected_msg_queue)
+                if daemon and _daemon_idle_expired():
+                    trigger_shutdown(_DAEMON_IDLE_REASON)
+                next_config_check = time.monotonic() + _CONFIG_CHECK_INTERVAL
+
             # Check if process has exited
             code = _cpptools_process.poll()
             if code is not None:
-                _trace_log(f"cpptools exited with code {code}")
+                _trace_log("cpptools exited with code %s", code)
+                if _restart_cpptools(cpptools_path, server_out, code):
+                    continue
                 trigger_shutdown(f"cpptools exited with code {code}")
                 break
             
@@ -1025,10 +4359,19 @@ def main(cpptools_path):
             trigger_shutdown(f"Main loop exception: {e}")
             break
 
+    _trace_log("[Requests] %s", _request_table.stats(), level=LOG_INFO)
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        cpptools_path = sys.argv[1]
+    # OCLSP.py [--daemon] <cpptools path>, or python -OO -m OCLSP ... as AfterInstall.py sets it up
+    daemon = sys.argv[1:2] == ["--daemon"]
+    args = sys.argv[2:] if daemon else sys.argv[1:]
+    if args:
+        cpptools_path = args[0]
         try:
-            main(cpptools_path)
+            main(cpptools_path, daemon)
         except Exception as e:
             log_exception("Caught exception in main")
+        finally:
+            _stop_capture()
+            _dump_metrics()
+            _stop_logging()
@@ -0,0 +1,130 @@
+"""
+Go to Definition right after Code Builder starts, while cpptools is still
+indexing, with and without the proxy's symbol index of the OriginC headers.
+
+A generated OriginC folder (--headers headers, each declaring functions,
+macros, a class and an enum) stands in for ORGDIR_EXE\\OriginC. OCLSP.py runs
+against benchmarks/mock_cpptools.py with --index-delay, which holds the mock
+up on the OriginC properties the way indexing does and then reports its tag
+parser done. A document calling one of the functions is opened and F11 is
+pressed on the call 50 ms after initialized, with:
+
+  off    symbolIndex false in OCLSP_User.json, the request waits for cpptools
+  cold   no index stored yet, it is built while cpptools starts; F11 comes
+         before it is done, so cpptools' empty reply is filled from it
+  warm   the index stored by the previous run is loaded
+
+Building, refreshing and loading the index are timed in-process as well.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--headers 400] [--index-delay 2]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+import mock_cpptools
+import OCLSP
+from replay import LspProcess
+from bench_restart import Client
+
+OPEN_DELAY = 0.05
+FUNCTIONS_PER_HEADER = 50
+
+
+def write_headers(root, count):
+    os.makedirs(os.path.join(root, "system"), exist_ok=True)
+    for h in range(count):
+        lines = [f"/* header {h} */", f"#ifndef _HEADER{h}_H", f"#define _HEADER{h}_H"]
+        lines += [f"#define HEADER{h}_FLAG{k} {k}" for k in range(10)]
+        lines += [f"class Object{h} : public OriginObject", "{", "public:", "\tint GetIndex();", "};"]
+        lines += [f"enum {{ H{h}_FIRST, H{h}_SECOND = 2 }};"]
+        lines += [f"int WINAPI api{h}_function{k}(LPCSTR lpcszName, int nIndex = 0);" for k in range(FUNCTIONS_PER_HEADER)]
+        lines.append("#endif")
+        with open(os.path.join(root, "system", f"header{h}.h"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def start_proxy(launcher, workdir):
+    env = dict(os.environ, OCLSP_ENGINE="thread", ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35")
+    env.pop("OCLSP_CAPTURE", None)
+    env.pop("OCLSP_CONFIG_JSON_PATH", None)
+    env.pop("OCLSP_SHARED", None)
+    return LspProcess([sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher], env)
+
+
+def go_to_definition(launcher, workdir, name):
+    """(seconds from F11 to its reply, whether it had a location)"""
+    proxy = start_proxy(launcher, workdir)
+    client = Client(proxy)
+    try:
+        client.request("initialize", {})
+        client.notify("initialized", {})
+        time.sleep(OPEN_DELAY)
+        uri = Path(workdir, "OriginC", "cold.c").as_uri()
+        client.notify("textDocument/didOpen", {"textDocument": {
+            "uri": uri, "languageId": "cpp", "version": 1, "text": f"void f()\n{{\n    {name}(\"Book1\");\n}}\n"}})
+        start = time.perf_counter()
+        reply = client.request("textDocument/definition", {"textDocument": {"uri": uri}, "position": {"line": 2, "character": 8}})
+        elapsed = time.perf_counter() - start
+        return elapsed, bool((reply or {}).get("result"))
+    finally:
+        proxy.close()
+
+
+def time_index(root, workdir):
+    start = time.perf_counter()
+    files, _ = OCLSP._scan_headers(root, {})
+    build = time.perf_counter() - start
+    path = os.path.join(workdir, "symbols.json")
+    with open(path, "wb") as f:
+        f.write(OCLSP.json_dumps({"version": OCLSP._SYMBOL_INDEX_VERSION, "files": files}))
+    start = time.perf_counter()
+    stored = OCLSP._load_stored_symbols(path)
+    index = OCLSP._SymbolIndex(stored)
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    OCLSP._scan_headers(root, stored)
+    refresh = time.perf_counter() - start
+    return index.count, len(files), build, load, refresh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--headers", type=int, default=400)
+    parser.add_argument("--index-delay", type=float, default=2.0, metavar="SECONDS",
+                        help="time the mock spends per cpptools/didChangeCppProperties")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        oclsp_dir = os.path.join(workdir, "OCLSP")
+        os.makedirs(oclsp_dir)
+        root = os.path.join(workdir, "OriginC")
+        write_headers(root, args.headers)
+        launcher = mock_cpptools.make_launcher(workdir, ["--index-delay", str(args.index_delay)])
+        name = f"api{args.headers // 2}_function{FUNCTIONS_PER_HEADER // 2}"
+
+        symbols, headers, build, load, refresh = time_index(root, workdir)
+        print(f"{symbols} symbols in {headers} headers: build {build * 1000:.1f} ms, "
+              f"load stored {load * 1000:.1f} ms, refresh unchanged {refresh * 1000:.1f} ms")
+
+        print(f"index delay {args.index_delay:.3f}s")
+        print(f"{'index':<8} {'F11 ms':>10} {'location':>10}")
+        user_config = os.path.join(oclsp_dir, "OCLSP_User.json")
+        for mode in ("off", "cold", "warm"):
+            with open(user_config, "w", encoding="utf-8") as f:
+                json.dump({"symbolIndex": mode != "off"}, f)
+            elapsed, found = go_to_definition(launcher, workdir, name)
+            print(f"{mode:<8} {elapsed * 1000:10.1f} {str(found):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Measure the documentSymbol path on a large OriginC source.
+
+Builds the symbol tree cpptools would return for a synthetic source of
+--lines lines (structs with nested members, free functions with locals) and
+times, on identical copies of it:
+
+  * the previous recursive _flatten_symbols (kept here as reference)
+  * the current iterative OCLSP._flatten_symbols
+  * the full cpptools reply handler, cold and answered from the cache
+
+It then checks both flatteners on a tree nested deeper than the recursion
+limit.
+
+Usage:
+    python benchmarks/bench_document_symbols.py [--lines 20000] [--repeat 20]
+"""
+import argparse
+import copy
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import OCLSP
+
+URI = "file:///C:/OriginC/bench.c"
+
+
+def legacy_flatten_symbols(symbols, parent_name=None):
+    flat_list = []
+    for sym in symbols:
+        if parent_name:
+            sym['detail'] = parent_name
+        else:
+            detail = sym.get('detail')
+            if detail is None or not isinstance(detail, str):
+                sym['detail'] = ""
+        children = sym.pop('children', [])
+        flat_list.append(sym)
+        if children:
+            flat_list.extend(legacy_flatten_symbols(children, sym.get('name', '')))
+    return flat_list
+
+
+def make_range(line, length):
+    return {"start": {"line": line, "character": 0}, "end": {"line": line + length, "character": 1}}
+
+
+def symbol(name, kind, line, length, children=None):
+    sym = {"name": name, "kind": kind, "detail": None,
+           "range": make_range(line, length), "selectionRange": make_range(line, 0)}
+    if children:
+        sym["children"] = children
+    return sym
+
+
+def symbol_tree(lines):
+    """About one symbol every three lines, nested up to three levels."""
+    symbols = []
+    line = 0
+    index = 0
+    while line < lines:
+        if index % 4 == 0:
+            members = [symbol(f"m_{index}_{k}", 8, line + 1 + k, 0) for k in range(12)]
+            inner = symbol(f"Inner{index}", 23, line + 13, 6,
+                           [symbol(f"x_{index}_{k}", 8, line + 14 + k, 0) for k in range(4)])
+            symbols.append(symbol(f"Struct{index}", 23, line, 20, members + [inner]))
+            line += 21
+        else:
+            locals_ = [symbol(f"v_{index}_{k}", 13, line + 2 + k, 0) for k in range(6)]
+            symbols.append(symbol(f"Function{index}", 12, line, 24, locals_))
+            line += 25
+        index += 1
+    return symbols
+
+
+def nested_tree(depth):
+    root = current = symbol("Level0", 23, 0, depth)
+    for level in range(1, depth):
+        child = symbol(f"Level{level}", 23, level, depth - level)
+        current["children"] = [child]
+        current = child
+    return [root]
+
+
+def count_symbols(symbols):
+    total = 0
+    stack = list(symbols)
+    while stack:
+        sym = stack.pop()
+        total += 1
+        stack.extend(sym.get("children", ()))
+    return total
+
+
+def best_of(fn, make_arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        arg = make_arg()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            # Keep the result alive so freeing the symbols isn't timed
+            result = fn(arg)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+        del arg, result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    tree = symbol_tree(args.lines)
+    print(f"{args.lines} lines, {count_symbols(tree)} symbols")
+
+    # Flattening is what old Origin versions get; force it for the handler too
+    OCLSP._ORG_VERSION = 10.30
+    OCLSP._client_out = open(os.devnull, "wb")
+    document = OCLSP._OpenDocument(URI, 1, "")
+    OCLSP._open_documents[URI] = document
+
+    def reply():
+        return {"jsonrpc": "2.0", "id": 1, "result": {"symbols": copy.deepcopy(tree)}}
+
+    def request():
+        return {"jsonrpc": "2.0", "id": 1, "method": "textDocument/documentSymbol",
+                "params": {"textDocument": {"uri": URI}}}
+
+    def cold(msg):
+        OCLSP._handle_lsp_documentSymbol(msg, None)
+        return msg
+
+    def cached(msg):
+        OCLSP._handle_origin_textDocument_documentSymbol(msg, None)
+
+    OCLSP._handle_lsp_documentSymbol(reply(), (URI, document.version))
+
+    rows = [
+        ("legacy recursive flatten", best_of(legacy_flatten_symbols, lambda: copy.deepcopy(tree), args.repeat)),
+        ("iterative flatten", best_of(OCLSP._flatten_symbols, lambda: copy.deepcopy(tree), args.repeat)),
+        ("reply handler, cold", best_of(cold, reply, args.repeat)),
+        ("request answered from cache", best_of(cached, request, args.repeat)),
+    ]
+    for name, seconds in rows:
+        print(f"{name:<30} {seconds * 1000:9.3f} ms")
+
+    depth = sys.getrecursionlimit() * 2
+    for name, flatten in (("legacy", legacy_flatten_symbols), ("iterative", OCLSP._flatten_symbols)):
+        try:
+            outcome = f"{len(flatten(nested_tree(depth)))} symbols"
+        except RecursionError:
+            outcome = "RecursionError"
+        print(f"{name} flatten, depth {depth}: {outcome}")
+
+
+if __name__ == "__main__":
+    main()
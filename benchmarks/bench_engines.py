@@ -0,0 +1,106 @@
+"""
+Latency comparison of the threaded and asyncio proxy engines.
+
+Runs OCLSP.py against benchmarks/mock_cpptools.py for each OCLSP_ENGINE and
+measures ping-pong hover round trips (latency) and a pipelined burst of
+completion requests (throughput). The mock answers instantly, so the numbers
+are proxy plus pipe overhead.
+
+Usage:
+    python benchmarks/bench_engines.py [--requests 500]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+
+
+class ProxyClient:
+    """Plays Origin: talks LSP to an OCLSP.py subprocess."""
+    def __init__(self, launcher, env):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.next_id = 1
+
+    def send(self, method, params, request=True):
+        msg = {"jsonrpc": "2.0", "method": method, "params": params}
+        msg_id = None
+        if request:
+            msg_id = msg["id"] = self.next_id
+            self.next_id += 1
+        mock_cpptools.write_message(self.proc.stdin, json.dumps(msg).encode("utf-8"))
+        return msg_id
+
+    def receive(self):
+        """Next response, skipping notifications such as cpptools/stderr."""
+        while True:
+            body = mock_cpptools.read_message(self.proc.stdout)
+            if body is None:
+                raise EOFError("proxy closed stdout")
+            msg = json.loads(body)
+            if "id" in msg and "method" not in msg:
+                return msg
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait(timeout=10)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_engine(engine, launcher, workdir, count):
+    env = dict(os.environ, OCLSP_ENGINE=engine, ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35")
+    client = ProxyClient(launcher, env)
+    client.send("initialize", {})
+    client.receive()
+    client.send("initialized", {}, request=False)
+    uri = "file:///mock/test.c"
+    client.send("textDocument/didOpen", {"textDocument": {"uri": uri, "version": 1, "text": "Worksheet wks;\n"}}, request=False)
+
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        client.send("textDocument/hover", {"textDocument": {"uri": uri}, "position": {"line": 0, "character": i % 9}})
+        client.receive()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(count):
+        client.send("textDocument/definition", {"textDocument": {"uri": uri}, "position": {"line": 0, "character": i % 9}})
+    for _ in range(count):
+        client.receive()
+    burst = time.perf_counter() - start
+    client.close()
+    return latencies, burst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "OCLSP"), exist_ok=True)
+        launcher = mock_cpptools.make_launcher(workdir)
+        print(f"{'engine':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'burst req/s':>12}")
+        for engine in ("thread", "asyncio"):
+            latencies, burst = run_engine(engine, launcher, workdir, args.requests)
+            mean = sum(latencies) / len(latencies)
+            print(f"{engine:>8} {percentile(latencies, 50) * 1000:8.3f} {percentile(latencies, 99) * 1000:8.3f} "
+                  f"{mean * 1000:8.3f} {args.requests / burst:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
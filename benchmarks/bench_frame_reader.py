@@ -0,0 +1,114 @@
+"""
+Throughput benchmark for LSP framing.
+
+Streams multi-megabyte LSP messages through an unbuffered OS pipe, the same
+way main() opens cpptools' stdout (bufsize=0), and compares the legacy
+readline()/`data += chunk` reader with OCLSP.LspFrameReader.
+
+Usage:
+    python benchmarks/bench_frame_reader.py [--size-mb 4] [--count 20]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import OCLSP
+
+
+def legacy_read_exactly(stream, n):
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def legacy_read_lsp_message(stream):
+    headers = {}
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line_str = line.decode("ascii", errors="replace").strip()
+        if line_str == "":
+            break
+        if ":" in line_str:
+            key, value = line_str.split(":", 1)
+            headers[key.lower()] = value.strip()
+    return legacy_read_exactly(stream, int(headers["content-length"]))
+
+
+def make_frame(size):
+    # Roughly the shape of a large completion/references reply
+    item = b'{"label":"Worksheet_GetColumn","kind":3,"detail":"Column Worksheet::GetColumn(int nCol)"},'
+    body = b'{"jsonrpc":"2.0","id":1,"result":{"isIncomplete":false,"items":['
+    body += item * (size // len(item))
+    body = body[:-1] + b"]}}"
+    header = f"Content-Length: {len(body)}\r\nContent-Type: application/vscode-jsonrpc; charset=utf-8\r\n\r\n"
+    return header.encode("ascii") + body, len(body)
+
+
+def run(read_one, frame, count):
+    r, w = os.pipe()
+    reader_stream = os.fdopen(r, "rb", buffering=0)
+    writer_stream = os.fdopen(w, "wb", buffering=0)
+
+    def writer():
+        view = memoryview(frame)
+        for _ in range(count):
+            pos = 0
+            while pos < len(view):
+                pos += writer_stream.write(view[pos:])
+        writer_stream.close()
+
+    t = threading.Thread(target=writer, daemon=True)
+    start = time.perf_counter()
+    t.start()
+    total = 0
+    for _ in range(count):
+        body = read_one(reader_stream)
+        total += len(body)
+    elapsed = time.perf_counter() - start
+    t.join()
+    reader_stream.close()
+    return total, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--count", type=int, default=20)
+    args = parser.parse_args()
+
+    frame, body_len = make_frame(int(args.size_mb * 1024 * 1024))
+    print(f"{args.count} messages of {body_len / (1024 * 1024):.2f} MB over a raw pipe")
+
+    results = {}
+    total, elapsed = run(legacy_read_lsp_message, frame, args.count)
+    results["legacy readline"] = (total, elapsed)
+
+    def frame_reader_factory():
+        state = {}
+        def read_one(stream):
+            reader = state.get("reader")
+            if reader is None:
+                reader = state["reader"] = OCLSP.LspFrameReader(stream)
+            return reader.read_message()
+        return read_one
+
+    results["LspFrameReader"] = run(frame_reader_factory(), frame, args.count)
+
+    for name, (total, elapsed) in results.items():
+        print(f"{name:>18}: {elapsed:8.3f}s  {total / elapsed / (1024 * 1024):10.1f} MB/s")
+    legacy = results["legacy readline"][1]
+    new = results["LspFrameReader"][1]
+    print(f"speedup: {legacy / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare the JSON backends OCLSP can use (orjson, ujson, stdlib json).
+
+Payloads default to synthetic completion, hover and references replies
+shaped like cpptools' output. Recorded bodies can be benchmarked instead
+with --payload NAME=FILE (the file holds one raw JSON message body).
+
+Usage:
+    python benchmarks/bench_json_codec.py [--repeat 20] [--payload completion=reply.json]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import OCLSP
+
+
+def completion_payload(count=5000):
+    items = []
+    for i in range(count):
+        items.append({
+            "label": f"Worksheet_Method{i}",
+            "kind": 2,
+            "detail": f"int Worksheet::Method{i}(int nCol, LPCSTR lpcszName = NULL)",
+            "documentation": {"kind": "markdown", "value": f"Returns the column **{i}**.\n\n*Origin C* API"},
+            "sortText": f"{i:08d}",
+            "insertText": f"Method{i}",
+            "textEdit": {"range": {"start": {"line": 120, "character": 8}, "end": {"line": 120, "character": 10}},
+                         "newText": f"Method{i}"},
+        })
+    return {"jsonrpc": "2.0", "id": 42, "result": {"isIncomplete": False, "items": items}}
+
+
+def hover_payload():
+    value = "```cpp\nclass Worksheet : public Layer\n```\n" + "Worksheet member documentation line.\n" * 60
+    return {"jsonrpc": "2.0", "id": 43, "result": {
+        "contents": {"kind": "markdown", "value": value},
+        "range": {"start": {"line": 10, "character": 4}, "end": {"line": 10, "character": 13}}}}
+
+
+def references_payload(count=20000):
+    infos = []
+    for i in range(count):
+        infos.append({
+            "file": f"C:\\Program Files\\OriginLab\\Origin2026\\OriginC\\System\\file{i % 400}.c",
+            "position": {"line": i % 3000, "character": i % 80},
+            "text": "    Worksheet wks = Project.ActiveLayer();",
+            "type": i % 7,
+        })
+    return {"jsonrpc": "2.0", "id": 44, "result": {"referenceInfos": infos, "text": "Worksheet"}}
+
+
+def time_call(fn, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--payload", action="append", default=[], metavar="NAME=FILE")
+    args = parser.parse_args()
+
+    stdlib = OCLSP._make_json_codec("json")
+    payloads = {}
+    if args.payload:
+        for spec in args.payload:
+            name, _, path = spec.partition("=")
+            with open(path, "rb") as f:
+                payloads[name] = f.read()
+    else:
+        for name, obj in (("completion", completion_payload()),
+                          ("hover", hover_payload()),
+                          ("references", references_payload())):
+            payloads[name] = stdlib[2](obj)
+
+    codecs = [c for c in (OCLSP._make_json_codec(n) for n in OCLSP._JSON_BACKENDS) if c]
+    missing = [n for n in OCLSP._JSON_BACKENDS if n not in [c[0] for c in codecs]]
+    if missing:
+        print(f"not installed: {', '.join(missing)}")
+    print(f"selected backend: {OCLSP._json_backend()}")
+    print(f"{'payload':>12} {'size':>9} {'backend':>8} {'loads ms':>10} {'dumps ms':>10}")
+    for name, body in payloads.items():
+        view = memoryview(bytearray(body))
+        obj = stdlib[1](body)
+        for codec_name, loads, dumps in codecs:
+            t_loads = time_call(loads, view, args.repeat)
+            t_dumps = time_call(dumps, obj, args.repeat)
+            print(f"{name:>12} {len(body) / 1024:8.0f}K {codec_name:>8} {t_loads * 1000:10.2f} {t_dumps * 1000:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
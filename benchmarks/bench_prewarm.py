@@ -0,0 +1,82 @@
+"""
+The first completion after Code Builder starts, with and without the proxy's
+IntelliSense prewarm.
+
+OCLSP.py runs against benchmarks/mock_cpptools.py with --parse-delay, so the
+first completion the mock gets pays for parsing origin.h and later ones
+don't. After initialized the client waits --idle seconds, the time a user
+takes to open a file and start typing, then opens a document and completes
+in it. With prewarm true in OCLSP_User.json the proxy spends that idle time
+on a throwaway completion in its own document; with --idle 0 the real
+traffic arrives at once and the prewarm is cancelled.
+
+Usage:
+    python benchmarks/bench_prewarm.py [--parse-delay 1] [--idle 1.5]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+from replay import LspProcess
+from bench_restart import Client
+
+
+def start_proxy(launcher, workdir):
+    env = dict(os.environ, OCLSP_ENGINE="thread", ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35")
+    env.pop("OCLSP_CAPTURE", None)
+    env.pop("OCLSP_CONFIG_JSON_PATH", None)
+    env.pop("OCLSP_SHARED", None)
+    return LspProcess([sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher], env)
+
+
+def first_completion(launcher, workdir, idle):
+    """(seconds from the first completion request to its reply, whether it had a result)"""
+    proxy = start_proxy(launcher, workdir)
+    client = Client(proxy)
+    try:
+        client.request("initialize", {})
+        client.notify("initialized", {})
+        time.sleep(idle)
+        uri = Path(workdir, "OriginC", "prewarm.c").as_uri()
+        client.notify("textDocument/didOpen", {"textDocument": {
+            "uri": uri, "languageId": "cpp", "version": 1, "text": "void f()\n{\n    Work\n}\n"}})
+        start = time.perf_counter()
+        reply = client.request("textDocument/completion", {"textDocument": {"uri": uri}, "position": {"line": 2, "character": 8}})
+        elapsed = time.perf_counter() - start
+        return elapsed, "result" in (reply or {})
+    finally:
+        proxy.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parse-delay", type=float, default=1.0, metavar="SECONDS",
+                        help="time the mock spends on its first completion")
+    parser.add_argument("--idle", type=float, default=1.5, metavar="SECONDS",
+                        help="time between initialized and the first didOpen")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        oclsp_dir = os.path.join(workdir, "OCLSP")
+        os.makedirs(oclsp_dir)
+        launcher = mock_cpptools.make_launcher(workdir, ["--parse-delay", str(args.parse_delay)])
+        print(f"parse delay {args.parse_delay:.3f}s")
+        print(f"{'prewarm':<8} {'idle s':>8} {'completion ms':>14} {'result':>8}")
+        for idle in (args.idle, 0.0):
+            for prewarm in (False, True):
+                with open(os.path.join(oclsp_dir, "OCLSP_User.json"), "w", encoding="utf-8") as f:
+                    json.dump({"prewarm": prewarm}, f)
+                elapsed, answered = first_completion(launcher, workdir, idle)
+                print(f"{str(prewarm):<8} {idle:8.2f} {elapsed * 1000:14.1f} {str(answered):>8}")
+
+
+if __name__ == "__main__":
+    main()
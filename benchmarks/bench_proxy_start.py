@@ -0,0 +1,114 @@
+"""
+Cold start of OCLSP.py: a new interpreter each run, timed until the proxy
+has started cpptools and until Origin's initialize is answered.
+
+OCLSP.py and its payload templates are copied to a temporary app folder, as
+the installer leaves them, and run against benchmarks/mock_cpptools.py in
+two ways:
+
+  script   python OCLSP.py, how LSP.json started it before; the script is
+           compiled from source at every start
+  -OO -m   python -OO -m OCLSP with the app folder on PYTHONPATH, after
+           AfterInstall.py compiled it into __pycache__ with optimize=2
+
+"spawn" is "cpptools spawned" from OCLSP\\startup_history.jsonl, counted from
+the process launch (on Linux /proc has 10 ms resolution, so compare medians
+over a few runs). "initialize" is the time from starting the proxy to the
+initialize reply, which includes the mock's own start. --oclsp runs another
+copy of OCLSP.py, e.g. an older one from a git worktree.
+
+Usage:
+    python benchmarks/bench_proxy_start.py [--runs 10] [--oclsp PATH]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import py_compile
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+from replay import LspProcess
+from bench_restart import Client
+
+TEMPLATES = ("cpptools_initialize.json", "cpptools_didChangeCppProperties.json")
+
+
+def install(oclsp, app_dir):
+    """Copy OCLSP.py next to its templates and compile it the way AfterInstall.py does."""
+    os.makedirs(app_dir)
+    shutil.copy(oclsp, os.path.join(app_dir, "OCLSP.py"))
+    for name in TEMPLATES:
+        shutil.copy(os.path.join(REPO_DIR, name), app_dir)
+    source = os.path.join(app_dir, "OCLSP.py")
+    py_compile.compile(source, cfile=importlib.util.cache_from_source(source, optimization=2), doraise=True, optimize=2)
+
+
+def start_once(args, launcher, workdir, pythonpath):
+    """(seconds to the initialize reply, seconds from launch to cpptools spawned or None)"""
+    env = dict(os.environ, OCLSP_ENGINE="thread", ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35")
+    for name in ("OCLSP_CAPTURE", "OCLSP_CONFIG_JSON_PATH", "OCLSP_SHARED", "PYTHONDONTWRITEBYTECODE"):
+        env.pop(name, None)
+    if pythonpath:
+        env["PYTHONPATH"] = pythonpath
+    history = os.path.join(workdir, "OCLSP", "startup_history.jsonl")
+    start = time.perf_counter()
+    proxy = LspProcess(args + [launcher], env)
+    client = Client(proxy)
+    try:
+        if client.request("initialize", {}) is None:
+            return None, None
+        initialize = time.perf_counter() - start
+        client.notify("initialized", {})
+        uri = Path(workdir, "OriginC", "start.c").as_uri()
+        client.notify("textDocument/didOpen", {"textDocument": {
+            "uri": uri, "languageId": "cpp", "version": 1, "text": "void f()\n{\n    Work\n}\n"}})
+        # The first completion ends the startup timeline and writes it to the history
+        client.request("textDocument/completion", {"textDocument": {"uri": uri}, "position": {"line": 2, "character": 8}})
+    finally:
+        proxy.close()
+    try:
+        with open(history, "rb") as f:
+            entry = json.loads(f.read().splitlines()[-1])
+        spawned = entry["steps"].get("cpptools spawned") if entry.get("since") == "launch" else None
+    except (OSError, IndexError, ValueError, KeyError):
+        spawned = None
+    return initialize, spawned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--oclsp", default=os.path.join(REPO_DIR, "OCLSP.py"), metavar="PATH")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "OCLSP"))
+        app_dir = os.path.join(workdir, "app")
+        install(args.oclsp, app_dir)
+        launcher = mock_cpptools.make_launcher(workdir)
+        modes = (
+            ("script", [sys.executable, os.path.join(app_dir, "OCLSP.py")], None),
+            ("-OO -m", [sys.executable, "-OO", "-m", "OCLSP"], app_dir),
+        )
+        print(f"{args.runs} runs, median ms")
+        print(f"{'mode':<8} {'spawn':>8} {'initialize':>11}")
+        for mode, command, pythonpath in modes:
+            results = [start_once(command, launcher, workdir, pythonpath) for _ in range(args.runs)]
+            initialize = [i for i, _ in results if i is not None]
+            spawned = [s for _, s in results if s is not None]
+            spawn_ms = f"{statistics.median(spawned) * 1000:8.0f}" if spawned else f"{'n/a':>8}"
+            initialize_ms = f"{statistics.median(initialize) * 1000:11.0f}" if initialize else f"{'no reply':>11}"
+            print(f"{mode:<8} {spawn_ms} {initialize_ms}")
+
+
+if __name__ == "__main__":
+    main()
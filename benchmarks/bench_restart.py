@@ -0,0 +1,112 @@
+"""
+Crash cpptools under a running OCLSP.py and time how long until requests
+reach it again.
+
+OCLSP.py runs as Origin starts it, against benchmarks/mock_cpptools.py. After
+a document is opened and completed in, a mock/crash request makes the mock
+exit. The proxy should fail that request with ContentModified, start a new
+mock after its backoff (1 s for the first restart, then 2 s, 4 s) and replay
+initialize, the cpptools configuration and the open document. Requests sent
+meanwhile fail with ContentModified; mock/openDocuments is retried until the
+new mock answers it, which also shows whether the document was reopened.
+
+Usage:
+    python benchmarks/bench_restart.py [--engine thread|asyncio] [--crashes 2]
+"""
+import argparse
+import os
+import queue
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+from replay import LspProcess, REPLY_TIMEOUT
+
+RETRY_INTERVAL = 0.05
+
+
+def start_proxy(launcher, workdir, engine):
+    env = dict(os.environ, OCLSP_ENGINE=engine, ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35")
+    env.pop("OCLSP_CAPTURE", None)
+    env.pop("OCLSP_CONFIG_JSON_PATH", None)
+    return LspProcess([sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher], env)
+
+
+class Client:
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.next_id = 1
+
+    def request(self, method, params):
+        """The reply to a request, or None if there was none within REPLY_TIMEOUT."""
+        msg_id = self.next_id
+        self.next_id += 1
+        self.proxy.send({"jsonrpc": "2.0", "id": msg_id, "method": method, "params": params})
+        deadline = time.perf_counter() + REPLY_TIMEOUT
+        while True:
+            try:
+                _, msg = self.proxy.replies.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                return None
+            if msg is None:
+                return None
+            if msg.get("id") == msg_id:
+                return msg
+
+    def notify(self, method, params):
+        self.proxy.send({"jsonrpc": "2.0", "method": method, "params": params})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", default="thread", choices=("thread", "asyncio"))
+    parser.add_argument("--crashes", type=int, default=2, help="crashes in a row, each restart backs off longer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "OCLSP"), exist_ok=True)
+        launcher = mock_cpptools.make_launcher(workdir)
+        proxy = start_proxy(launcher, workdir, args.engine)
+        client = Client(proxy)
+        uri = Path(workdir, "OriginC", "restart.c").as_uri()
+        completion = {"textDocument": {"uri": uri}, "position": {"line": 2, "character": 8}}
+        try:
+            client.request("initialize", {})
+            client.notify("initialized", {})
+            client.notify("textDocument/didOpen", {"textDocument": {
+                "uri": uri, "languageId": "cpp", "version": 1, "text": "void f()\n{\n    Work\n}\n"}})
+            if "result" not in (client.request("textDocument/completion", completion) or {}):
+                print("no completion before the crash")
+                return 1
+
+            for crash in range(1, args.crashes + 1):
+                start = time.perf_counter()
+                reply = client.request("mock/crash", {})
+                error = (reply or {}).get("error", {})
+                print(f"crash {crash}: mock/crash answered with {error.get('code')} {error.get('message')!r}")
+                retries = 0
+                while True:
+                    # Completion could come from the proxy's cache, this has to reach the mock
+                    reply = client.request("mock/openDocuments", {})
+                    if reply is None:
+                        print(f"crash {crash}: the proxy stopped answering (it exits once the restart budget is used up)")
+                        return 1
+                    if "result" in reply:
+                        break
+                    retries += 1
+                    time.sleep(RETRY_INTERVAL)
+                elapsed = time.perf_counter() - start
+                print(f"crash {crash}: cpptools back after {elapsed:.2f}s ({retries} failed retries), "
+                      f"document reopened: {uri in reply['result']}")
+        finally:
+            proxy.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Start a second Origin next to a running one and time how long until its
+first completion reply, with each OCLSP.py running its own cpptools and
+with OCLSP_SHARED=true, where the second attaches to the daemon the first
+one started.
+
+Both run against benchmarks/mock_cpptools.py with --index-delay, so a new
+cpptools pays for indexing OriginC before it answers. Each Origin opens its
+own document; mock/openDocuments, sent by the second one, shows whether both
+ended up in the same cpptools. The daemon exits daemonIdleTimeout seconds
+(set to 1 here) after both are closed.
+
+Usage:
+    python benchmarks/bench_shared.py [--index-delay 0.5] [--runs 3]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+from replay import LspProcess
+from bench_restart import Client
+
+IDLE_TIMEOUT = 1
+OPEN_DELAY = 0.05
+
+
+def start_proxy(launcher, workdir, shared):
+    env = dict(os.environ, OCLSP_ENGINE="thread", ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35",
+               OCLSP_SHARED=str(shared).lower())
+    env.pop("OCLSP_CAPTURE", None)
+    env.pop("OCLSP_CONFIG_JSON_PATH", None)
+    return LspProcess([sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher], env)
+
+
+def open_and_complete(client, uri):
+    """Seconds from initialize to the first completion reply, None if something wasn't answered."""
+    start = time.perf_counter()
+    if client.request("initialize", {}) is None:
+        return None
+    client.notify("initialized", {})
+    # As in bench_startup, the document is opened after the injected messages are on their way
+    time.sleep(OPEN_DELAY)
+    client.notify("textDocument/didOpen", {"textDocument": {
+        "uri": uri, "languageId": "cpp", "version": 1, "text": "void f()\n{\n    Work\n}\n"}})
+    reply = client.request("textDocument/completion", {"textDocument": {"uri": uri}, "position": {"line": 2, "character": 8}})
+    if "result" not in (reply or {}):
+        return None
+    return time.perf_counter() - start
+
+
+def second_instance(launcher, workdir, shared, run):
+    """(seconds to the second Origin's first completion, uris its cpptools has open)"""
+    first = start_proxy(launcher, workdir, shared)
+    second = None
+    try:
+        if open_and_complete(Client(first), Path(workdir, "OriginC", f"first{run}.c").as_uri()) is None:
+            return None, []
+        second = start_proxy(launcher, workdir, shared)
+        client = Client(second)
+        elapsed = open_and_complete(client, Path(workdir, "OriginC", f"second{run}.c").as_uri())
+        reply = client.request("mock/openDocuments", {}) or {}
+        return elapsed, reply.get("result") or []
+    finally:
+        for proxy in (second, first):
+            if proxy is not None:
+                proxy.close()
+        if shared:
+            # Let the daemon exit, the next run starts a new one
+            time.sleep(IDLE_TIMEOUT + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-delay", type=float, default=0.5, metavar="SECONDS",
+                        help="time the mock spends per cpptools/didChangeCppProperties")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"index delay {args.index_delay:.3f}s")
+    print(f"{'mode':<12} {'best ms':>10} {'worst ms':>10} {'documents in its cpptools':>26}")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "OCLSP"), exist_ok=True)
+        with open(os.path.join(workdir, "OCLSP", "OCLSP_User.json"), "w", encoding="utf-8") as f:
+            json.dump({"daemonIdleTimeout": IDLE_TIMEOUT}, f)
+        launcher = mock_cpptools.make_launcher(workdir, ["--index-delay", str(args.index_delay)])
+        for mode, shared in (("standalone", False), ("shared", True)):
+            results = [second_instance(launcher, workdir, shared, run) for run in range(args.runs)]
+            times = [elapsed for elapsed, _ in results if elapsed is not None]
+            documents = max(len(uris) for _, uris in results)
+            if times:
+                print(f"{mode:<12} {min(times) * 1000:10.1f} {max(times) * 1000:10.1f} {documents:>26}")
+            else:
+                print(f"{mode:<12} {'no reply':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Time from Origin's initialized to the first completion reply, with every
+workspace folder configured up front (workspaceActivation "eager", the
+default) and with only OriginC's ("lazy").
+
+OCLSP.py runs as Origin starts it, against benchmarks/mock_cpptools.py with
+--index-delay: each cpptools/didChangeCppProperties holds the mock up for
+that long, the way cpptools indexing a workspace holds up the requests
+behind it. OCLSP_User.json lists --workspaces extra folders; the XFC and
+AppXFC folders are added by OCLSP.py itself. The document that is opened
+and completed in lives in the OriginC folder, it is opened 50 ms after
+initialized.
+
+Usage:
+    python benchmarks/bench_startup.py [--workspaces 5] [--index-delay 0.2] [--runs 3] [--engine thread|asyncio]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+from replay import LspProcess
+
+OPEN_DELAY = 0.05
+
+
+def start_proxy(launcher, workdir, engine):
+    env = dict(os.environ, OCLSP_ENGINE=engine, ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir, ORG_VER="10.35")
+    env.pop("OCLSP_CAPTURE", None)
+    env.pop("OCLSP_CONFIG_JSON_PATH", None)
+    return LspProcess([sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher], env)
+
+
+def write_user_config(workdir, activation, workspaces):
+    folders = [{"uri": os.path.join(workdir, f"Project{i}"), "name": f"Project{i}"} for i in range(workspaces)]
+    with open(os.path.join(workdir, "OCLSP", "OCLSP_User.json"), "w", encoding="utf-8") as f:
+        json.dump({"workspaceActivation": activation, "workspaceFolders": folders}, f)
+
+
+def first_completion(launcher, workdir, engine):
+    """Seconds from initialized to the reply to the first completion, or None if it never came."""
+    proxy = start_proxy(launcher, workdir, engine)
+    try:
+        proxy.send({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}})
+        if proxy.wait_reply(1) is None:
+            return None
+        uri = Path(workdir, "OriginC", "startup.c").as_uri()
+        start = time.perf_counter()
+        proxy.send({"jsonrpc": "2.0", "method": "initialized", "params": {}})
+        # Origin opens the document a moment later, after the injected
+        # messages are on their way to cpptools
+        time.sleep(OPEN_DELAY)
+        proxy.send({"jsonrpc": "2.0", "method": "textDocument/didOpen", "params": {"textDocument": {
+            "uri": uri, "languageId": "cpp", "version": 1, "text": "void f()\n{\n    Work\n}\n"}}})
+        proxy.send({"jsonrpc": "2.0", "id": 2, "method": "textDocument/completion", "params": {
+            "textDocument": {"uri": uri}, "position": {"line": 2, "character": 8}}})
+        arrived = proxy.wait_reply(2)
+        return arrived - start if arrived is not None else None
+    finally:
+        proxy.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workspaces", type=int, default=5, help="extra workspace folders in OCLSP_User.json")
+    parser.add_argument("--index-delay", type=float, default=0.2, metavar="SECONDS",
+                        help="time the mock spends per cpptools/didChangeCppProperties")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--engine", default="thread", choices=("thread", "asyncio"))
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "OCLSP"), exist_ok=True)
+        launcher = mock_cpptools.make_launcher(workdir, ["--index-delay", str(args.index_delay)])
+        for activation in ("eager", "lazy"):
+            write_user_config(workdir, activation, args.workspaces)
+            times = [first_completion(launcher, workdir, args.engine) for _ in range(args.runs)]
+            results[activation] = [t for t in times if t is not None]
+
+    print(f"{args.workspaces} extra workspaces + XFC + AppXFC, index delay {args.index_delay:.3f}s, "
+          f"engine={args.engine}")
+    print(f"{'activation':<12} {'best ms':>10} {'worst ms':>10}")
+    for activation, times in results.items():
+        if times:
+            print(f"{activation:<12} {min(times) * 1000:10.1f} {max(times) * 1000:10.1f}")
+        else:
+            print(f"{activation:<12} {'no reply':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Microbenchmarks for the transforms OCLSP applies to every matching message,
+checked against a committed baseline.
+
+Payloads are generated at the sizes that hurt in practice:
+
+  completion_fix       5k-item completion list through _fix_completion_documentation
+  flatten_symbols      7k symbols, structs nested three levels, through _flatten_symbols
+  flatten_deep         a 5k-level chain through _flatten_symbols
+  references           50k referenceInfos over 400 files through _handle_lsp_references
+  initialize           a full cpptools initialize reply through _handle_lsp_initialize
+  config               global + user OCLSP.json with 300 workspaces each through get_oclsp_config
+  config_check         the periodic look at the same files when they haven't changed
+  initialized          the cpptools/initialize and 301 didChangeCppProperties injected for that config
+  did_change           a one-character edit sent as the full text of a 1.2 MB document, turned into a range edit
+
+Each case is timed as the best of --repeat runs on a fresh copy of its
+payload, with the garbage collector off. A fixed pure-Python workload is
+timed as well and stored with the baseline; --scale divides results by it,
+for a rough comparison against a baseline recorded on another machine. On
+the machine that recorded the baseline, leave it off: the calibration
+workload and the cases don't slow down by the same amount under load.
+
+The run fails (exit code 1) when a case is slower than the baseline by more
+than --threshold (default 25%) and by more than --min-delta ms. A case that
+looks slower is measured again with three times the repeats before it is
+reported, since a busy moment on the machine easily costs 40%.
+
+Usage:
+    python benchmarks/bench_transforms.py [--repeat 15] [--threshold 0.25] [--min-delta 0.05] [--scale]
+    python benchmarks/bench_transforms.py --update-baseline
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import OCLSP
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "transforms_baseline.json")
+
+
+def completion_reply(count=5000):
+    items = []
+    for i in range(count):
+        items.append({
+            "label": f"Worksheet_Method{i}",
+            "kind": 2,
+            "detail": f"int Worksheet::Method{i}(int nCol, LPCSTR lpcszName = NULL)",
+            "documentation": {"kind": "markdown", "value": f"Returns the column **{i}**.\n\n*Origin C* API"},
+            # cpptools' sortText is not in label order
+            "sortText": f"{(i * 7919) % count:08d}",
+            "insertText": f"Method{i}",
+        })
+    return {"jsonrpc": "2.0", "id": 1, "result": {"isIncomplete": False, "items": items}}
+
+
+def symbol(name, kind, line, children=None):
+    rng = {"start": {"line": line, "character": 0}, "end": {"line": line + 1, "character": 1}}
+    sym = {"name": name, "kind": kind, "detail": None, "range": rng, "selectionRange": rng}
+    if children:
+        sym["children"] = children
+    return sym
+
+
+def symbol_tree(structs=500):
+    symbols = []
+    for i in range(structs):
+        inner = symbol(f"Inner{i}", 23, i * 20 + 13, [symbol(f"x_{i}_{k}", 8, i * 20 + 14 + k) for k in range(3)])
+        members = [symbol(f"m_{i}_{k}", 8, i * 20 + 1 + k) for k in range(8)]
+        symbols.append(symbol(f"Struct{i}", 23, i * 20, members + [inner]))
+        symbols.append(symbol(f"Function{i}", 12, i * 20 + 19))
+    return symbols
+
+
+def symbol_chain(depth=5000):
+    root = current = symbol("Level0", 23, 0)
+    for level in range(1, depth):
+        child = symbol(f"Level{level}", 23, level)
+        current["children"] = [child]
+        current = child
+    return [root]
+
+
+def references_reply(count=50000, files=400):
+    root = os.path.abspath(os.sep)
+    infos = []
+    for i in range(count):
+        infos.append({
+            "file": os.path.join(root, "OriginLab", "OriginC", "System", f"file{i % files}.c"),
+            "position": {"line": i % 3000, "character": i % 80},
+            "text": "    Worksheet wks = Project.ActiveLayer();",
+            "type": i % 7,
+        })
+    return {"jsonrpc": "2.0", "id": 3, "result": {"referenceInfos": infos, "text": "Worksheet"}}
+
+
+def initialize_reply():
+    commands = [f"C_Cpp.Command{i}" for i in range(40)]
+    return {"jsonrpc": "2.0", "id": 4, "result": {"capabilities": {
+        "textDocumentSync": {"openClose": True, "change": 2, "save": {"includeText": False}},
+        "completionProvider": {"resolveProvider": False, "triggerCharacters": [".", ">", ":", "#", "\"", "<"]},
+        "signatureHelpProvider": {"triggerCharacters": ["(", ","], "retriggerCharacters": [")"]},
+        "definitionProvider": True, "declarationProvider": True, "renameProvider": True,
+        "documentFormattingProvider": True, "documentRangeFormattingProvider": True,
+        "documentOnTypeFormattingProvider": {"firstTriggerCharacter": "}", "moreTriggerCharacter": [";", "\n"]},
+        "foldingRangeProvider": True, "workspaceSymbolProvider": True,
+        "executeCommandProvider": {"commands": commands},
+        "semanticTokensProvider": {"legend": {"tokenTypes": [f"type{i}" for i in range(30)],
+                                              "tokenModifiers": [f"mod{i}" for i in range(10)]}, "full": True},
+    }}}
+
+
+def big_document(lines=20000):
+    return "".join(f"    int nCol{i} = wks.Columns({i}).GetNumRows(); // {i}\n" for i in range(lines))
+
+
+def write_configs(directory, workspaces=300):
+    def folders(prefix, offset):
+        return [{
+            "uri": f"C:\\Users\\Kenny\\Documents\\OriginLab\\Projects\\{prefix}{i + offset}",
+            "name": f"{prefix}{i + offset}",
+            "includePath": [f"C:\\SDK\\include{k}" for k in range(i % 5 + 1)],
+            "defines": [f"VERSION_{i}", "ORIGIN_C"],
+        } for i in range(workspaces)]
+    # Half the user workspaces repeat global ones, so merging is exercised
+    # Eager, so the initialized case configures every workspace
+    global_config = {"cpptools": "cpptools.exe", "workspaceActivation": "eager", "workspaceFolders": folders("Proj", 0),
+                     "additionalIncludePath": [f"C:\\inc{i}" for i in range(50)]}
+    user_config = {"completionCache": True, "workspaceFolders": folders("Proj", workspaces // 2),
+                   "additionalIncludePath": [f"C:\\user_inc{i}" for i in range(50)]}
+    paths = []
+    for name, config in (("OCLSP.json", global_config), ("OCLSP_User.json", user_config)):
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        paths.append(path)
+    return paths
+
+
+def calibration(_):
+    """Fixed dict/list/string work, standing in for the speed of the machine."""
+    total = 0
+    for i in range(200000):
+        d = {"line": i, "character": i % 80}
+        total += d["line"] + len(str(i))
+    return total
+
+
+def best_of(fn, make_arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        arg = make_arg()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            # Keep the result alive so freeing it isn't timed
+            result = fn(arg)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+        del arg, result
+    return best
+
+
+def cases(workdir):
+    OCLSP._client_out = open(os.devnull, "wb")
+    global_path, user_path = write_configs(workdir)
+
+    def reset_config():
+        OCLSP._GLOBAL_OCLSP_CONFIG = None
+        OCLSP._config_files.clear()
+        OCLSP._GLOBAL_OCLSP_CONFIG_JSON_PATH = global_path
+        OCLSP._CUR_VER_OCLSP_CONFIG_JSON_PATH = user_path
+        return None
+
+    def references_fresh():
+        OCLSP._path_to_uri.cache_clear()
+        return copy.deepcopy(references)
+
+    completion = completion_reply()
+    tree = symbol_tree()
+    references = references_reply()
+    initialize = initialize_reply()
+
+    def run_references(msg):
+        OCLSP._handle_lsp_references(msg, None)
+        return msg
+
+    def run_initialize(msg):
+        OCLSP._handle_lsp_initialize(msg, None)
+        return msg
+
+    class InjectQueue(list):
+        put = list.append
+
+    def initialized_fresh():
+        # The injected requests would otherwise pile up in the request table
+        OCLSP._request_table = OCLSP._RequestTable()
+        return InjectQueue()
+
+    def run_initialized(inject_queue):
+        OCLSP._handle_origin_initialized({"jsonrpc": "2.0", "method": "initialized", "params": {}}, inject_queue)
+        return inject_queue
+
+    uri = "file:///C:/OriginLab/OriginC/big.c"
+    text = big_document()
+    middle = len(text) // 2
+    edited = text[:middle] + "x" + text[middle:]
+    OCLSP._server_incremental_sync = True
+    OCLSP._open_documents[uri] = OCLSP._OpenDocument(uri, "cpp", 1, text)
+
+    def did_change_fresh():
+        return {"jsonrpc": "2.0", "method": "textDocument/didChange", "params": {
+            "textDocument": {"uri": uri, "version": 2}, "contentChanges": [{"text": edited}]}}
+
+    def run_did_change(msg):
+        OCLSP._handle_origin_textDocument_didChange(msg, None)
+        return msg
+
+    def run_completion(msg):
+        OCLSP._fix_completion_documentation(msg)
+        return msg
+
+    return [
+        ("completion_fix", run_completion, lambda: copy.deepcopy(completion)),
+        ("flatten_symbols", OCLSP._flatten_symbols, lambda: copy.deepcopy(tree)),
+        # Too deep for deepcopy, build a new one each time
+        ("flatten_deep", OCLSP._flatten_symbols, symbol_chain),
+        ("references", run_references, references_fresh),
+        ("initialize", run_initialize, lambda: copy.deepcopy(initialize)),
+        ("config", lambda _: OCLSP.get_oclsp_config(), reset_config),
+        ("config_check", lambda _: OCLSP._reload_oclsp_config(), lambda: None),
+        ("initialized", run_initialized, initialized_fresh),
+        ("did_change", run_did_change, did_change_fresh),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown over the baseline, as a fraction (default 0.25)")
+    parser.add_argument("--min-delta", type=float, default=0.05, metavar="MS",
+                        help="ignore slowdowns smaller than this many ms (default 0.05)")
+    parser.add_argument("--scale", action="store_true", help="scale the baseline by the calibration workload")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="record this run as the baseline")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    case_list = cases(workdir.name)
+    calib = best_of(calibration, lambda: None, args.repeat)
+    results = {name: best_of(fn, make_arg, args.repeat) * 1000 for name, fn, make_arg in case_list}
+    # Once more at the end, in case the CPU was still ramping up at the start
+    calib = min(calib, best_of(calibration, lambda: None, args.repeat))
+
+    if args.update_baseline:
+        workdir.cleanup()
+        baseline = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "jsonBackend": OCLSP._json_backend(),
+            "calibrationMs": round(calib * 1000, 4),
+            "resultsMs": {name: round(ms, 4) for name, ms in results.items()},
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=4)
+            f.write("\n")
+        print(f"calibration {calib * 1000:.3f} ms")
+        for name, ms in results.items():
+            print(f"{name:<18} {ms:10.3f} ms")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except OSError:
+        parser.error(f"no baseline at {args.baseline}, run with --update-baseline first")
+    scale = calib * 1000 / baseline["calibrationMs"] if args.scale else 1.0
+    print(f"calibration {calib * 1000:.3f} ms (baseline {baseline['calibrationMs']:.3f} ms, scale {scale:.2f})")
+    print(f"{'case':<18} {'ms':>10} {'baseline':>10} {'ratio':>7}")
+    failed = []
+    for name, fn, make_arg in case_list:
+        ms = results[name]
+        base = baseline["resultsMs"].get(name)
+        if base is None:
+            print(f"{name:<18} {ms:10.3f} {'-':>10} {'new':>7}")
+            continue
+        base *= scale
+
+        def regressed(ms):
+            # Tiny cases are all timer noise, they need a real slowdown to count
+            return ms / base > 1 + args.threshold and ms - base > args.min_delta
+
+        if regressed(ms):
+            ms = min(ms, best_of(fn, make_arg, args.repeat * 3) * 1000)
+        mark = ""
+        if regressed(ms):
+            failed.append(name)
+            mark = "  REGRESSION"
+        print(f"{name:<18} {ms:10.3f} {base:10.3f} {ms / base:7.2f}{mark}")
+    workdir.cleanup()
+    if failed:
+        print(f"slower than the baseline by more than {args.threshold:.0%}: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
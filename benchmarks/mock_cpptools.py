@@ -0,0 +1,186 @@
+"""
+A small Python stand-in for cpptools.exe, for running OCLSP.py headless.
+
+It speaks LSP over stdio and answers every request immediately with a canned
+result for the method, so whatever latency is measured through the proxy is
+the proxy's (and the pipes') own. With --replay SESSION it answers with the
+replies cpptools gave in a session captured by OCLSP_CAPTURE instead.
+--index-delay SECONDS makes every cpptools/didChangeCppProperties block the
+mock for that long, like cpptools indexing the workspace before it gets to
+the requests queued behind it. After each one the mock reports its tag
+parser done with a cpptools/reportStatus notification. --parse-delay
+SECONDS does the same to the first textDocument/completion, like the first
+IntelliSense parse of origin.h that later ones reuse.
+A mock/crash request makes the mock exit with code 3 without answering, for
+exercising the proxy's cpptools restarts; mock/openDocuments answers with the
+uris it was sent didOpen for.
+
+make_launcher() writes an executable shim that main() can Popen the same way
+it starts cpptools ([path, "--stdio"]).
+"""
+import argparse
+import collections
+import json
+import os
+import stat
+import sys
+import time
+
+CANNED_RESULTS = {
+    "initialize": {"capabilities": {"textDocumentSync": 2, "completionProvider": {"triggerCharacters": [".", ">", ":"]}}},
+    "cpptools/hover": {"contents": {"kind": "markdown", "value": "```cpp\nclass Worksheet : public Layer\n```"}},
+    "textDocument/completion": {"isIncomplete": False, "items": [
+        {"label": name, "kind": 7, "sortText": name} for name in ("Worksheet", "WorksheetPage", "Window", "WindowLayer")
+    ]},
+    "cpptools/getDocumentSymbols": {"symbols": [{"name": "Foo", "kind": 5, "children": [{"name": "bar", "kind": 6}]}]},
+    "cpptools/findAllReferences": {"referenceInfos": [
+        {"file": os.path.abspath("mock.c"), "position": {"line": 1, "character": 2}, "text": "Foo foo;", "type": 0}
+    ]},
+}
+
+
+def read_message(stream):
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        key, _, value = line.partition(b":")
+        if key.strip().lower() == b"content-length":
+            length = int(value)
+    if length is None:
+        return b""
+    return stream.read(length)
+
+
+def write_message(stream, body):
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+def load_session(path):
+    """Read a capture file: returns (header, [(t, direction, body bytes), ...])."""
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        frames = []
+        for line in f:
+            if line.strip():
+                frame = json.loads(line)
+                frames.append((frame["t"], frame["dir"], frame["body"].encode("utf-8")))
+    return header, frames
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class Recording:
+    """
+    The replies cpptools gave in a captured session, matched to the requests
+    the proxy sent it. A replayed request gets the reply recorded for the
+    same method and params, else the next recorded reply for its method
+    (cycling), else a null result.
+    """
+    def __init__(self, frames):
+        requests = {}
+        self._exact = collections.defaultdict(collections.deque)
+        self._by_method = collections.defaultdict(list)
+        self._next = collections.Counter()
+        for _, direction, body in frames:
+            msg = json.loads(body)
+            if direction == "toServer" and "method" in msg and "id" in msg:
+                requests[json.dumps(msg["id"])] = msg
+            elif direction == "fromServer" and "method" not in msg and "id" in msg:
+                request = requests.pop(json.dumps(msg["id"]), None)
+                if request is None:
+                    continue
+                reply = {key: msg[key] for key in ("result", "error") if key in msg}
+                self._exact[(request["method"], _params_key(request.get("params")))].append(reply)
+                self._by_method[request["method"]].append(reply)
+
+    def reply(self, method, params):
+        exact = self._exact.get((method, _params_key(params)))
+        if exact:
+            reply = exact.popleft()
+            exact.append(reply)
+            return reply
+        replies = self._by_method.get(method)
+        if replies:
+            reply = replies[self._next[method] % len(replies)]
+            self._next[method] += 1
+            return reply
+        return {"result": None}
+
+
+def serve(results=None, stdin=None, stdout=None, recording=None, index_delay=0.0, parse_delay=0.0):
+    results = CANNED_RESULTS if results is None else results
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    open_documents = []
+    while True:
+        body = read_message(stdin)
+        if body is None:
+            return
+        if not body:
+            continue
+        msg = json.loads(body)
+        method = msg.get("method")
+        if method == "exit":
+            return
+        if method == "mock/crash":
+            os._exit(3)
+        if method == "cpptools/didChangeCppProperties":
+            if index_delay:
+                time.sleep(index_delay)
+            write_message(stdout, json.dumps({"jsonrpc": "2.0", "method": "cpptools/reportStatus",
+                                              "params": {"status": "Workspace Parsing done"}}).encode("utf-8"))
+        if method == "textDocument/completion" and parse_delay:
+            time.sleep(parse_delay)
+            parse_delay = 0.0
+        if method == "textDocument/didOpen":
+            open_documents.append(msg["params"]["textDocument"]["uri"])
+        if "id" in msg and method is not None:
+            reply = {"jsonrpc": "2.0", "id": msg["id"]}
+            if method == "mock/openDocuments":
+                reply["result"] = open_documents
+            elif recording is not None:
+                reply.update(recording.reply(method, msg.get("params")))
+            else:
+                reply["result"] = results.get(method)
+            write_message(stdout, json.dumps(reply).encode("utf-8"))
+
+
+def make_launcher(directory, extra_args=()):
+    """
+    Write an executable that runs this mock with the current interpreter and
+    return its path (POSIX only, the harness runs headless on Linux).
+    """
+    path = os.path.join(directory, "cpptools")
+    args = " ".join(f'"{a}"' for a in extra_args)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" {args} "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for cpptools.exe")
+    parser.add_argument("--replay", metavar="SESSION", help="answer from a session captured with OCLSP_CAPTURE")
+    parser.add_argument("--index-delay", type=float, default=0.0, metavar="SECONDS",
+                        help="time each cpptools/didChangeCppProperties takes")
+    parser.add_argument("--parse-delay", type=float, default=0.0, metavar="SECONDS",
+                        help="time the first textDocument/completion takes")
+    # OCLSP.py starts cpptools with --stdio
+    args, _ = parser.parse_known_args()
+    recording = None
+    if args.replay:
+        _, frames = load_session(args.replay)
+        recording = Recording(frames)
+    serve(recording=recording, index_delay=args.index_delay, parse_delay=args.parse_delay)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Replay an Origin session through OCLSP.py and report what the proxy adds.
+
+The session is a file captured with OCLSP_CAPTURE (see README), or, with
+--synthetic N, a generated one: a document is opened and N hover,
+completion, definition, documentSymbol and references requests are sent,
+with an edit every few requests. OCLSP.py runs as Origin starts it, against
+benchmarks/mock_cpptools.py, which answers instantly from the recording
+(canned results for --synthetic).
+
+Two passes are made over the Origin messages, each with a fresh proxy:
+
+  * ping-pong: every request waits for its reply, giving p50/p99 latency
+    per method. "added" subtracts the round trip of talking to the mock
+    directly, i.e. what the proxy costs on top of the pipes
+  * burst: everything is sent back to back while replies are drained,
+    giving throughput
+
+Runs headless on Linux (and anywhere else with a POSIX shell).
+
+Usage:
+    python benchmarks/replay.py SESSION.jsonl [--engine thread|asyncio]
+    python benchmarks/replay.py --synthetic 2000 [--engine asyncio]
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_cpptools
+
+REPLY_TIMEOUT = 10.0
+
+
+class LspProcess:
+    """An LSP peer over a subprocess' stdio, with replies collected by a reader thread."""
+    def __init__(self, args, env=None):
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.replies = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            body = mock_cpptools.read_message(self.proc.stdout)
+            if body is None:
+                self.replies.put((time.perf_counter(), None))
+                return
+            msg = json.loads(body)
+            if "id" in msg and "method" not in msg:
+                self.replies.put((time.perf_counter(), msg))
+
+    def send(self, msg):
+        mock_cpptools.write_message(self.proc.stdin, json.dumps(msg).encode("utf-8"))
+
+    def wait_reply(self, msg_id):
+        """Time the reply to msg_id arrived, or None if it never did."""
+        deadline = time.perf_counter() + REPLY_TIMEOUT
+        while True:
+            try:
+                arrived, msg = self.replies.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                return None
+            if msg is None:
+                return None
+            if msg.get("id") == msg_id:
+                return arrived
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def session_messages(frames):
+    """Origin's requests and notifications, without replies to cpptools or the shutdown sequence."""
+    messages = []
+    for _, direction, body in frames:
+        if direction != "fromOrigin":
+            continue
+        msg = json.loads(body)
+        if "method" in msg and msg["method"] not in ("shutdown", "exit"):
+            messages.append(msg)
+    return messages
+
+
+def synthetic_messages(count):
+    uri = "file:///mock/OriginC/replay.c"
+    lines = [f"void Function{i}(Worksheet& wks, int nCol) {{ wks.Columns(nCol).SetName(\"c{i}\"); }}"
+             for i in range(200)]
+    messages = [
+        {"jsonrpc": "2.0", "id": 0, "method": "initialize", "params": {}},
+        {"jsonrpc": "2.0", "method": "initialized", "params": {}},
+        {"jsonrpc": "2.0", "method": "textDocument/didOpen",
+         "params": {"textDocument": {"uri": uri, "languageId": "cpp", "version": 1, "text": "\n".join(lines)}}},
+    ]
+    methods = ("textDocument/hover", "textDocument/completion", "textDocument/definition",
+               "textDocument/documentSymbol", "textDocument/references")
+    version = 1
+    for i in range(count):
+        if i and i % 10 == 0:
+            version += 1
+            line = i % len(lines)
+            messages.append({"jsonrpc": "2.0", "method": "textDocument/didChange", "params": {
+                "textDocument": {"uri": uri, "version": version},
+                "contentChanges": [{"range": {"start": {"line": line, "character": 0},
+                                              "end": {"line": line, "character": 0}}, "text": " "}]}})
+        method = methods[i % len(methods)]
+        params = {"textDocument": {"uri": uri}, "position": {"line": i % len(lines), "character": 5 + i % 30}}
+        if method == "textDocument/documentSymbol":
+            del params["position"]
+        elif method == "textDocument/references":
+            params["context"] = {"includeDeclaration": True}
+        messages.append({"jsonrpc": "2.0", "id": i + 1, "method": method, "params": params})
+    return messages
+
+
+def renumber(messages):
+    """Give requests fresh ids so a recording with reused ids still pairs up."""
+    ids = {}
+    counter = itertools.count(1)
+    out = []
+    for msg in messages:
+        msg = json.loads(json.dumps(msg))
+        if "id" in msg:
+            new_id = next(counter)
+            ids[json.dumps(msg["id"])] = new_id
+            msg["id"] = new_id
+        elif msg["method"] == "$/cancelRequest":
+            msg["params"]["id"] = ids.get(json.dumps(msg["params"].get("id")), -1)
+        out.append(msg)
+    return out
+
+
+def start_proxy(launcher, workdir, engine, org_version):
+    env = dict(os.environ, OCLSP_ENGINE=engine, ORGDIR_USER_APPDATA=workdir, ORGDIR_EXE=workdir,
+               ORG_VER=str(org_version))
+    env.pop("OCLSP_CAPTURE", None)
+    return LspProcess([sys.executable, os.path.join(REPO_DIR, "OCLSP.py"), launcher], env)
+
+
+def ping_pong(proxy, messages):
+    latencies = {}
+    lost = 0
+    for msg in messages:
+        start = time.perf_counter()
+        proxy.send(msg)
+        if "id" not in msg:
+            continue
+        arrived = proxy.wait_reply(msg["id"])
+        if arrived is None:
+            lost += 1
+            continue
+        latencies.setdefault(msg["method"], []).append(arrived - start)
+    return latencies, lost
+
+
+def burst(proxy, messages):
+    if messages and messages[0]["method"] == "initialize":
+        # Startup isn't throughput, get it out of the way first
+        proxy.send(messages[0])
+        proxy.wait_reply(messages[0]["id"])
+        messages = messages[1:]
+    expected = sum(1 for msg in messages if "id" in msg)
+    sender = threading.Thread(target=lambda: [proxy.send(msg) for msg in messages])
+    start = time.perf_counter()
+    sender.start()
+    received = 0
+    while received < expected:
+        try:
+            _, msg = proxy.replies.get(timeout=REPLY_TIMEOUT)
+        except queue.Empty:
+            break
+        if msg is None:
+            break
+        received += 1
+    elapsed = time.perf_counter() - start
+    sender.join()
+    return received, elapsed
+
+
+def direct_round_trips(launcher, count):
+    """Round trips to the mock without the proxy: the pipe cost the proxy can't avoid."""
+    mock = LspProcess([launcher, "--stdio"])
+    times = []
+    # The first few include interpreter warm-up, don't count them
+    for i in range(-20, count):
+        start = time.perf_counter()
+        mock.send({"jsonrpc": "2.0", "id": i, "method": "cpptools/hover",
+                   "params": {"textDocument": {"uri": "file:///mock/a.c"}, "position": {"line": 0, "character": 0}}})
+        arrived = mock.wait_reply(i)
+        if arrived is not None and i >= 0:
+            times.append(arrived - start)
+    mock.close()
+    return times
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("session", nargs="?", help="session file captured with OCLSP_CAPTURE")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="replay N generated requests instead")
+    parser.add_argument("--engine", default="thread", choices=("thread", "asyncio"))
+    args = parser.parse_args()
+    if not args.session and not args.synthetic:
+        parser.error("give a session file or --synthetic N")
+
+    if args.session:
+        header, frames = mock_cpptools.load_session(args.session)
+        messages = session_messages(frames)
+        org_version = header.get("orgVersion", 10.35)
+        mock_args = ["--replay", os.path.abspath(args.session)]
+    else:
+        messages = synthetic_messages(args.synthetic)
+        org_version = 10.35
+        mock_args = []
+    messages = renumber(messages)
+    requests = sum(1 for msg in messages if "id" in msg)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "OCLSP"), exist_ok=True)
+        launcher = mock_cpptools.make_launcher(workdir, mock_args)
+
+        baseline = direct_round_trips(launcher, min(max(requests, 100), 1000))
+        base_p50, base_p99 = percentile(baseline, 50), percentile(baseline, 99)
+
+        proxy = start_proxy(launcher, workdir, args.engine, org_version)
+        latencies, lost = ping_pong(proxy, messages)
+        proxy.close()
+
+        proxy = start_proxy(launcher, workdir, args.engine, org_version)
+        received, elapsed = burst(proxy, messages)
+        proxy.close()
+
+    print(f"{len(messages)} messages, {requests} requests, engine={args.engine}")
+    print(f"direct to mock: p50 {base_p50 * 1000:.3f} ms, p99 {base_p99 * 1000:.3f} ms")
+    print(f"{'method':<32} {'count':>6} {'p50 ms':>8} {'p99 ms':>8} {'added p50':>10} {'added p99':>10}")
+    for method in sorted(latencies):
+        values = latencies[method]
+        p50, p99 = percentile(values, 50), percentile(values, 99)
+        print(f"{method:<32} {len(values):>6} {p50 * 1000:8.3f} {p99 * 1000:8.3f} "
+              f"{(p50 - base_p50) * 1000:10.3f} {(p99 - base_p99) * 1000:10.3f}")
+    if lost:
+        print(f"{lost} requests got no reply within {REPLY_TIMEOUT:.0f}s")
+    print(f"burst: {received} replies in {elapsed:.3f}s after initialize, {received / elapsed:.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()